@@ -0,0 +1,2 @@
+# Catalog-driven crawl engine for RedBus route pages.
+# Run `python -m crawler --help` for usage.
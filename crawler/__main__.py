@@ -0,0 +1,3 @@
+from crawler.engine import main
+
+main()
@@ -0,0 +1,265 @@
+import argparse
+import base64
+import json
+import os
+import time
+from datetime import datetime
+
+from crawler.blocking import read_performance_log
+from crawler.lookup import LookupStats
+from crawler.scraper import scroll_and_load, to_bus_details
+
+# The bus list is rendered from JSON search responses the route page
+# fetches. With Chrome's performance log on, those responses can be picked
+# out of the network events and their bodies read over the DevTools
+# protocol, so trips come straight from JSON without reading elements. The
+# first response holds the first page of buses; the page fetches the rest as
+# the list is scrolled, so the list is still scrolled to the end and every
+# search response read.
+
+SEARCH_API_PATTERNS = ('/search/SearchResults', '/search/SearchV4Results', '/search/searchresults')
+
+# Candidate keys per field; the first one present in a trip wins
+TRIP_KEYS = {
+    'bus_name': ('Tvs', 'travelsName', 'operatorName', 'travels'),
+    'bus_type': ('bt', 'busType', 'busTypeName'),
+    'departure': ('dt', 'departureTime', 'depTime'),
+    'arrival': ('at', 'arrivalTime', 'arrTime'),
+    'duration': ('dur', 'duration', 'journeyDuration'),
+    'fare': ('minfr', 'frLst', 'fare', 'minFare', 'fares'),
+    'seats': ('nsa', 'availableSeats', 'avlSeats', 'seatsAvailable'),
+    'rating': ('rt', 'totRt', 'rating', 'busRating'),
+}
+
+INVENTORY_KEYS = ('inv', 'inventories', 'buses', 'busList', 'data')
+# Trip count for the whole route-date, over every page
+TOTAL_KEYS = ('totalBuses', 'totalCount', 'total', 'totalResults')
+
+TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%d-%b-%Y %H:%M')
+
+PAGE_WAIT = 1   # seconds to wait for a last page still loading once the list stops growing
+
+
+def is_search_response(url):
+    return any(pattern.lower() in url.lower() for pattern in SEARCH_API_PATTERNS)
+
+
+def first_value(trip, field):
+    for key in TRIP_KEYS[field]:
+        if key in trip and trip[key] not in (None, '', []):
+            return trip[key]
+    return None
+
+
+def parse_timestamp(value):
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(str(value), fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def find_inventory(payload):
+    # The trip list sits under one of a few keys, sometimes one level down
+    if isinstance(payload, list):
+        return payload
+    if not isinstance(payload, dict):
+        return []
+    for key in INVENTORY_KEYS:
+        value = payload.get(key)
+        if isinstance(value, list) and value and isinstance(value[0], dict):
+            return value
+        if isinstance(value, dict):
+            nested = find_inventory(value)
+            if nested:
+                return nested
+    return []
+
+
+def search_total(payload):
+    # The route-date's trip count across pages, None when not reported
+    if not isinstance(payload, dict):
+        return None
+    for key in TOTAL_KEYS:
+        if isinstance(payload.get(key), int) and not isinstance(payload[key], bool):
+            return payload[key]
+    for key in INVENTORY_KEYS:
+        if isinstance(payload.get(key), dict):
+            total = search_total(payload[key])
+            if total is not None:
+                return total
+    return None
+
+
+def format_duration(value):
+    # Minutes -> '04h 25m', the same text the bus-item shows
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        minutes = int(value)
+        return f"{minutes // 60:02d}h {minutes % 60:02d}m"
+    return str(value)
+
+
+def format_fare(value):
+    if isinstance(value, list):
+        prices = [float(v) for v in value if str(v).replace('.', '', 1).isdigit()]
+        if not prices:
+            return None
+        value = min(prices)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return f"INR {value:g}"
+
+
+def format_seats(value):
+    # None when the count isn't a number, so the trip is rejected on its own
+    try:
+        seats = int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return f"{seats} Seats available" if seats >= 0 else None
+
+
+def format_rating(value):
+    if isinstance(value, dict):
+        value = value.get('totRt', value.get('rating'))
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return f"{value:g}" if value > 0 else 'New'
+
+
+def parse_search_response(payload):
+    # Returns raw records in the same shape as the DOM extractor's
+    records = []
+    for trip in find_inventory(payload):
+        departure = parse_timestamp(first_value(trip, 'departure'))
+        arrival = parse_timestamp(first_value(trip, 'arrival'))
+        duration = first_value(trip, 'duration')
+        if duration is None and departure and arrival:
+            duration = int((arrival - departure).total_seconds() // 60)
+
+        next_day = None
+        if departure and arrival and arrival.date() != departure.date():
+            next_day = arrival.strftime('%d-%b')
+
+        records.append({
+            'bus_name': first_value(trip, 'bus_name'),
+            'bus_type': first_value(trip, 'bus_type'),
+            'departure_time': departure.strftime('%H:%M') if departure else None,
+            'arrival_time': arrival.strftime('%H:%M') if arrival else None,
+            'duration': format_duration(duration) if duration is not None else None,
+            'ticket_fare': format_fare(first_value(trip, 'fare')),
+            'seats_availability': format_seats(first_value(trip, 'seats')),
+            'rating': format_rating(first_value(trip, 'rating')),
+            'next_day': next_day,
+        })
+    return records
+
+
+def operator_matches(record, operator_filter):
+    # Government buses are listed as '<operator label> - <service number>'
+    name = record.get('bus_name') or ''
+    return name == operator_filter or name.startswith(operator_filter + ' - ')
+
+
+def read_response_body(driver, request_id):
+    body = driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+    text = body['body']
+    if body.get('base64Encoded'):
+        text = base64.b64decode(text).decode('utf-8')
+    return json.loads(text)
+
+
+def wait_for_search_payloads(driver, messages, timeout=15, poll=0.25, read=None):
+    # Collects performance-log messages into `messages` until a search
+    # response not in `read` has finished loading; returns the decoded JSON
+    # bodies of every such response and adds their request ids to `read`
+    read = set() if read is None else read
+    search_requests = set()
+    deadline = time.time() + timeout
+    while True:
+        messages.extend(read_performance_log(driver))
+        finished = set()
+        for message in messages:
+            params = message.get('params', {})
+            if message.get('method') == 'Network.responseReceived' and is_search_response(params['response']['url']):
+                search_requests.add(params['requestId'])
+            elif message.get('method') == 'Network.loadingFinished':
+                finished.add(params.get('requestId'))
+
+        ready = (search_requests & finished) - read
+        if ready or time.time() >= deadline:
+            break
+        time.sleep(poll)
+
+    read.update(ready)
+
+    payloads = []
+    for request_id in ready:
+        try:
+            payloads.append(read_response_body(driver, request_id))
+        except Exception as e:
+            print(f"Could not read search response body: {str(e)}")
+    return payloads
+
+
+def save_payloads(payloads, record_dir, route, onward):
+    os.makedirs(record_dir, exist_ok=True)
+    for index, payload in enumerate(payloads):
+        path = os.path.join(record_dir, f"{route['slug']}_{onward}_{index}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+
+
+def extract_buses_from_api(driver, route, route_name, route_link, onward, messages, record_dir=None, timeout=15):
+    # Returns None when no usable search response was seen, so the caller
+    # can fall back to DOM extraction
+    operator_filter = route['operator_filter'] if route['mode'] == 'govt' else ''
+    if operator_filter.startswith('//'):
+        print(f"{route_name}: operator filter is a page XPath, using DOM extraction")
+        return None
+
+    read = set()
+    payloads = wait_for_search_payloads(driver, messages, timeout, read=read)
+    if not payloads:
+        print(f"{route_name}: search response not seen, falling back to DOM extraction")
+        return None
+    # Later pages load as the list scrolls
+    scroll_and_load(driver)
+    payloads += wait_for_search_payloads(driver, messages, PAGE_WAIT, read=read)
+    if record_dir:
+        save_payloads(payloads, record_dir, route, onward)
+
+    records = [record for payload in payloads for record in parse_search_response(payload)]
+    if operator_filter:
+        records = [record for record in records if operator_matches(record, operator_filter)]
+    if not records:
+        print(f"{route_name}: no trips in search response, falling back to DOM extraction")
+        return None
+
+    stats = LookupStats()
+    buses = []
+    for record in records:
+        stats.record(record)
+        if stats.missing_required(record):
+            continue
+        buses.append(to_bus_details(record, route_name, route_link, onward))
+    print(f"{route_name} (search API): {stats.summary()}")
+    return buses
+
+
+if __name__ == '__main__':
+    # Replay recorded search responses: python -m crawler.api_capture FILE [FILE ...]
+    parser = argparse.ArgumentParser(description="Parse recorded RedBus search responses")
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args()
+    for path in args.files:
+        with open(path, encoding='utf-8') as f:
+            records = parse_search_response(json.load(f))
+        print(f"{path}: {len(records)} trips")
+        for record in records:
+            print(record)
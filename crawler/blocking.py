@@ -0,0 +1,96 @@
+import json
+from collections import Counter
+
+# Crawl browser profile: images, media, fonts and third-party trackers are
+# blocked through the DevTools protocol (Network.setBlockedURLs), and the
+# Chrome performance log is read back to report what each route downloaded
+# and what was kept off the wire. Images are blocked here too rather than
+# with Chrome's images content setting, which drops them before any network
+# event and so left them out of the report.
+
+IMAGE_EXTENSIONS = ['png', 'jpg', 'jpeg', 'gif', 'webp', 'avif', 'svg', 'ico']
+
+BLOCKED_URL_PATTERNS = [
+    # images, with or without a query string (CDN resizing parameters)
+    *[f'*.{extension}' for extension in IMAGE_EXTENSIONS],
+    *[f'*.{extension}?*' for extension in IMAGE_EXTENSIONS],
+    # fonts
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    # media
+    '*.mp4', '*.webm', '*.mp3', '*.m4a', '*.ogg',
+    # ads, analytics and tag managers
+    '*google-analytics.com*', '*googletagmanager.com*', '*googleadservices.com*',
+    '*doubleclick.net*', '*googlesyndication.com*', '*adservice.google.*',
+    '*facebook.net*', '*facebook.com/tr*', '*connect.facebook.*',
+    '*hotjar.com*', '*clarity.ms*', '*criteo.*', '*taboola.com*', '*outbrain.com*',
+    '*moengage.com*', '*branch.io*', '*appsflyer.com*', '*newrelic.com*', '*nr-data.net*',
+]
+
+# Typical transfer size per resource type, used to estimate what a blocked
+# request would have cost (blocked requests never report a size of their own)
+ESTIMATED_BYTES_BY_TYPE = {
+    'Image': 25 * 1024,
+    'Font': 40 * 1024,
+    'Media': 300 * 1024,
+    'Script': 60 * 1024,
+    'XHR': 4 * 1024,
+    'Fetch': 4 * 1024,
+    'Ping': 512,
+    'Other': 8 * 1024,
+}
+
+
+def enable_performance_log(options):
+    # Network events land in the 'performance' log, read with read_performance_log()
+    options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+    return options
+
+
+def enable_blocking(driver, patterns=None):
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns or BLOCKED_URL_PATTERNS})
+
+
+def read_performance_log(driver):
+    # Drains the performance log; every call only returns entries since the last one
+    messages = []
+    for entry in driver.get_log('performance'):
+        try:
+            messages.append(json.loads(entry['message'])['message'])
+        except (KeyError, ValueError):
+            continue
+    return messages
+
+
+def traffic_report(messages):
+    resource_types = {}
+    transferred = 0
+    loaded = 0
+    blocked = Counter()
+    for message in messages:
+        method = message.get('method')
+        params = message.get('params', {})
+        if method == 'Network.requestWillBeSent':
+            resource_types[params.get('requestId')] = params.get('type', 'Other')
+        elif method == 'Network.loadingFinished':
+            transferred += int(params.get('encodedDataLength') or 0)
+            loaded += 1
+        elif method == 'Network.loadingFailed' and params.get('blockedReason'):
+            blocked[params.get('type') or resource_types.get(params.get('requestId'), 'Other')] += 1
+
+    estimated_saved = sum(ESTIMATED_BYTES_BY_TYPE.get(kind, ESTIMATED_BYTES_BY_TYPE['Other']) * count
+                          for kind, count in blocked.items())
+    return {
+        'requests_loaded': loaded,
+        'bytes_transferred': transferred,
+        'requests_blocked': sum(blocked.values()),
+        'blocked_by_type': dict(blocked),
+        'estimated_bytes_saved': estimated_saved,
+    }
+
+
+def format_traffic_report(report):
+    blocked = ', '.join(f"{kind} {count}" for kind, count in sorted(report['blocked_by_type'].items()))
+    return (f"{report['requests_loaded']} requests, {report['bytes_transferred'] / 1024:.0f} KB transferred; "
+            f"blocked {report['requests_blocked']} ({blocked or 'none'}), "
+            f"~{report['estimated_bytes_saved'] / 1024:.0f} KB saved")
@@ -0,0 +1,130 @@
+import csv
+import os
+import re
+import sys
+from urllib.parse import urlsplit, parse_qs
+
+from crawler.catalog import CATALOG_FIELDS
+from crawler.config import CATALOG_PATH
+
+# Rebuilds routes.csv from the legacy per-route scripts (KSRTC/, TSRTC/, ...).
+# Each script hardcodes one route title, one route_link and, for government
+# buses, one operator label; this pulls those out so the engine can drive
+# every route from a single process.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Directories that hold no per-route scripts; hidden ones, __pycache__ and
+# the like are skipped too
+NON_SCRIPT_DIRS = {'crawler', 'tests'}
+
+ROUTE_LINK_RE = re.compile(r'^\w+_route_link\s*=\s*"([^"]+)"', re.M)
+ROUTE_TITLE_RE = re.compile(r"^\w+ = wait\.until\(.*//a\[@title='([^']+)'\]", re.M)
+DIRECTORY_LINK_RE = re.compile(r"^click_element\(driver, \"//a\[normalize-space\(\)='([^']+)'\]", re.M)
+DIRECTORY_PAGE_RE = re.compile(r"^operator_opt1 = wait\.until\(.*//div\[normalize-space\(\)='(\d+)'\]", re.M)
+RTC_PAGE_RE = re.compile(r'^driver\.get\("(https://www\.redbus\.in/online-booking/(?!rtc-directory)[^"]+)"\)', re.M)
+OPERATOR_RE = re.compile(r"//input\[@id='opfilter'\].*?wait\.until\(EC\.presence_of_element_located\(\(By\.XPATH, \"([^\"]+)\"\)\)\)", re.S)
+LABEL_TITLE_RE = re.compile(r"^//label\[@title='([^']+)'\]$")
+
+
+def find_scripts(root):
+    scripts = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(('.', '_')) and d not in NON_SCRIPT_DIRS)
+        if dirpath == root:
+            continue
+        for name in sorted(filenames):
+            if name.endswith('.py'):
+                scripts.append(os.path.join(dirpath, name))
+    return scripts
+
+
+def parse_script(path, root=REPO_ROOT):
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+
+    link_match = ROUTE_LINK_RE.search(source)
+    title_match = ROUTE_TITLE_RE.search(source)
+    if not link_match or not title_match:
+        return None
+
+    route_link = link_match.group(1)
+    parts = urlsplit(route_link)
+    params = {k: v[0] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+
+    rel_path = os.path.relpath(path, root)
+    operator = os.path.splitext(os.path.basename(path))[0]
+    mode = 'private' if operator == 'private' else 'govt'
+    if '/' not in rel_path.replace(os.sep, '/').split('/', 1)[1]:
+        # loose script directly under a corporation folder
+        operator, mode = 'private', 'private'
+
+    # Government scripts narrow the page with the operator filter; keep the
+    # label title where the script used one, otherwise the raw XPath it clicked.
+    operator_filter = ''
+    operator_match = OPERATOR_RE.search(source)
+    if operator_match:
+        xpath = operator_match.group(1)
+        label_match = LABEL_TITLE_RE.match(xpath)
+        operator_filter = label_match.group(1) if label_match else xpath
+
+    directory_url = ''
+    directory_link = ''
+    rtc_page = RTC_PAGE_RE.search(source)
+    if rtc_page:
+        directory_url = rtc_page.group(1)
+    else:
+        directory_match = DIRECTORY_LINK_RE.search(source)
+        directory_link = directory_match.group(1) if directory_match else ''
+    page_match = DIRECTORY_PAGE_RE.search(source)
+
+    return {
+        'corporation': rel_path.replace(os.sep, '/').split('/')[0],
+        'route_name': title_match.group(1),
+        'mode': mode,
+        'operator': operator,
+        'operator_filter': operator_filter,
+        'slug': parts.path.rsplit('/', 1)[-1],
+        'from_city_id': params.get('fromCityId', ''),
+        'to_city_id': params.get('toCityId', ''),
+        'from_city_name': params.get('fromCityName', ''),
+        'to_city_name': params.get('toCityName', ''),
+        'src_country': params.get('srcCountry', ''),
+        'dest_country': params.get('destCountry', ''),
+        'onward': params.get('onward', ''),
+        'directory_url': directory_url,
+        'directory_link': directory_link,
+        'directory_page': page_match.group(1) if page_match else '',
+        'script': rel_path.replace(os.sep, '/'),
+    }
+
+
+def build_catalog(root=REPO_ROOT):
+    routes = []
+    seen = set()
+    for path in find_scripts(root):
+        route = parse_script(path, root)
+        if route is None:
+            print(f"Skipping {path}: no route link found")
+            continue
+        key = (route['corporation'], route['route_name'], route['operator'])
+        if key in seen:
+            print(f"Skipping {path}: duplicate of {key}")
+            continue
+        seen.add(key)
+        routes.append(route)
+    return routes
+
+
+def write_catalog(routes, path=CATALOG_PATH):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CATALOG_FIELDS)
+        writer.writeheader()
+        writer.writerows(routes)
+
+
+if __name__ == '__main__':
+    root = sys.argv[1] if len(sys.argv) > 1 else REPO_ROOT
+    routes = build_catalog(root)
+    write_catalog(routes)
+    print(f"Wrote {len(routes)} routes to {CATALOG_PATH}")
@@ -0,0 +1,198 @@
+import argparse
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+
+import mysql.connector
+
+from crawler import db
+from crawler.config import db_config
+from crawler.normalize import parse_rows
+from crawler.rows import COLUMNS
+from crawler.schema import STAGING_TABLE, is_normalized, merge_into_trips
+
+try:
+    import pandas as pd
+except ImportError:  # only needed to load Parquet files
+    pd = None
+
+# Bulk path for large sweeps. Trips are staged to a TSV file as the crawl
+# goes; at the end the file is sent with LOAD DATA LOCAL INFILE into a
+# temporary staging table and merged with INSERT ... SELECT, into the
+# normalized trips tables or the original bus_routes table, whichever the
+# database has. The server must allow it (local_infile=ON).
+#
+#   python -m crawler --corporation KSRTC --bulk-load
+#   python -m crawler.bulk_load staged.tsv bus_routes.journal.jsonl trips.parquet
+
+LOAD_STAGING = f"""
+LOAD DATA LOCAL INFILE %s INTO TABLE bus_routes_staging
+CHARACTER SET utf8mb4
+FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+LINES TERMINATED BY '\\n'
+({', '.join(COLUMNS)})
+"""
+
+# Original single-table schema: upserts on the trip_key unique index
+MERGE_STAGING = f"""
+INSERT INTO bus_routes ({', '.join(COLUMNS)})
+SELECT {', '.join(COLUMNS)} FROM bus_routes_staging
+ON DUPLICATE KEY UPDATE
+route_link = VALUES(route_link), duration = VALUES(duration), reaching_time = VALUES(reaching_time),
+star_rating = VALUES(star_rating), price = VALUES(price), seats_available = VALUES(seats_available)
+"""
+
+
+def tsv_value(value):
+    # MySQL's default LOAD DATA escaping
+    if value is None:
+        return '\\N'
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    text = str(value)
+    return (text.replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def tsv_line(row):
+    return '\t'.join(tsv_value(value) for value in row) + '\n'
+
+
+class BulkLoader:
+    # Same put()/close() interface as the write-behind queue: put() appends
+    # a route's trips to the staging TSV, close() loads the file
+
+    def __init__(self, path=None, keep=False):
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='bus_routes_', suffix='.tsv')
+            os.close(fd)
+        self.path = path
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.staged = 0
+        self.skipped = 0
+        self.file = None
+
+    def start(self):
+        self.file = open(self.path, 'w', encoding='utf-8', newline='')
+        return self
+
+    def put(self, buses):
+        rows = parse_rows(buses)
+        self.put_rows(rows)
+        with self.lock:
+            self.skipped += len(buses) - len(rows)
+
+    def put_rows(self, rows):
+        with self.lock:
+            self.file.writelines(tsv_line(row) for row in rows)
+            self.staged += len(rows)
+
+    def close(self):
+        self.file.close()
+        if not self.staged:
+            print("Bulk load: nothing staged")
+        else:
+            try:
+                load_tsv(self.path)
+            except mysql.connector.Error as error:
+                # Keep the staged rows so the load can be rerun
+                print(f"Bulk load failed ({error}); staged trips kept in {self.path}, "
+                      f"rerun with `python -m crawler.bulk_load {self.path}`")
+                raise
+            if self.keep:
+                print(f"Staged trips kept in {self.path}")
+        if not self.keep:
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def load_tsv(path):
+    # Loads one staged TSV file; returns the per-load report
+    report = {'file': path, 'bytes': os.path.getsize(path)}
+    started = time.time()
+    connection = mysql.connector.connect(**db_config, allow_local_infile=True)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(STAGING_TABLE)
+
+        cursor.execute(LOAD_STAGING, (os.path.abspath(path),))
+        report['staged'] = cursor.rowcount
+        cursor.execute("SHOW COUNT(*) WARNINGS")
+        report['warnings'] = cursor.fetchone()[0]
+        report['load_seconds'] = time.time() - started
+
+        merge_started = time.time()
+        normalized = is_normalized(cursor)
+        table = 'trips' if normalized else 'bus_routes'
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        before = cursor.fetchone()[0]
+        if normalized:
+            affected = merge_into_trips(cursor, 'bus_routes_staging', db.crawl_run_id)
+        else:
+            cursor.execute(MERGE_STAGING)
+            affected = cursor.rowcount
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        # Affected rows count 1 per insert and 2 per changed existing row
+        report['inserted'] = cursor.fetchone()[0] - before
+        report['updated'] = (affected - report['inserted']) // 2
+        report['unchanged'] = report['staged'] - report['inserted'] - report['updated']
+        connection.commit()
+        report['merge_seconds'] = time.time() - merge_started
+
+        cursor.execute("DROP TEMPORARY TABLE bus_routes_staging")
+        cursor.close()
+    except mysql.connector.Error as error:
+        connection.rollback()
+        if getattr(error, 'errno', None) in (1148, 2068, 3948):
+            print("LOAD DATA LOCAL is disabled; set local_infile=ON on the MySQL server")
+        raise
+    finally:
+        connection.close()
+
+    report['total_seconds'] = time.time() - started
+    print(f"Bulk load {os.path.basename(path)}: staged {report['staged']} rows "
+          f"({report['bytes'] / 1024:.0f} KB, {report['warnings']} warnings) in {report['load_seconds']:.2f}s, "
+          f"merged into {table} in {report['merge_seconds']:.2f}s: {report['inserted']} inserted, "
+          f"{report['updated']} updated, {report['unchanged']} unchanged")
+    return report
+
+
+def rows_from_file(path):
+    # Bus-route rows from a journal/JSON-lines file of bus dicts, or a
+    # Parquet/CSV file with the bus_routes column names
+    if path.endswith('.jsonl') or path.endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            buses = [json.loads(line) for line in f if line.strip()]
+        return parse_rows(buses, path)
+    if path.endswith('.parquet'):
+        if pd is None:
+            raise ImportError("Reading Parquet needs pandas and pyarrow")
+        frame = pd.read_parquet(path, columns=list(COLUMNS))
+        return [tuple(None if pd.isna(value) else value for value in row)
+                for row in frame.itertuples(index=False)]
+    with open(path, newline='', encoding='utf-8') as f:
+        return [tuple(row[column] for column in COLUMNS) for row in csv.DictReader(f)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk load trips into bus_routes with LOAD DATA LOCAL INFILE")
+    parser.add_argument('files', nargs='+',
+                        help=".tsv staged by --bulk-load FILE, .jsonl bus dicts (e.g. the write-behind "
+                             "journal), or .parquet/.csv with bus_routes columns")
+    args = parser.parse_args()
+
+    for path in args.files:
+        if path.endswith('.tsv'):
+            load_tsv(path)
+            continue
+        with BulkLoader() as loader:
+            loader.put_rows(rows_from_file(path))
@@ -0,0 +1,45 @@
+import csv
+from urllib.parse import quote, urlencode
+
+from crawler.config import BASE_URL, CATALOG_PATH
+
+# Columns of routes.csv, one row per (corporation, route, operator)
+CATALOG_FIELDS = [
+    'corporation', 'route_name', 'mode', 'operator', 'operator_filter',
+    'slug', 'from_city_id', 'to_city_id', 'from_city_name', 'to_city_name',
+    'src_country', 'dest_country', 'onward',
+    'directory_url', 'directory_link', 'directory_page', 'script',
+]
+
+
+def load_routes(path=CATALOG_PATH, corporations=None, mode=None, operators=None, routes=None):
+    selected = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if corporations and row['corporation'] not in corporations:
+                continue
+            if mode and row['mode'] != mode:
+                continue
+            if operators and row['operator'] not in operators:
+                continue
+            if routes and row['route_name'] not in routes:
+                continue
+            selected.append(row)
+    return selected
+
+
+def route_link(route, onward=None):
+    # Rebuild the same bus-tickets URL the legacy scripts hardcoded
+    params = [
+        ('fromCityId', route['from_city_id']),
+        ('toCityId', route['to_city_id']),
+        ('fromCityName', route['from_city_name']),
+        ('toCityName', route['to_city_name']),
+        ('busType', 'Any'),
+    ]
+    if route['src_country']:
+        params.append(('srcCountry', route['src_country']))
+    if route['dest_country']:
+        params.append(('destCountry', route['dest_country']))
+    params.append(('onward', onward or route['onward']))
+    return f"{BASE_URL}/bus-tickets/{route['slug']}?{urlencode(params, quote_via=quote, safe='()')}"
@@ -0,0 +1,54 @@
+import os
+
+# Shared settings for the crawl engine.
+# The legacy per-route scripts each carry their own copy of db_config;
+# the engine reads it from here instead.
+
+# Database connection configuration
+db_config = {
+    'host': 'localhost',  # Usually 'localhost' for phpMyAdmin
+    'user': 'root',
+    'password': '',
+    'database': 'redbus'
+}
+
+BASE_URL = "https://www.redbus.in"
+RTC_DIRECTORY_URL = BASE_URL + "/online-booking/rtc-directory"
+
+# Route catalog shipped next to the engine (regenerate with `python -m crawler.build_catalog`)
+CATALOG_PATH = os.path.join(os.path.dirname(__file__), 'routes.csv')
+
+# Browser pool sizing; override per machine with the environment or CLI flags
+CRAWL_WORKERS = int(os.environ.get('REDBUS_WORKERS', '2'))
+RECYCLE_AFTER_ROUTES = int(os.environ.get('REDBUS_RECYCLE_AFTER', '25'))
+MAX_BROWSER_MEMORY_MB = int(os.environ.get('REDBUS_MAX_BROWSER_MB', '1500'))
+HTTP_WORKERS = int(os.environ.get('REDBUS_HTTP_WORKERS', '16'))
+
+# Database writes: pooled connections shared by the crawl threads, and rows per executemany batch
+DB_POOL_SIZE = int(os.environ.get('REDBUS_DB_POOL_SIZE', '4'))
+DB_BATCH_SIZE = int(os.environ.get('REDBUS_DB_BATCH_SIZE', '500'))
+
+# Write-behind queue between extraction and the database (crawler/write_behind.py).
+# Trips waiting when the database is down are journaled here and replayed later;
+# trips the database rejects on their own go to the dead-letter file.
+WRITE_BEHIND_QUEUE = int(os.environ.get('REDBUS_WRITE_QUEUE', '10000'))
+WRITE_BEHIND_WRITERS = int(os.environ.get('REDBUS_DB_WRITERS', '2'))
+JOURNAL_PATH = os.environ.get('REDBUS_JOURNAL', 'bus_routes.journal.jsonl')
+DEAD_LETTER_PATH = os.environ.get('REDBUS_DEAD_LETTER', 'bus_routes.dead.jsonl')
+
+# Daily partitions of trips (crawler/partitions.py): days to create ahead of
+# today, and days of departures to keep (unset keeps every day)
+PARTITION_DAYS_AHEAD = int(os.environ.get('REDBUS_PARTITION_AHEAD', '35'))
+PARTITION_RETENTION_DAYS = (int(os.environ['REDBUS_PARTITION_RETENTION'])
+                            if os.environ.get('REDBUS_PARTITION_RETENTION') else None)
+
+# Storage backend for trips (crawler/storage.py): mysql, sqlite or duckdb.
+# The path is the embedded database file; the dashboard can read from a
+# different backend than the crawler writes to.
+STORAGE_BACKEND = os.environ.get('REDBUS_STORAGE', 'mysql')
+STORAGE_PATH = os.environ.get('REDBUS_STORAGE_PATH')
+DASHBOARD_STORAGE = os.environ.get('REDBUS_DASHBOARD_STORAGE', STORAGE_BACKEND)
+
+# Parquet lake of crawled trips (crawler/lake.py). When set, every crawl run
+# is appended to it as it finishes.
+LAKE_PATH = os.environ.get('REDBUS_LAKE_PATH')
@@ -0,0 +1,123 @@
+import argparse
+from datetime import datetime, timedelta
+
+from crawler.config import db_config
+
+# Seat and price curves from trip_snapshots (see schema.py): one point per
+# crawl run that saw the trip, rebuilt from the stored deltas with a running
+# sum. Snapshots are clustered on (trip_id, crawl_run_id), so a trip's whole
+# history is one contiguous range read however many runs it spans.
+#
+#   python -m crawler.curves trip 1234 1235
+#   python -m crawler.curves route "Kozhikode to Bangalore" --onward 29-Jul-2024
+
+CHUNK_SIZE = 500    # trip ids per query
+
+# The window must see every snapshot of a trip for the sums to be right,
+# so filter by trip only; narrow by time on the result
+CURVE_QUERY = """
+SELECT s.trip_id, s.crawl_run_id, c.started_at, s.minutes_to_departure,
+       SUM(s.seats_delta) OVER (PARTITION BY s.trip_id ORDER BY s.crawl_run_id) AS seats_available,
+       SUM(s.price_delta) OVER (PARTITION BY s.trip_id ORDER BY s.crawl_run_id) AS price_paise
+FROM trip_snapshots s
+JOIN crawl_runs c ON c.id = s.crawl_run_id
+WHERE s.trip_id IN ({placeholders})
+ORDER BY s.trip_id, s.crawl_run_id"""
+
+# Trips of one route on one onward date; a prefix of uq_trip
+ROUTE_TRIPS_QUERY = """
+SELECT t.id, t.departing_time, IF(t.service_no = '', o.name, CONCAT(o.name, ' - ', t.service_no)), b.name
+FROM trips t
+JOIN routes r ON r.id = t.route_id
+JOIN operators o ON o.id = t.operator_id
+JOIN bus_types b ON b.id = t.bus_type_id
+WHERE r.route_name = %s AND t.onward = %s
+ORDER BY t.departing_time"""
+
+
+def trip_curves(cursor, trip_ids):
+    # {trip_id: [point, ...]} in crawl order; a point is a dict of crawl_run_id,
+    # started_at, minutes_to_departure, seats_available and price
+    curves = {trip_id: [] for trip_id in trip_ids}
+    trip_ids = list(curves)
+    for start in range(0, len(trip_ids), CHUNK_SIZE):
+        chunk = trip_ids[start:start + CHUNK_SIZE]
+        cursor.execute(CURVE_QUERY.format(placeholders=','.join(['%s'] * len(chunk))), chunk)
+        for trip_id, run_id, started_at, minutes, seats, price_paise in cursor.fetchall():
+            curves[trip_id].append({
+                'crawl_run_id': run_id,
+                'started_at': started_at,
+                'minutes_to_departure': minutes,
+                'seats_available': int(seats),
+                'price': int(price_paise) / 100,
+            })
+    return curves
+
+
+def route_trips(cursor, route_name, onward):
+    # [(trip_id, departing_time, busname, bustype)]
+    if isinstance(onward, str):
+        onward = datetime.strptime(onward, '%d-%b-%Y').date()
+    cursor.execute(ROUTE_TRIPS_QUERY, (route_name, onward))
+    return cursor.fetchall()
+
+
+def route_curves(cursor, route_name, onward):
+    # {trip_id: points} for every trip of a route on one onward date
+    return trip_curves(cursor, [row[0] for row in route_trips(cursor, route_name, onward)])
+
+
+def curve_summary(points):
+    # Sell-through and price movement over the observed part of a curve
+    if not points:
+        return {}
+    first, last = points[0], points[-1]
+    hours = (first['minutes_to_departure'] - last['minutes_to_departure']) / 60
+    seats_sold = first['seats_available'] - last['seats_available']
+    return {
+        'snapshots': len(points),
+        'hours_observed': round(hours, 1),
+        'seats_sold': seats_sold,
+        'seats_per_day': round(seats_sold / hours * 24, 2) if hours > 0 else None,
+        'first_price': first['price'],
+        'last_price': last['price'],
+        'max_price': max(point['price'] for point in points),
+        'price_change_pct': (round((last['price'] - first['price']) / first['price'] * 100, 1)
+                             if first['price'] else None),
+    }
+
+
+def print_curve(label, points):
+    print(f"{label}: {curve_summary(points)}")
+    for point in points:
+        before = timedelta(minutes=point['minutes_to_departure'])
+        print(f"  run {point['crawl_run_id']} {point['started_at']} ({before} before departure): "
+              f"{point['seats_available']} seats, INR {point['price']:.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Seat and price curves from trip_snapshots")
+    parser.add_argument('command', choices=['trip', 'route'])
+    parser.add_argument('args', nargs='+', help="trip: trip ids; route: route title")
+    parser.add_argument('--onward', help="route: onward date, e.g. 29-Jul-2024")
+    args = parser.parse_args()
+
+    import mysql.connector
+
+    connection = mysql.connector.connect(**db_config)
+    try:
+        cursor = connection.cursor()
+        if args.command == 'trip':
+            for trip_id, points in trip_curves(cursor, [int(arg) for arg in args.args]).items():
+                print_curve(f"trip {trip_id}", points)
+        else:
+            route_name = ' '.join(args.args)
+            trips = route_trips(cursor, route_name, args.onward)
+            if not trips:
+                print(f"No trips for {route_name} on {args.onward}")
+            curves = trip_curves(cursor, [row[0] for row in trips])
+            for trip_id, departing_time, busname, bustype in trips:
+                print_curve(f"{departing_time:%H:%M} {busname} ({bustype})", curves[trip_id])
+        cursor.close()
+    finally:
+        connection.close()
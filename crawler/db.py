@@ -0,0 +1,237 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import pooling
+
+from crawler.config import db_config, DB_POOL_SIZE, DB_BATCH_SIZE
+from crawler.schema import STAGING_TABLE, is_normalized, merge_into_trips
+
+
+# Original single-table schema. A rerun refreshes fares, seats and ratings
+# in place once the trip_key unique index exists; before that it appends.
+INSERT_QUERY = """
+INSERT INTO bus_routes
+(route_name, route_link, busname, bustype, departing_time, duration,
+reaching_time, star_rating, price, seats_available)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+route_link = VALUES(route_link), duration = VALUES(duration), reaching_time = VALUES(reaching_time),
+star_rating = VALUES(star_rating), price = VALUES(price), seats_available = VALUES(seats_available)
+"""
+
+# Normalized schema (python -m crawler.schema upgrade): rows are staged in a
+# session temporary table and merged into routes/operators/bus_types/trips
+STAGING_INSERT = """
+INSERT INTO bus_routes_staging
+(route_name, route_link, busname, bustype, departing_time, duration,
+reaching_time, star_rating, price, seats_available)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+pool = None
+pool_lock = threading.Lock()
+normalized = None      # whether bus_routes is the compatibility view, checked once
+crawl_run_id = None    # crawl_runs id stamped on trips written by this process
+
+
+def get_pool():
+    # One pool per process, shared by every crawl thread
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = pooling.MySQLConnectionPool(pool_name='redbus', pool_size=DB_POOL_SIZE, **db_config)
+    return pool
+
+
+@contextmanager
+def pooled_connection(wait=0.05):
+    # Waits for a free connection rather than failing when every one is checked out
+    while True:
+        try:
+            connection = get_pool().get_connection()
+            break
+        except mysql.connector.errors.PoolError:
+            time.sleep(wait)
+    try:
+        yield connection
+    finally:
+        connection.close()  # returns it to the pool
+
+
+# Client error codes for a server that can't be reached or a connection
+# that dropped (CR_CONNECTION_ERROR, CR_CONN_HOST_ERROR, CR_SERVER_GONE_ERROR,
+# CR_SERVER_LOST, CR_SERVER_LOST_EXTENDED). Matched on errno because the
+# error class differs between connectors: the C extension raises a refused
+# connection as a plain DatabaseError.
+CONNECTION_ERRNOS = {2002, 2003, 2006, 2013, 2055}
+
+
+def is_connection_error(error):
+    # Whether an error means the database could not be reached, as opposed
+    # to a bad row or a failed statement (a deadlock, say)
+    if not isinstance(error, mysql.connector.Error):
+        return False
+    if error.errno in CONNECTION_ERRNOS:
+        return True
+    # 'MySQL Connection not available' carries no error code
+    return error.errno == -1 and isinstance(error, (mysql.connector.errors.InterfaceError,
+                                                    mysql.connector.errors.OperationalError))
+
+
+def schema_is_normalized(cursor):
+    global normalized
+    if normalized is None:
+        normalized = is_normalized(cursor)
+    return normalized
+
+
+def write_rows(rows):
+    # One executemany in one transaction; if the batch is rejected, the rows
+    # are retried one by one so a bad row doesn't take the rest with it.
+    # Returns rows written; raises when the database is unreachable (see
+    # is_connection_error).
+    with pooled_connection() as connection:
+        cursor = connection.cursor()
+        try:
+            if schema_is_normalized(cursor):
+                return write_normalized(connection, cursor, rows)
+            return insert_rows(connection, cursor, INSERT_QUERY, rows)
+        finally:
+            cursor.close()
+
+
+def insert_rows(connection, cursor, query, rows, commit=True):
+    try:
+        cursor.executemany(query, rows)
+        written = len(rows)
+    except mysql.connector.Error as error:
+        if is_connection_error(error):
+            raise
+        connection.rollback()
+        print(f"Batch insert of {len(rows)} rows failed ({error}), retrying row by row")
+        written = insert_one_by_one(cursor, query, rows)
+    if commit:
+        connection.commit()
+    return written
+
+
+def insert_one_by_one(cursor, query, rows):
+    written = 0
+    for row in rows:
+        try:
+            cursor.execute(query, row)
+            written += 1
+        except mysql.connector.Error as error:
+            if is_connection_error(error):
+                raise
+            print(f"Failed to insert record into bus_routes table: {error} ({row[0]}, {row[2]})")
+    return written
+
+
+def write_normalized(connection, cursor, rows):
+    # A failed merge is rolled back and raised, not reported as 0 rows
+    # written, so the write-behind queue journals the batch
+    cursor.execute(STAGING_TABLE)
+    cursor.execute("DELETE FROM bus_routes_staging")
+    written = insert_rows(connection, cursor, STAGING_INSERT, rows, commit=False)
+    try:
+        merge_into_trips(cursor, 'bus_routes_staging', crawl_run_id)
+        connection.commit()
+    except mysql.connector.Error as error:
+        connection.rollback()
+        print(f"Failed to merge {written} rows into trips: {error}")
+        raise
+    return written
+
+
+def start_crawl_run(engine, label=None):
+    # Records the run in crawl_runs (normalized schema only) and stamps it
+    # on every trip this process writes from now on
+    global crawl_run_id
+    try:
+        with pooled_connection() as connection:
+            cursor = connection.cursor()
+            if schema_is_normalized(cursor):
+                cursor.execute("INSERT INTO crawl_runs (engine, label, started_at) VALUES (%s, %s, NOW())",
+                               (engine, label))
+                connection.commit()
+                crawl_run_id = cursor.lastrowid
+            cursor.close()
+    except mysql.connector.Error as error:
+        print(f"Could not record the crawl run: {error}")
+    return crawl_run_id
+
+
+def finish_crawl_run():
+    if crawl_run_id is None:
+        return
+    try:
+        with pooled_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("UPDATE crawl_runs SET finished_at = NOW() WHERE id = %s", (crawl_run_id,))
+            connection.commit()
+            cursor.close()
+    except mysql.connector.Error as error:
+        print(f"Could not record the end of crawl run {crawl_run_id}: {error}")
+
+
+class BusRouteWriter:
+    # Buffers buses, parses them a batch at a time (crawler/normalize.py) and
+    # writes them to the configured storage backend (crawler/storage.py)
+    # with executemany, one transaction per flush. Flushes on its own every
+    # `batch_size` buses; use it as a context manager (or call flush()) to
+    # write the rest.
+
+    def __init__(self, batch_size=DB_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.buses = []
+        self.written = 0
+        self.failed = 0
+
+    def add(self, bus_details):
+        self.buses.append(bus_details)
+        if len(self.buses) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        from crawler.normalize import parse_rows
+        from crawler.storage import get_storage
+
+        buses, self.buses = self.buses, []
+        rows = parse_rows(buses)
+        self.failed += len(buses) - len(rows)
+        if not rows:
+            return 0
+        storage = get_storage()
+        try:
+            written = storage.write_rows(rows)
+        except storage.errors as error:
+            print(f"Failed to insert records into bus_routes table: {error}")
+            self.failed += len(rows)
+            return 0
+        self.written += written
+        self.failed += len(rows) - written
+        return written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+
+def insert_bus_routes(buses, batch_size=DB_BATCH_SIZE):
+    # Writes one route's buses in a single transaction; returns rows written
+    with BusRouteWriter(batch_size) as writer:
+        for bus_details in buses:
+            writer.add(bus_details)
+    if buses:
+        print(f"Inserted {writer.written} of {len(buses)} buses for {buses[0]['bus_route_name']}")
+    return writer.written
+
+
+def insert_bus_route(bus_details):
+    # Single-row form, kept for callers that only have one bus
+    return insert_bus_routes([bus_details])
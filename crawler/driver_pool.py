@@ -0,0 +1,148 @@
+import queue
+import threading
+import time
+from selenium import webdriver
+
+from crawler.blocking import enable_blocking, enable_performance_log
+
+try:
+    import psutil
+except ImportError:  # memory-based recycling is skipped without psutil
+    psutil = None
+
+
+def make_driver(headless=True, block_resources=True, capture_network=False):
+    options = webdriver.ChromeOptions()
+    if block_resources or capture_network:
+        enable_performance_log(options)
+    if headless:
+        options.add_argument("--headless=new")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--window-size=1366,2000")
+    driver = webdriver.Chrome(options=options)
+    # Required elements use explicit waits; optional ones must not pay an implicit wait
+    driver.implicitly_wait(0)
+    if block_resources:
+        enable_blocking(driver)
+    elif capture_network:
+        driver.execute_cdp_cmd('Network.enable', {})
+    return driver
+
+
+def driver_memory_mb(driver):
+    # Resident memory of chromedriver plus every Chrome process it spawned
+    if psutil is None:
+        return 0.0
+    try:
+        process = psutil.Process(driver.service.process.pid)
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return total / (1024 * 1024)
+    except (AttributeError, psutil.Error):
+        return 0.0
+
+
+class PooledDriver:
+    # One browser slot in the pool; relaunches Chrome when it has done
+    # `recycle_after` routes or grown past `max_memory_mb`.
+
+    def __init__(self, factory, recycle_after=25, max_memory_mb=1500):
+        self.factory = factory
+        self.recycle_after = recycle_after
+        self.max_memory_mb = max_memory_mb
+        self.driver = None
+        self.routes_done = 0
+        self.launches = 0
+
+    def get(self):
+        if self.driver is None:
+            self.driver = self.factory()
+            self.routes_done = 0
+            self.launches += 1
+        return self.driver
+
+    def route_finished(self):
+        self.routes_done += 1
+        if self.recycle_after and self.routes_done >= self.recycle_after:
+            print(f"Recycling browser after {self.routes_done} routes")
+            self.quit()
+            return
+        if self.max_memory_mb:
+            memory = driver_memory_mb(self.driver)
+            if memory > self.max_memory_mb:
+                print(f"Recycling browser at {memory:.0f} MB")
+                self.quit()
+
+    def route_failed(self):
+        # Keep the browser unless it stopped responding; the next get() starts fresh
+        try:
+            self.driver.current_url
+        except Exception:
+            print("Browser stopped responding, relaunching")
+            self.quit()
+            return
+        self.route_finished()
+
+    def quit(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                print(f"Error closing browser: {str(e)}")
+            self.driver = None
+
+
+class DriverPool:
+    # N browser workers pulling jobs from a shared queue.
+
+    def __init__(self, size=2, recycle_after=25, max_memory_mb=1500, headless=True, block_resources=True,
+                 capture_network=False, factory=None):
+        self.size = max(1, size)
+        self.recycle_after = recycle_after
+        self.max_memory_mb = max_memory_mb
+        self.factory = factory or (lambda: make_driver(headless, block_resources, capture_network))
+
+    def run(self, jobs, handler):
+        # handler(driver, job) -> result; returns [(job, result, error), ...] in completion order
+        job_queue = queue.Queue()
+        for job in jobs:
+            job_queue.put(job)
+
+        results = []
+        lock = threading.Lock()
+
+        def worker(index):
+            slot = PooledDriver(self.factory, self.recycle_after, self.max_memory_mb)
+            try:
+                while True:
+                    try:
+                        job = job_queue.get_nowait()
+                    except queue.Empty:
+                        return
+                    try:
+                        result = handler(slot.get(), job)
+                        error = None
+                        slot.route_finished()
+                    except Exception as e:
+                        result = None
+                        error = e
+                        slot.route_failed()
+                    with lock:
+                        results.append((job, result, error))
+            finally:
+                slot.quit()
+
+        threads = [threading.Thread(target=worker, args=(i,), name=f"crawl-worker-{i}", daemon=True)
+                   for i in range(self.size)]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(f"Pool of {self.size} browsers finished {len(results)} jobs in {time.time() - started:.0f}s")
+        return results
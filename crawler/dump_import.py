@@ -0,0 +1,290 @@
+import argparse
+import gzip
+import os
+import re
+import time
+from datetime import datetime
+
+from crawler.config import STORAGE_BACKEND, DB_BATCH_SIZE
+from crawler.rows import COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed for Parquet output
+    pa = None
+
+# Restores a phpMyAdmin/mysqldump dump of bus_routes (bus_routes.sql) without
+# a MySQL server. The dump is read in chunks and tokenized as it streams, so
+# memory stays flat however big the file or its INSERT statements are; each
+# VALUES tuple becomes a bus_routes row as soon as its closing parenthesis is
+# read, and rows go to the target in batches:
+#
+#   python -m crawler.dump_import bus_routes.sql --target duckdb
+#   python -m crawler.dump_import bus_routes.sql --target sqlite --path redbus.sqlite3
+#   python -m crawler.dump_import bus_routes.sql.gz --target parquet --path bus_routes.parquet
+#
+# Everything but INSERT/REPLACE INTO the chosen table is skipped (SET, CREATE,
+# ALTER, conditional /*!...*/ comments). Column names come from the INSERT's
+# column list, or from the CREATE TABLE when the dump has none.
+
+CHUNK_SIZE = 1 << 16
+
+TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*(?:\n|$)|\#[^\n]*(?:\n|$)|/\*.*?\*/)
+  | (?P<string>'(?:[^'\\]|\\.|'')*')
+  | (?P<quoted>`(?:[^`]|``)*`)
+  | (?P<number>-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<symbol>.)
+""", re.VERBOSE | re.DOTALL)
+
+# MySQL string escapes
+ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+ESCAPE = re.compile(r"\\(.)|''", re.DOTALL)
+
+# Words that open a key or constraint rather than a column in CREATE TABLE
+NOT_COLUMNS = {'PRIMARY', 'KEY', 'UNIQUE', 'INDEX', 'FULLTEXT', 'SPATIAL', 'CONSTRAINT', 'FOREIGN', 'CHECK'}
+
+PARQUET_SCHEMA = None if pa is None else pa.schema([
+    ('route_name', pa.string()),
+    ('route_link', pa.string()),
+    ('busname', pa.string()),
+    ('bustype', pa.string()),
+    ('departing_time', pa.timestamp('s')),
+    ('duration', pa.string()),
+    ('reaching_time', pa.timestamp('s')),
+    ('star_rating', pa.float32()),
+    ('price', pa.decimal128(10, 2)),
+    ('seats_available', pa.int32()),
+])
+
+
+def unescape(text):
+    return ESCAPE.sub(lambda match: "'" if match.group(1) is None else ESCAPES.get(match.group(1), match.group(1)),
+                      text)
+
+
+def tokens(f):
+    # (kind, text) for every token of the dump, reading CHUNK_SIZE at a time.
+    # A token is only matched once at least a chunk is buffered past its
+    # start, and one that reaches the last character of the buffer (it might
+    # go on) or is a quote or comment that doesn't close within it is matched
+    # again with more of the file, so none is cut at a chunk boundary.
+    buffer = ''
+    position = 0
+    eof = False
+    while True:
+        if not eof and len(buffer) - position < CHUNK_SIZE:
+            chunk = f.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+        if position >= len(buffer):
+            return
+        match = TOKEN.match(buffer, position)
+        if match.lastgroup in ('string', 'quoted'):
+            # Followed by its own quote, it's the start of a longer one with a
+            # doubled quote inside ('it''s') that isn't all buffered yet
+            unclosed = buffer.startswith(match.group()[0], match.end())
+        else:
+            unclosed = match.lastgroup == 'symbol' and (match.group() in "'`" or buffer.startswith('/*', position))
+        if not eof and (unclosed or match.end() >= len(buffer) - 1):
+            chunk = f.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        position = match.end()
+        if match.lastgroup not in ('space', 'comment'):
+            yield match.lastgroup, match.group()
+
+
+def value_of(kind, text):
+    if kind == 'string':
+        return unescape(text[1:-1])
+    if kind == 'number':
+        return float(text) if any(c in text for c in '.eE') else int(text)
+    if kind == 'word' and text.upper() == 'NULL':
+        return None
+    return text
+
+
+def name_of(kind, text):
+    return text[1:-1].replace('``', '`') if kind == 'quoted' else text
+
+
+def read_inserts(f, table='bus_routes'):
+    # (columns, values) for every tuple inserted into `table`
+    stream = tokens(f)
+    table_columns = None
+    for kind, text in stream:
+        word = text.upper() if kind == 'word' else None
+        if word == 'CREATE':
+            table_columns = read_create(stream, table) or table_columns
+        elif word in ('INSERT', 'REPLACE'):
+            yield from read_values(stream, table, table_columns)
+        elif text != ';':
+            skip_statement(stream)
+
+
+def skip_statement(stream):
+    for kind, text in stream:
+        if kind == 'symbol' and text == ';':
+            return
+
+
+def read_create(stream, table):
+    # Column names of CREATE TABLE `table`, None for any other CREATE
+    kind, text = next(stream)
+    if text.upper() != 'TABLE':
+        skip_statement(stream)
+        return None
+    kind, text = next(stream)
+    while kind == 'word' and text.upper() in ('IF', 'NOT', 'EXISTS'):
+        kind, text = next(stream)
+    if name_of(kind, text) != table:
+        skip_statement(stream)
+        return None
+    columns = []
+    depth = 0
+    expect_name = False
+    for kind, text in stream:
+        if kind == 'symbol' and text == ';':
+            break
+        if kind == 'symbol' and text == '(':
+            depth += 1
+            expect_name = depth == 1
+        elif kind == 'symbol' and text == ')':
+            depth -= 1
+        elif kind == 'symbol' and text == ',' and depth == 1:
+            expect_name = True
+        elif expect_name:
+            if kind == 'quoted' or (kind == 'word' and text.upper() not in NOT_COLUMNS):
+                columns.append(name_of(kind, text))
+            expect_name = False
+    return columns
+
+
+def read_values(stream, table, table_columns):
+    # INSERT [IGNORE] INTO `table` [(columns)] VALUES (...), (...);
+    kind, text = next(stream)
+    if text.upper() == 'IGNORE':
+        kind, text = next(stream)
+    if text.upper() == 'INTO':
+        kind, text = next(stream)
+    if name_of(kind, text) != table:
+        skip_statement(stream)
+        return
+    columns = table_columns
+    kind, text = next(stream)
+    if text == '(':
+        columns = []
+        for kind, text in stream:
+            if text == ')':
+                break
+            if text != ',':
+                columns.append(name_of(kind, text))
+        kind, text = next(stream)
+    if text.upper() not in ('VALUES', 'VALUE') or not columns:
+        raise ValueError(f"Can't read the INSERT into {table}: no VALUES or no column names")
+
+    values = None
+    for kind, text in stream:
+        if kind == 'symbol':
+            if text == '(':
+                values = []
+            elif text == ')':
+                yield columns, values
+                values = None
+            elif text == ';':
+                return
+        elif values is not None:
+            values.append(value_of(kind, text))
+
+
+def to_row(columns, values):
+    # bus_routes row in COLUMNS order, with times as datetimes
+    record = dict(zip(columns, values))
+    row = [record[column] for column in COLUMNS]
+    for index in (COLUMNS.index('departing_time'), COLUMNS.index('reaching_time')):
+        row[index] = datetime.strptime(row[index], '%Y-%m-%d %H:%M:%S')
+    return tuple(row)
+
+
+def read_rows(path, table='bus_routes', batch_size=DB_BATCH_SIZE):
+    # Batches of bus_routes rows from a .sql or .sql.gz dump; rows that
+    # don't convert are reported and left out
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        batch = []
+        for number, (columns, values) in enumerate(read_inserts(f, table), 1):
+            try:
+                batch.append(to_row(columns, values))
+            except (KeyError, ValueError, TypeError) as error:
+                print(f"Skipping row {number} of {table}: {error!r}")
+                continue
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+class ParquetTarget:
+    # Same write_rows() as the storage backends; one row group per batch
+
+    name = 'parquet'
+
+    def __init__(self, path):
+        if pa is None:
+            raise ImportError("Parquet output needs pyarrow (pip install pyarrow)")
+        self.path = path
+        self.writer = pq.ParquetWriter(path, PARQUET_SCHEMA, compression='zstd')
+
+    def write_rows(self, rows):
+        columns = list(zip(*rows))
+        self.writer.write_table(pa.table(
+            [pa.array(values, type=field.type) for values, field in zip(columns, PARQUET_SCHEMA)],
+            schema=PARQUET_SCHEMA))
+        return len(rows)
+
+    def close(self):
+        self.writer.close()
+
+
+def import_dump(path, target=STORAGE_BACKEND, target_path=None, table='bus_routes', batch_size=DB_BATCH_SIZE):
+    started = time.time()
+    if target == 'parquet':
+        store = ParquetTarget(target_path or os.path.splitext(os.path.basename(path))[0] + '.parquet')
+    else:
+        from crawler.storage import get_storage
+
+        store = get_storage(target, target_path)
+        store.start_run('import', os.path.basename(path)[:32])
+    read = written = 0
+    try:
+        for rows in read_rows(path, table, batch_size):
+            read += len(rows)
+            written += store.write_rows(rows)
+    finally:
+        if target == 'parquet':
+            store.close()
+        else:
+            store.finish_run()
+    elapsed = time.time() - started
+    print(f"Imported {written} of {read} rows from {path} into {target} in {elapsed:.1f}s "
+          f"({read / elapsed if elapsed else 0:.0f} rows/s)")
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import a bus_routes SQL dump without a MySQL server")
+    parser.add_argument('dump', help=".sql or .sql.gz file, e.g. bus_routes.sql")
+    parser.add_argument('--target', choices=['mysql', 'sqlite', 'duckdb', 'parquet'], default=STORAGE_BACKEND)
+    parser.add_argument('--path', help="database or Parquet file to write (default per target)")
+    parser.add_argument('--table', default='bus_routes', help="table in the dump to import")
+    parser.add_argument('--batch-size', type=int, default=DB_BATCH_SIZE)
+    args = parser.parse_args()
+
+    import_dump(args.dump, args.target, args.path, args.table, args.batch_size)
@@ -0,0 +1,189 @@
+import argparse
+import time
+
+from crawler.api_capture import extract_buses_from_api
+from crawler.blocking import read_performance_log, traffic_report, format_traffic_report
+from crawler.catalog import load_routes, route_link
+from crawler.config import CATALOG_PATH, CRAWL_WORKERS, RECYCLE_AFTER_ROUTES, MAX_BROWSER_MEMORY_MB
+from crawler.driver_pool import DriverPool
+from crawler.scraper import open_via_directory, apply_operator_filter, scroll_and_load, extract_buses
+from crawler.snapshots import new_run_id, save_snapshot
+from crawler.storage import get_storage
+from crawler.write_behind import WriteBehind
+
+# One process, a pool of browsers, every route in the catalog.
+
+
+def crawl_route(driver, route, settings):
+    onward = settings.get('onward') or route['onward']
+    link = route_link(route, onward)
+    network_log = settings['block_resources'] or settings['extract'] == 'api'
+    messages = []
+
+    # The bus-tickets URL is fully determined by the catalog, so go straight
+    # to it; walking home page -> RTC directory -> route anchor is only kept
+    # to check that a route is still listed there.
+    route_name = route['route_name']
+    if settings['via_directory']:
+        route_name = open_via_directory(driver, route)
+    if network_log:
+        read_performance_log(driver)  # discard traffic from earlier pages
+    driver.get(link)
+
+    buses = None
+    if settings['extract'] == 'api':
+        buses = extract_buses_from_api(driver, route, route_name, link, onward, messages,
+                                       record_dir=settings.get('record_api'))
+
+    if buses is None:
+        if route['mode'] == 'govt' and route['operator_filter']:
+            apply_operator_filter(driver, route['operator_filter'])
+
+        # Scroll to load all buses
+        scroll_and_load(driver)
+        if settings['archive']:
+            save_snapshot(settings['archive'], settings['run_id'], route, onward, link, driver.page_source)
+        buses = extract_buses(driver, route_name, link, onward)
+
+    if settings['block_resources']:
+        messages.extend(read_performance_log(driver))
+        print(f"{route_name}: {format_traffic_report(traffic_report(messages))}")
+    return buses
+
+
+def route_label(route):
+    return f"{route['corporation']} / {route['route_name']} ({route['operator']})"
+
+
+def crawl_and_store(driver, route, settings):
+    print(f"Crawling {route_label(route)}")
+    buses = crawl_route(driver, route, settings)
+    for bus_details in buses:
+        print(bus_details)
+    if settings.get('writer'):
+        # Hand off to the writer threads and get back to the browser
+        settings['writer'].put(buses)
+    else:
+        # One transaction for the whole route, straight into MySQL
+        from crawler.db import insert_bus_routes
+
+        insert_bus_routes(buses)
+    return len(buses)
+
+
+DEFAULT_SETTINGS = {
+    'onward': None,            # override every route's catalog date
+    'workers': CRAWL_WORKERS,
+    'recycle_after': RECYCLE_AFTER_ROUTES,
+    'max_browser_mb': MAX_BROWSER_MEMORY_MB,
+    'headless': True,
+    'via_directory': False,
+    'block_resources': True,
+    'extract': 'dom',          # 'dom' or 'api'
+    'record_api': None,        # directory to save captured search responses in
+    'archive': None,           # directory to archive scrolled route pages in
+    'run_id': None,            # archive key for this crawl (default: start time)
+    'write_behind': True,      # queue trips for writer threads instead of inserting inline
+    'bulk_load': None,         # stage trips to a TSV and LOAD DATA it at the end ('' = temp file)
+    'writer': None,            # the WriteBehind queue, set by run()
+}
+
+
+def make_settings(**overrides):
+    settings = {**DEFAULT_SETTINGS, **overrides}
+    if settings['archive'] and not settings['run_id']:
+        settings['run_id'] = new_run_id()
+    return settings
+
+
+def run(routes, **overrides):
+    settings = make_settings(**overrides)
+    pool = DriverPool(size=min(settings['workers'], len(routes)), recycle_after=settings['recycle_after'],
+                      max_memory_mb=settings['max_browser_mb'], headless=settings['headless'],
+                      block_resources=settings['block_resources'], capture_network=settings['extract'] == 'api')
+    started = time.time()
+    storage = get_storage()
+    storage.start_run('browser', settings['run_id'])
+    if settings['bulk_load'] is not None and storage.name != 'mysql':
+        print(f"--bulk-load needs the mysql backend; writing to {storage.name} through the write-behind queue")
+        settings['bulk_load'] = None
+    if settings['bulk_load'] is not None:
+        from crawler.bulk_load import BulkLoader
+
+        settings['writer'] = BulkLoader(settings['bulk_load'] or None, keep=bool(settings['bulk_load'])).start()
+    elif settings['write_behind']:
+        settings['writer'] = WriteBehind().start()
+    try:
+        results = pool.run(routes, lambda driver, route: crawl_and_store(driver, route, settings))
+    finally:
+        if settings['writer']:
+            settings['writer'].close()
+        storage.finish_run()
+
+    crawled = 0
+    failed = []
+    for route, bus_count, error in results:
+        if error is not None:
+            print(f"Error crawling {route_label(route)}: {str(error)}")
+            failed.append(route_label(route))
+        else:
+            crawled += 1
+
+    print(f"Crawled {crawled} of {len(routes)} routes in {time.time() - started:.0f}s")
+    for label in failed:
+        print(f"Failed: {label}")
+    return crawled, failed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl RedBus routes listed in the route catalog")
+    parser.add_argument('--catalog', default=CATALOG_PATH, help="route catalog CSV")
+    parser.add_argument('--corporation', action='append', help="only these corporations (repeatable)")
+    parser.add_argument('--operator', action='append', help="only these operators, e.g. ksrtc, private (repeatable)")
+    parser.add_argument('--route', action='append', help="only these route titles (repeatable)")
+    parser.add_argument('--mode', choices=['govt', 'private'], help="only government or private rows")
+    parser.add_argument('--onward', help="onward date like 29-Jul-2024 (defaults to each route's catalog date)")
+    parser.add_argument('--limit', type=int, help="stop after this many routes")
+    parser.add_argument('--workers', type=int, default=CRAWL_WORKERS, help="number of browsers run in parallel")
+    parser.add_argument('--recycle-after', type=int, default=RECYCLE_AFTER_ROUTES,
+                        help="relaunch a browser after this many routes (0 = never)")
+    parser.add_argument('--max-browser-mb', type=int, default=MAX_BROWSER_MEMORY_MB,
+                        help="relaunch a browser once it uses more memory than this (needs psutil, 0 = never)")
+    parser.add_argument('--show-browser', action='store_true', help="run Chrome with a visible window")
+    parser.add_argument('--via-directory', action='store_true',
+                        help="reach each route through the home page and RTC directory before opening it")
+    parser.add_argument('--no-block', action='store_true',
+                        help="load images, fonts, media and third-party trackers instead of blocking them")
+    parser.add_argument('--extract', choices=['dom', 'api'], default='dom',
+                        help="read trips from bus-item elements, or from the captured search API response "
+                             "(falls back to the DOM when no response is seen)")
+    parser.add_argument('--record-api', metavar='DIR', help="save captured search responses here for replay")
+    parser.add_argument('--archive', metavar='DIR',
+                        help="archive each scrolled route page here for re-parsing with crawler.reparse")
+    parser.add_argument('--run-id', help="archive run id (default: crawl start time)")
+    parser.add_argument('--sync-writes', action='store_true',
+                        help="insert each route's trips from the crawl thread instead of the write-behind queue")
+    parser.add_argument('--bulk-load', nargs='?', const='', metavar='TSV',
+                        help="stage trips to a TSV (kept if a path is given) and load it with "
+                             "LOAD DATA LOCAL INFILE after the crawl")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    routes = load_routes(args.catalog, corporations=args.corporation, mode=args.mode,
+                         operators=args.operator, routes=args.route)
+    if args.limit:
+        routes = routes[:args.limit]
+    if not routes:
+        print("No routes match the given filters")
+        return
+    run(routes, onward=args.onward, workers=args.workers, recycle_after=args.recycle_after,
+        max_browser_mb=args.max_browser_mb, headless=not args.show_browser, via_directory=args.via_directory,
+        block_resources=not args.no_block, extract=args.extract, record_api=args.record_api,
+        archive=args.archive, run_id=args.run_id, write_behind=not args.sync_writes,
+        bulk_load=args.bulk_load)
+
+
+if __name__ == '__main__':
+    main()
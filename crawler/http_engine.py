@@ -0,0 +1,356 @@
+import argparse
+import importlib.util
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+from crawler.api_capture import (find_inventory, is_search_response, parse_search_response, operator_matches,
+                                  search_total)
+from crawler.catalog import load_routes, route_link
+from crawler.config import CATALOG_PATH, HTTP_WORKERS
+from crawler.storage import get_storage
+from crawler.write_behind import WriteBehind
+from crawler.lookup import LookupStats
+from crawler.scraper import to_bus_details
+
+try:
+    import httpx
+except ImportError:  # only needed for the browserless engine
+    httpx = None
+
+# httpx speaks HTTP/2 when h2 is installed
+HTTP2 = importlib.util.find_spec('h2') is not None
+
+# Browserless crawl: one Selenium session loads a single route page to pick
+# up cookies, headers and the shape of the search API request; every other
+# route-date is then fetched with a pooled keep-alive HTTP client.
+
+# Request headers worth replaying; the rest are set by the HTTP client
+REPLAY_HEADERS = ('user-agent', 'accept', 'accept-language', 'content-type', 'origin', 'referer',
+                  'x-requested-with')
+
+
+PLACEHOLDERS = ('from_city_id', 'to_city_id', 'onward')
+# Request fields that pick the page of results, by what they count
+PAGE_FIELDS = {'page': 'page', 'pageno': 'page', 'pagenumber': 'page', 'pageindex': 'page',
+               'offset': 'offset', 'skip': 'offset', 'start': 'offset', 'startindex': 'offset'}
+MAX_PAGES = 50   # per route-date, in case the API ignores the page field
+
+
+def escape(text):
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+def page_field(key, value, paging):
+    # Placeholder name for a page or offset field, noting where the seed's
+    # first page starts
+    name = PAGE_FIELDS.get(str(key).lower())
+    if name is None or not str(value).isdigit():
+        return None
+    paging.update(paging=name, first_page=int(value))
+    return name
+
+
+def template_query(query, values, found, paging):
+    # A query string or form body with each field whose whole value is a
+    # seed value swapped for its placeholder; other fields keep their bytes
+    fields = []
+    for field in query.split('&'):
+        key, sep, value = field.partition('=')
+        value = unquote_plus(value)
+        name = (page_field(unquote_plus(key), value, paging) or values.get(value)) if sep else None
+        if name:
+            found.append(name)
+            fields.append(f"{escape(key)}={{{name}}}")
+        else:
+            fields.append(escape(field))
+    return '&'.join(fields)
+
+
+def template_json(body, values, found, paging):
+    # A JSON body with each string or number field whose value is a seed
+    # value swapped for its placeholder, quoted as the seed had it
+    def mark(value, key=None):
+        if isinstance(value, dict):
+            return {key: mark(item, key) for key, item in value.items()}
+        if isinstance(value, list):
+            return [mark(item) for item in value]
+        if not isinstance(value, (str, int)) or isinstance(value, bool):
+            return value
+        name = page_field(key, value, paging) if key is not None else None
+        if name is None and str(value) in values:
+            name = values[str(value)]
+            found.append(name)
+        if name is None:
+            return value
+        return f"@@{name}:{'str' if isinstance(value, str) else 'number'}@@"
+
+    text = escape(json.dumps(mark(body), separators=(',', ':')))
+    for name in PLACEHOLDERS + ('page', 'offset'):
+        text = text.replace(f'"@@{name}:str@@"', f'"{{{name}}}"').replace(f'"@@{name}:number@@"', f'{{{name}}}')
+    return text
+
+
+def make_template(request, route, onward):
+    # The seed request with the route's city ids and the onward date swapped
+    # for placeholders, field by field, so it can be reissued for any
+    # route-date. A field only matches on its whole value, so city id 1
+    # doesn't touch 12 or a page size of 100. Raises ValueError when a
+    # placeholder has no field, e.g. the site sends the date in another
+    # format, or several, rather than fetch the seed's route-date for
+    # every job. A page or offset field becomes {page}/{offset} so later
+    # pages can be asked for; 'paging' says which, None when the request
+    # has neither.
+    values = {str(route['from_city_id']): 'from_city_id', str(route['to_city_id']): 'to_city_id', onward: 'onward'}
+    found = []
+    paging = {'paging': None, 'first_page': 0}
+
+    parts = urlsplit(request['url'])
+    query = template_query(parts.query, values, found, paging) if parts.query else ''
+    url = urlunsplit((parts.scheme, parts.netloc, escape(parts.path), query, escape(parts.fragment)))
+
+    post_data = request.get('postData')
+    if post_data:
+        try:
+            post_data = template_json(json.loads(post_data), values, found, paging)
+        except ValueError:
+            post_data = template_query(post_data, values, found, paging)
+
+    seed_values = f"({route['from_city_id']}, {route['to_city_id']}, {onward})"
+    missing = [name for name in PLACEHOLDERS if name not in found]
+    if missing:
+        raise ValueError(f"Seed search request has no field holding {', '.join(missing)} {seed_values}: "
+                         f"{request['url']}")
+    repeated = [name for name in PLACEHOLDERS if found.count(name) > 1]
+    if repeated:
+        raise ValueError(f"Seed search request has several fields holding {', '.join(repeated)} {seed_values}: "
+                         f"{request['url']}")
+    return {
+        'method': request.get('method', 'GET'),
+        'url': url,
+        'post_data': post_data,
+        **paging,
+    }
+
+
+def seed_from_browser(driver, route, onward=None, timeout=20):
+    from crawler.blocking import read_performance_log
+
+    onward = onward or route['onward']
+    read_performance_log(driver)
+    driver.get(route_link(route, onward))
+
+    request = None
+    deadline = time.time() + timeout
+    while request is None and time.time() < deadline:
+        for message in read_performance_log(driver):
+            params = message.get('params', {})
+            if message.get('method') == 'Network.requestWillBeSent' and is_search_response(params['request']['url']):
+                request = params['request']
+                break
+        else:
+            time.sleep(0.25)
+    if request is None:
+        raise RuntimeError(f"No search API request seen on {route['route_name']}")
+
+    headers = {k: v for k, v in request.get('headers', {}).items() if k.lower() in REPLAY_HEADERS}
+    headers.setdefault('User-Agent', driver.execute_script("return navigator.userAgent"))
+    return {
+        'cookies': {cookie['name']: cookie['value'] for cookie in driver.get_cookies()},
+        'headers': headers,
+        'template': make_template(request, route, onward),
+    }
+
+
+def seed_with_browser(route, onward=None, headless=True):
+    from crawler.driver_pool import make_driver
+
+    driver = make_driver(headless=headless, block_resources=True, capture_network=True)
+    try:
+        return seed_from_browser(driver, route, onward)
+    finally:
+        driver.quit()
+
+
+def rebase_url(url, base_url):
+    # Point a captured URL at another host, e.g. a local stand-in server
+    if not base_url:
+        return url
+    base = urlsplit(base_url)
+    parts = urlsplit(url)
+    return urlunsplit((base.scheme, base.netloc, parts.path, parts.query, parts.fragment))
+
+
+def build_request(seed, route, onward, base_url=None, page=0, offset=0):
+    # page counts requests for the route-date so far, offset the trips read
+    template = seed['template']
+    first = template.get('first_page', 0)
+    values = {'from_city_id': route['from_city_id'], 'to_city_id': route['to_city_id'], 'onward': onward,
+              'page': first + page, 'offset': first + offset}
+    post_data = template['post_data'].format(**values) if template['post_data'] else None
+    return template['method'], rebase_url(template['url'].format(**values), base_url), post_data
+
+
+def client_options(seed, workers, timeout):
+    if httpx is None:
+        raise ImportError("The HTTP engine needs httpx (pip install httpx, plus h2 for HTTP/2)")
+    limits = httpx.Limits(max_connections=workers, max_keepalive_connections=workers)
+    return dict(http2=HTTP2, headers=seed['headers'], cookies=seed['cookies'],
+                limits=limits, timeout=timeout, follow_redirects=True)
+
+
+def make_client(seed, workers=HTTP_WORKERS, timeout=30):
+    return httpx.Client(**client_options(seed, workers, timeout))
+
+
+def make_async_client(seed, workers=HTTP_WORKERS, timeout=30):
+    return httpx.AsyncClient(**client_options(seed, workers, timeout))
+
+
+def next_page(seed, payloads):
+    # (page, offset) of the next request for a route-date, None once the
+    # last page is in: an empty page, or as many trips as the API reports
+    if not payloads:
+        return 0, 0
+    read = sum(len(find_inventory(payload)) for payload in payloads)
+    total = search_total(payloads[-1])
+    if not find_inventory(payloads[-1]) or (total is not None and read >= total):
+        return None
+    if not seed['template'].get('paging'):
+        if total is not None:
+            print(f"Only {read} of {total} trips: the seed request has no page or offset field")
+        return None
+    if len(payloads) >= MAX_PAGES:
+        print(f"Stopping after {MAX_PAGES} pages with {read} of {total} trips")
+        return None
+    return len(payloads), read
+
+
+def trips_from_payloads(route, onward, payloads):
+    records = [record for payload in payloads for record in parse_search_response(payload)]
+
+    operator_filter = route['operator_filter'] if route['mode'] == 'govt' else ''
+    if operator_filter and not operator_filter.startswith('//'):
+        records = [record for record in records if operator_matches(record, operator_filter)]
+
+    stats = LookupStats()
+    buses = []
+    link = route_link(route, onward)
+    for record in records:
+        stats.record(record)
+        if not stats.missing_required(record):
+            buses.append(to_bus_details(record, route['route_name'], link, onward))
+    print(f"{route['route_name']} {onward} (HTTP): {stats.summary()}")
+    return buses
+
+
+def fetch_route(client, seed, route, onward=None, base_url=None):
+    onward = onward or route['onward']
+    payloads = []
+    position = next_page(seed, payloads)
+    while position is not None:
+        method, url, post_data = build_request(seed, route, onward, base_url, *position)
+        response = client.request(method, url, content=post_data)
+        response.raise_for_status()
+        payloads.append(response.json())
+        position = next_page(seed, payloads)
+    return trips_from_payloads(route, onward, payloads)
+
+
+async def fetch_route_async(client, seed, route, onward=None, base_url=None):
+    onward = onward or route['onward']
+    payloads = []
+    position = next_page(seed, payloads)
+    while position is not None:
+        method, url, post_data = build_request(seed, route, onward, base_url, *position)
+        response = await client.request(method, url, content=post_data)
+        response.raise_for_status()
+        payloads.append(response.json())
+        position = next_page(seed, payloads)
+    return trips_from_payloads(route, onward, payloads)
+
+
+def run(routes, seed, onwards=None, workers=HTTP_WORKERS, base_url=None, store=True, bulk_load=None):
+    # Every (route, onward date) pair is one job on the shared client
+    jobs = [(route, onward) for route in routes for onward in (onwards or [None])]
+    started = time.time()
+    fetched = 0
+    failed = []
+    writer = None
+    storage = get_storage() if store else None
+    if store:
+        storage.start_run('http')
+    if store and bulk_load is not None and storage.name != 'mysql':
+        print(f"--bulk-load needs the mysql backend; writing to {storage.name} through the write-behind queue")
+        bulk_load = None
+    if store and bulk_load is not None:
+        from crawler.bulk_load import BulkLoader
+
+        writer = BulkLoader(bulk_load or None, keep=bool(bulk_load)).start()
+    elif store:
+        writer = WriteBehind().start()
+    try:
+        with make_client(seed, workers) as client, ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fetch_route, client, seed, route, onward, base_url): (route, onward)
+                       for route, onward in jobs}
+            for future in as_completed(futures):
+                route, onward = futures[future]
+                label = f"{route['route_name']} ({route['operator']}) {onward or route['onward']}"
+                try:
+                    buses = future.result()
+                except Exception as e:
+                    print(f"Error fetching {label}: {str(e)}")
+                    failed.append(label)
+                    continue
+                fetched += 1
+                if writer:
+                    writer.put(buses)
+    finally:
+        if writer:
+            writer.close()
+        if store:
+            storage.finish_run()
+
+    elapsed = time.time() - started
+    print(f"Fetched {fetched} of {len(jobs)} route-dates in {elapsed:.1f}s "
+          f"({fetched / elapsed * 3600 if elapsed else 0:.0f} per hour)")
+    return fetched, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch RedBus route results over HTTP, seeded by one browser session")
+    parser.add_argument('--catalog', default=CATALOG_PATH)
+    parser.add_argument('--corporation', action='append')
+    parser.add_argument('--operator', action='append')
+    parser.add_argument('--mode', choices=['govt', 'private'])
+    parser.add_argument('--onward', action='append', help="onward date(s), repeatable (default: catalog date)")
+    parser.add_argument('--workers', type=int, default=HTTP_WORKERS, help="concurrent HTTP requests")
+    parser.add_argument('--seed', metavar='FILE', help="reuse a saved seed instead of launching Chrome")
+    parser.add_argument('--save-seed', metavar='FILE', help="write the browser seed here for later runs")
+    parser.add_argument('--base-url', help="send requests to this host instead, e.g. a local stand-in server")
+    parser.add_argument('--no-store', action='store_true', help="fetch and parse only, skip the database")
+    parser.add_argument('--bulk-load', nargs='?', const='', metavar='TSV',
+                        help="stage trips to a TSV and load it with LOAD DATA LOCAL INFILE at the end")
+    args = parser.parse_args(argv)
+
+    routes = load_routes(args.catalog, corporations=args.corporation, mode=args.mode, operators=args.operator)
+    if not routes:
+        print("No routes match the given filters")
+        return
+
+    if args.seed:
+        with open(args.seed, encoding='utf-8') as f:
+            seed = json.load(f)
+    else:
+        seed = seed_with_browser(routes[0])
+    if args.save_seed:
+        with open(args.save_seed, 'w', encoding='utf-8') as f:
+            json.dump(seed, f, indent=2)
+
+    run(routes, seed, onwards=args.onward, workers=args.workers, base_url=args.base_url, store=not args.no_store,
+        bulk_load=args.bulk_load)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+import argparse
+import glob
+import os
+import re
+import shutil
+from datetime import date, datetime
+from decimal import Decimal
+from urllib.parse import unquote
+
+from crawler.catalog import load_routes
+from crawler.config import STORAGE_BACKEND, CATALOG_PATH, LAKE_PATH
+from crawler.rows import COLUMNS, SERVICE_NO
+from crawler.schema import COMPAT_SELECT
+
+try:
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:  # only needed for the lake
+    pa = None
+
+# Parquet copy of the crawled trips for offline analytics, one directory per
+# corporation, onward date and crawl run (hive style, so pyarrow, DuckDB,
+# Spark and pandas all read the partition values from the path):
+#
+#   lake/corporation=KSRTC/onward=2024-07-29/crawl_run=12/run-12-0.parquet
+#
+# Each crawl run is appended as new files and never rewrites older ones. A
+# file holds the trips the run wrote, normalized (operator and service number
+# split out, duration in minutes), with typed timestamps and decimals and
+# dictionary-encoded strings. Set REDBUS_LAKE_PATH to export every run as it
+# finishes, or catch up from the storage backend:
+#
+#   python -m crawler.lake export              # runs newer than the lake's latest
+#   python -m crawler.lake export --run 12     # one run again
+#   python -m crawler.lake status
+#
+# Readers filter on the partition columns to open only the directories they
+# need: scan() here for notebooks, the 'lake' storage backend for the
+# dashboard, or DuckDB directly:
+#
+#   SELECT * FROM read_parquet('lake/**/*.parquet', hive_partitioning = true)
+#   WHERE corporation = 'KSRTC' AND onward = DATE '2024-07-29'
+
+DEFAULT_PATH = 'lake'
+
+# Trip identity within the lake; the latest run's copy of a trip wins
+TRIP_KEY = ['route_name', 'busname', 'bustype', 'departing_time']
+
+DURATION = re.compile(r'^(\d+)h (\d+)m$')
+
+CENT = Decimal('0.01')
+
+if pa is not None:
+    TEXT = pa.dictionary(pa.int32(), pa.string())
+    LAKE_SCHEMA = pa.schema([
+        ('route_name', TEXT),
+        ('route_link', TEXT),
+        ('operator', TEXT),
+        ('service_no', TEXT),
+        ('busname', TEXT),
+        ('bustype', TEXT),
+        ('departing_time', pa.timestamp('s')),
+        ('reaching_time', pa.timestamp('s')),
+        ('duration_min', pa.int16()),
+        ('star_rating', pa.float32()),
+        ('price', pa.decimal128(10, 2)),      # as the tables store it
+        ('seats_available', pa.int16()),
+    ])
+    PARTITION_SCHEMA = pa.schema([
+        ('corporation', pa.string()),
+        ('onward', pa.date32()),
+        ('crawl_run', pa.int32()),
+    ])
+    PARTITIONING = ds.partitioning(PARTITION_SCHEMA, flavor='hive')
+
+
+# Latest copy of every trip in the lake with the bus_routes columns, for
+# DuckDB (the 'lake' storage backend). The window partitions on onward and
+# corporation too, which doesn't change the result (both follow from the
+# trip), so filters on them are pushed below it and prune directories.
+LAKE_VIEW = """
+CREATE OR REPLACE VIEW bus_routes AS
+SELECT route_name, route_link, busname, bustype, departing_time,
+       COALESCE(printf('%02dh %02dm', duration_min // 60, duration_min % 60), '') AS duration,
+       reaching_time, star_rating, price, seats_available, corporation, onward, crawl_run
+FROM read_parquet('{files}', hive_partitioning = true,
+                  hive_types = {{'corporation': VARCHAR, 'onward': DATE, 'crawl_run': INTEGER}})
+QUALIFY row_number() OVER (PARTITION BY corporation, onward, route_name, busname, bustype, departing_time
+                           ORDER BY crawl_run DESC) = 1"""
+
+
+def lake_files(path=LAKE_PATH):
+    return os.path.join(path or DEFAULT_PATH, '*', '*', '*', '*.parquet')
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("The Parquet lake needs pandas and pyarrow (pip install pandas pyarrow)")
+
+
+def corporations_by_route(catalog=CATALOG_PATH):
+    # route_name -> corporation from the route catalog, for trips from a
+    # backend that doesn't record it
+    corporations = {}
+    for route in load_routes(catalog):
+        corporations.setdefault(route['route_name'], route['corporation'])
+    return corporations
+
+
+def normalize(frame, corporations=None):
+    # bus_routes-shaped rows of one run as lake columns plus partition columns
+    frame = frame.copy()
+    looked_up = frame['route_name'].map(corporations or corporations_by_route())
+    if 'corporation' in frame:
+        looked_up = frame['corporation'].fillna(looked_up)
+    frame['corporation'] = looked_up.fillna('unknown')
+    busname = frame['busname'].astype(str)
+    frame['service_no'] = busname.str.extract(SERVICE_NO.pattern, expand=False).fillna('')
+    frame['operator'] = busname.str.replace(SERVICE_NO.pattern, '', regex=True)
+    for column in ('departing_time', 'reaching_time'):
+        frame[column] = pd.to_datetime(frame[column])
+    parts = frame['duration'].astype(str).str.extract(DURATION.pattern).astype(float)
+    frame['duration_min'] = (parts[0] * 60 + parts[1]).astype('Int16')
+    frame['onward'] = frame['departing_time'].dt.date
+    return frame
+
+
+def to_table(frame, run_id):
+    # Arrow table in LAKE_SCHEMA order, partition columns last
+    columns = {}
+    for field in LAKE_SCHEMA:
+        values = frame[field.name]
+        if field.name == 'price':
+            # Through str so 449.0 from a float column is exactly 449.00
+            values = [None if pd.isna(value) else Decimal(str(value)).quantize(CENT) for value in values]
+        columns[field.name] = pa.array(values, type=field.type, from_pandas=True)
+    columns['corporation'] = pa.array(frame['corporation'], type=pa.string())
+    columns['onward'] = pa.array(frame['onward'], type=pa.date32())
+    columns['crawl_run'] = pa.array([run_id] * len(frame), type=pa.int32())
+    return pa.table(columns)
+
+
+def run_trips(storage, run_id):
+    # bus_routes columns of the trips a run wrote, plus the corporation where
+    # the backend knows it. A trip seen again by a later run carries that
+    # run's id, so a run is exported as soon as it finishes.
+    with storage.cursor() as cursor:
+        normalized = storage.is_normalized(cursor)
+    if normalized:
+        query = (COMPAT_SELECT.replace('SELECT t.id,', 'SELECT r.corporation,').replace('%', '%%')
+                 + "\nWHERE t.crawl_run_id = %s")
+    elif storage.name == 'mysql':
+        raise ValueError("Crawl runs are only recorded on the normalized schema; "
+                         "run `python -m crawler.schema upgrade` first")
+    else:
+        query = f"SELECT {', '.join(COLUMNS)} FROM bus_routes WHERE crawl_run_id = %s"
+    return storage.fetch(query, [run_id])
+
+
+def finished_runs(storage, after=0):
+    frame = storage.fetch("SELECT id FROM crawl_runs WHERE finished_at IS NOT NULL AND id > %s ORDER BY id",
+                          [after])
+    return [int(run_id) for run_id in frame['id']]
+
+
+def exported_runs(path=LAKE_PATH):
+    # Run ids with files in the lake, from the directory names alone
+    runs = set()
+    for directory in glob.glob(os.path.dirname(lake_files(path))):
+        runs.add(int(directory.rsplit('=', 1)[1]))
+    return runs
+
+
+def run_directories(run_id, path=LAKE_PATH):
+    return glob.glob(os.path.join(path or DEFAULT_PATH, '*', '*', f"crawl_run={run_id}"))
+
+
+def export_run(storage, run_id, path=LAKE_PATH, corporations=None):
+    # Writes one run's trips under crawl_run=<run_id>; exporting a run again
+    # replaces its files and leaves every other run alone. The run's old
+    # directories go first, or a trip whose onward date or corporation
+    # changed would be left behind in its old partition.
+    require_pyarrow()
+    frame = run_trips(storage, run_id)
+    if frame.empty:
+        print(f"No trips stamped with crawl run {run_id}; nothing to export")
+        return 0
+    table = to_table(normalize(frame, corporations), run_id)
+    for directory in run_directories(run_id, path):
+        shutil.rmtree(directory)
+        onward = os.path.dirname(directory)
+        for parent in (onward, os.path.dirname(onward)):
+            if not os.listdir(parent):
+                os.rmdir(parent)
+    ds.write_dataset(
+        table, path or DEFAULT_PATH, format='parquet', partitioning=PARTITIONING,
+        basename_template=f"run-{run_id}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+        file_options=ds.ParquetFileFormat().make_write_options(compression='zstd', use_dictionary=True))
+    print(f"Exported {table.num_rows} trips of crawl run {run_id} to {path or DEFAULT_PATH}")
+    return table.num_rows
+
+
+def export_new_runs(storage, path=LAKE_PATH):
+    # Appends every finished run newer than the lake's latest
+    require_pyarrow()
+    latest = max(exported_runs(path), default=0)
+    runs = finished_runs(storage, latest)
+    if not runs:
+        print(f"The lake is up to date (latest crawl run {latest or 'none'})")
+    corporations = corporations_by_route()
+    return sum(export_run(storage, run_id, path, corporations) for run_id in runs)
+
+
+def dataset(path=LAKE_PATH):
+    require_pyarrow()
+    return ds.dataset(path or DEFAULT_PATH, format='parquet', partitioning=PARTITIONING)
+
+
+def partition_filter(corporations=None, onward=None, runs=None):
+    # pyarrow expression on the partition columns only, so files outside it
+    # are never opened; onward is a date or a (first, last) pair
+    conditions = []
+    if corporations:
+        conditions.append(ds.field('corporation').isin(list(corporations)))
+    if onward is not None:
+        first, last = (onward, onward) if isinstance(onward, (date, str)) else (onward[0], onward[-1])
+        conditions.append((ds.field('onward') >= as_date(first)) & (ds.field('onward') <= as_date(last)))
+    if runs:
+        conditions.append(ds.field('crawl_run').isin([int(run_id) for run_id in runs]))
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def as_date(value):
+    # '2024-07-29', '29-Jul-2024' (the route link format), a date or a datetime
+    if isinstance(value, str):
+        return date.fromisoformat(value) if value[:4].isdigit() else datetime.strptime(value, '%d-%b-%Y').date()
+    return value.date() if isinstance(value, datetime) else value
+
+
+def scan(path=LAKE_PATH, corporations=None, onward=None, runs=None, columns=None, latest=True):
+    # Trips as a DataFrame, reading only the matching partitions. With
+    # latest, each trip appears once, as the newest run saw it.
+    #
+    #   scan(corporations=['KSRTC'], onward=('2024-07-29', '2024-07-31'))
+    lake = dataset(path)
+    if columns is not None and latest:
+        columns = list(dict.fromkeys(list(columns) + TRIP_KEY + ['crawl_run']))
+    frame = lake.to_table(columns=columns, filter=partition_filter(corporations, onward, runs)).to_pandas()
+    if latest and not frame.empty:
+        frame = frame.sort_values('crawl_run').drop_duplicates(TRIP_KEY, keep='last').reset_index(drop=True)
+    return frame
+
+
+def status(path=LAKE_PATH):
+    path = path or DEFAULT_PATH
+    if not os.path.isdir(path):
+        print(f"No lake at {path}")
+        return
+    lake = dataset(path)
+    fragments = list(lake.get_fragments())
+    runs = sorted(exported_runs(path))
+    corporations = sorted(unquote(os.path.basename(directory).split('=', 1)[1])
+                          for directory in glob.glob(os.path.join(path, 'corporation=*')))
+    size = sum(os.path.getsize(fragment.path) for fragment in fragments)
+    print(f"{path}: {lake.count_rows()} trips in {len(fragments)} files ({size / 1e6:.1f} MB), "
+          f"{len(runs)} crawl runs ({runs[0] if runs else '-'}..{runs[-1] if runs else '-'}), "
+          f"corporations: {', '.join(corporations) or '-'}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Partitioned Parquet export of crawled trips")
+    parser.add_argument('command', choices=['export', 'status'])
+    parser.add_argument('--path', default=LAKE_PATH or DEFAULT_PATH, help="lake directory")
+    parser.add_argument('--source', default=STORAGE_BACKEND, help="storage backend to export from")
+    parser.add_argument('--source-path')
+    parser.add_argument('--run', type=int, action='append', help="export these runs again (repeatable)")
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        status(args.path)
+    else:
+        from crawler.storage import get_storage
+
+        source = get_storage(args.source, args.source_path, read_only=True)
+        if args.run:
+            corporations = corporations_by_route()
+            for run_id in args.run:
+                export_run(source, run_id, args.path, corporations)
+        else:
+            export_new_runs(source, args.path)
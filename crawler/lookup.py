@@ -0,0 +1,75 @@
+from collections import Counter
+from contextlib import contextmanager
+from selenium.webdriver.common.by import By
+
+# Selector lookups split by whether a bus-item must have them. Every field
+# is looked up with zero wait once the list has loaded, so a bus without a
+# rating or next-day label costs nothing, and each miss is counted instead
+# of surfacing as a swallowed exception. A bus missing a required field is
+# dropped after extraction (LookupStats.missing_required).
+
+# bus-item fields -> class name
+REQUIRED_SELECTORS = {
+    'bus_name': 'travels',
+    'departure_time': 'dp-time',
+    'ticket_fare': 'fare',
+    'seats_availability': 'seat-left',
+}
+
+OPTIONAL_SELECTORS = {
+    'bus_type': 'bus-type',
+    'arrival_time': 'bp-time',
+    'duration': 'dur',
+    'rating': 'rating-sec',
+    'next_day': 'next-day-dp-lbl',
+}
+
+
+class LookupStats:
+    # Per-route tally of bus-items read and selector misses by field
+
+    def __init__(self):
+        self.rows = 0
+        self.misses = Counter()
+
+    def record(self, record):
+        self.rows += 1
+        for field, value in record.items():
+            if value is None:
+                self.misses[field] += 1
+
+    def missing_required(self, record):
+        return [field for field in REQUIRED_SELECTORS if record.get(field) is None]
+
+    def summary(self):
+        if not self.misses:
+            return f"{self.rows} buses, no missing fields"
+        counts = ', '.join(f"{field} {count}" for field, count in self.misses.most_common())
+        return f"{self.rows} buses, missing: {counts}"
+
+
+@contextmanager
+def no_implicit_wait(driver):
+    # Temporarily drop the implicit wait so find_elements returns immediately
+    previous = driver.timeouts.implicit_wait
+    driver.implicitly_wait(0)
+    try:
+        yield
+    finally:
+        driver.implicitly_wait(previous)
+
+
+def find_optional(parent, by, value):
+    # Zero-wait lookup; returns None instead of raising NoSuchElementException
+    elements = parent.find_elements(by, value)
+    return elements[0] if elements else None
+
+
+def read_bus_item(bus):
+    # Element-by-element read of one bus-item, used when the in-page script can't run
+    record = {}
+    for field, class_name in {**REQUIRED_SELECTORS, **OPTIONAL_SELECTORS}.items():
+        element = find_optional(bus, By.CLASS_NAME, class_name)
+        value = element.text.strip() if element is not None else ''
+        record[field] = value or None
+    return record
@@ -0,0 +1,252 @@
+import re
+from collections import Counter
+
+from crawler.rows import CLOCK, DURATION, LABEL_DAY, MAX_LENGTHS, SERVICE_NO, TIME_FORMAT, parse_row
+
+try:
+    import pandas as pd
+except ImportError:  # without pandas, buses are parsed one at a time with rows.parse_row
+    pd = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # fares stay float64 without it
+    pa = None
+
+# Batch form of rows.parse_bus_details. A page's or a run's bus dicts become
+# one DataFrame of raw text columns, and each field is converted for the
+# whole batch at once with pandas string methods and to_datetime instead of
+# strptime/split/float per bus. A value that doesn't convert becomes null in
+# its column and is counted per column, so one bad fare doesn't hide the
+# rest of the bus's fields or stop the batch:
+#
+#   frame, report = normalize_buses(buses)
+#   rows = to_rows(frame)        # bus_routes rows, for storage.write_rows
+#
+# Arrival comes from the departure rather than from the page's date label,
+# see rows.arrival_time().
+#
+# Typed columns: departing_time/reaching_time datetime64, duration_min
+# Int16 (duration keeps the '04h 25m' text the table stores), price
+# decimal(10,2) (float64 without pyarrow), seats_available Int32 and
+# star_rating float32, null for a "New" bus with no rating yet.
+
+RAW_FIELDS = ['bus_route_name', 'bus_route_link', 'bus_name', 'bus_type', 'departure_time', 'arrival_time',
+              'duration', 'ticket_fare', 'seats_availability', 'rating', 'arrival_dt', 'onward']
+
+# Whole-value patterns; group() takes their groups out
+FARE_PREFIX = re.compile(r'^\s*(?:INR|Rs\.?|₹)\s*')
+FARE = re.compile(r'^\d{1,8}(?:\.\d{1,2})?$')    # fits decimal(10,2)
+LEADING_INT = re.compile(r'^\s*(\d+).*$')
+FIRST_WORD = re.compile(r'^(\S+).*$')
+# Ratings read as 'New' on the page; scraper.to_bus_details and the API
+# capture store them as '0.0'
+UNRATED = {'', 'New', '0', '0.0'}
+
+# Columns a row can't be stored without; a bad value anywhere else is
+# reported and stored as the table's default. A route_link or bustype is
+# only bad when longer than rows.MAX_LENGTHS, and then the bus is left out.
+REQUIRED = ['route_name', 'route_link', 'busname', 'bustype', 'departing_time', 'reaching_time', 'price',
+            'seats_available']
+
+EXAMPLES = 3    # bad values shown per column
+
+
+def raw_frame(buses):
+    # Bus dicts as text columns, Arrow-backed where pyarrow is installed so
+    # the string methods below run as Arrow kernels; missing fields are null
+    frame = pd.DataFrame.from_records(list(buses), columns=RAW_FIELDS)
+    return frame.astype('string[pyarrow]' if pa is not None else 'string')
+
+
+def text(column):
+    return column.fillna('').str.strip()
+
+
+def group(column, pattern, number=1):
+    # A group of a whole-value pattern, null where the value doesn't match.
+    # str.replace with a back-reference stays in Arrow; str.extract loops
+    # over the values in Python.
+    return column.str.replace(pattern.pattern, f'\\{number}', regex=True).where(
+        column.str.fullmatch(pattern.pattern))
+
+
+def times(day_and_time):
+    return pd.to_datetime(day_and_time, format=TIME_FORMAT, errors='coerce')
+
+
+def minutes(hours, mins):
+    return (hours.astype('Int32') * 60 + mins.astype('Int32')).astype('Int16')
+
+
+def arrival_times(departing_time, duration_min, arrival, arrival_dt):
+    # (reaching_time, label_mismatch): rows.arrival_time over whole columns.
+    # label_mismatch marks trips whose next-day label disagrees with the
+    # derived date.
+    day = pd.Timedelta(days=1)
+    departure_day = departing_time.dt.normalize()
+    clock = pd.to_timedelta(minutes(group(arrival, CLOCK, 1), group(arrival, CLOCK, 2)), unit='min')
+    on_departure_day = departure_day + clock
+
+    by_duration = departing_time + pd.to_timedelta(duration_min, unit='min')
+    days = ((by_duration - on_departure_day) / day).round()
+
+    label = group(arrival_dt, LABEL_DAY)
+    label_day = pd.to_datetime(label + '-' + departure_day.dt.year.astype('string'),
+                               format='%d-%b-%Y', errors='coerce')
+    label_day = label_day.where(~(label_day < departure_day), label_day + pd.DateOffset(years=1))
+    labelled = label_day.notna() & (label_day != departure_day)
+
+    reaching_time = (on_departure_day + pd.to_timedelta(days, unit='D')) \
+        .fillna((label_day + clock).where(labelled)) \
+        .fillna(on_departure_day + day * (on_departure_day < departing_time)) \
+        .fillna(by_duration)
+    label_mismatch = labelled & days.notna() & (reaching_time.dt.normalize() != label_day)
+    return reaching_time, label_mismatch
+
+
+def longer_than(column, field):
+    return (column.str.len() > MAX_LENGTHS[field]).fillna(False)
+
+
+def too_long(raw):
+    # Masks of the values rows.too_long() rejects, per bus_routes column
+    busname = raw['bus_name'].fillna('')
+    service_no = busname.str.extract(SERVICE_NO.pattern, expand=False)
+    operator = busname.str.replace(SERVICE_NO.pattern, '', regex=True)
+    return {
+        'route_name': longer_than(raw['bus_route_name'], 'route_name'),
+        'route_link': longer_than(raw['bus_route_link'], 'route_link'),
+        'busname': longer_than(operator, 'operator') | longer_than(service_no, 'service_no'),
+        'bustype': longer_than(raw['bus_type'], 'bustype'),
+    }
+
+
+def normalize_raw(raw):
+    # (frame, bad) for a raw_frame(); bad maps each typed column to a mask of
+    # values present in the raw text that didn't convert
+    onward = text(raw['onward'])
+    departure = text(raw['departure_time'])
+    arrival_dt = raw['arrival_dt'].fillna('')
+    arrival = text(raw['arrival_time'])
+
+    # Same default as parse_bus_details: no departure time means midnight
+    departing_time = times(onward + ' ' + departure.where(departure != '', '00:00'))
+
+    duration = raw['duration'].fillna('')
+    duration_min = minutes(group(duration, DURATION, 1), group(duration, DURATION, 2))
+    reaching_time, label_mismatch = arrival_times(departing_time, duration_min, arrival, arrival_dt)
+
+    fare = text(raw['ticket_fare']).str.replace(FARE_PREFIX.pattern, '', regex=True).str.replace(',', '')
+    fare = fare.where(fare.str.fullmatch(FARE.pattern), None)
+    if pa is not None:
+        # Straight from the text, so 449.1 is exactly 449.10
+        price = pd.Series(pd.arrays.ArrowExtensionArray(
+            pa.array(fare, type=pa.string()).cast(pa.decimal128(10, 2))), index=fare.index)
+    else:
+        price = pd.to_numeric(fare, errors='coerce')
+
+    seats = text(raw['seats_availability'])
+    seats_available = group(seats, LEADING_INT).astype('Int32')
+
+    rating = text(raw['rating'])
+    unrated = rating.isin(UNRATED)
+    star_rating = pd.to_numeric(group(rating, FIRST_WORD).where(~unrated), errors='coerce').astype('float32')
+
+    long = too_long(raw)
+    frame = pd.DataFrame({
+        'route_name': raw['bus_route_name'].where(~long['route_name']),
+        'route_link': raw['bus_route_link'].fillna('').where(~long['route_link']),
+        'busname': raw['bus_name'].where(~long['busname']),
+        'bustype': raw['bus_type'].fillna('').where(~long['bustype']),
+        'departing_time': departing_time,
+        'duration': duration,
+        'duration_min': duration_min,
+        'reaching_time': reaching_time,
+        'star_rating': star_rating,
+        'price': price,
+        'seats_available': seats_available,
+    })
+    bad = {
+        'departing_time': departing_time.isna(),
+        'reaching_time': reaching_time.isna(),
+        'duration_min': duration_min.isna() & (duration.str.strip() != ''),
+        'price': price.isna(),
+        'seats_available': seats_available.isna(),
+        'star_rating': star_rating.isna() & ~unrated,
+        'route_name': raw['bus_route_name'].isna() | long['route_name'],
+        'route_link': long['route_link'],
+        'busname': raw['bus_name'].isna() | long['busname'],
+        'bustype': long['bustype'],
+        'next_day_label': label_mismatch,
+    }
+    sources = {
+        'departing_time': onward + ' ' + departure, 'reaching_time': arrival_dt + arrival, 'duration_min': duration,
+        'next_day_label': arrival_dt + arrival + ' after ' + onward + ' ' + departure + ', ' + duration,
+        'price': raw['ticket_fare'], 'seats_available': raw['seats_availability'], 'star_rating': raw['rating'],
+        'route_name': raw['bus_route_name'], 'busname': raw['bus_name'],
+        'route_link': raw['bus_route_link'], 'bustype': raw['bus_type'],
+    }
+    return frame, {column: (mask, sources[column]) for column, mask in bad.items()}
+
+
+def normalize_buses(buses):
+    # (frame, report) for a list of bus dicts. The report maps each column
+    # with bad values to {'bad': count, 'examples': [raw values]}; frame
+    # rows missing a REQUIRED value have ok=False.
+    raw = raw_frame(buses)
+    frame, bad = normalize_raw(raw)
+    report = {}
+    for column, (mask, source) in bad.items():
+        if mask.any():
+            examples = Counter(source[mask].map(repr)).most_common(EXAMPLES)
+            report[column] = {'bad': int(mask.sum()), 'examples': [example for example, _ in examples]}
+    frame['ok'] = frame[REQUIRED].notna().all(axis=1)
+    return frame, report
+
+
+def to_rows(frame):
+    # bus_routes rows (COLUMNS order, plain Python values) for the frame's
+    # storable buses. An unrated bus, or one whose rating didn't convert,
+    # is stored with star_rating 0, as before; the dashboard's
+    # minimum-rating filter leaves those out.
+    frame = frame[frame['ok']]
+    columns = {
+        'route_name': frame['route_name'],
+        'route_link': frame['route_link'],
+        'busname': frame['busname'],
+        'bustype': frame['bustype'],
+        'departing_time': pd.Series(frame['departing_time'].dt.to_pydatetime(), dtype=object),
+        'duration': frame['duration'],
+        'reaching_time': pd.Series(frame['reaching_time'].dt.to_pydatetime(), dtype=object),
+        'star_rating': frame['star_rating'].fillna(0).astype('float64').round(1),
+        'price': frame['price'].astype('float64'),
+        'seats_available': frame['seats_available'].astype('int64'),
+    }
+    values = [list(column) if column.dtype == object else column.tolist() for column in columns.values()]
+    return list(zip(*values))
+
+
+def format_report(report, total, kept):
+    # Buses kept out of the batch, then bad values per column; a bus can
+    # have bad values in several columns and still be stored
+    problems = '; '.join(f"{column} {entry['bad']} ({', '.join(entry['examples'])})"
+                         for column, entry in report.items())
+    return f"{kept} of {total} buses stored" + (f", bad values: {problems}" if problems else '')
+
+
+def parse_rows(buses, label=None):
+    # Drop-in for [parse_row(bus) for bus in buses] minus the failures,
+    # converting the whole batch at once and printing one line per batch
+    # with bad values
+    buses = list(buses)
+    if not buses:
+        return []
+    if pd is None:
+        return [row for row in map(parse_row, buses) if row is not None]
+    frame, report = normalize_buses(buses)
+    rows = to_rows(frame)
+    if report:
+        label = label or buses[0].get('bus_route_name')
+        print(f"{label}: {format_report(report, len(buses), len(rows))}")
+    return rows
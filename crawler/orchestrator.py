@@ -0,0 +1,285 @@
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from urllib.parse import urlsplit
+
+from crawler.catalog import load_routes, route_link
+from crawler.config import CATALOG_PATH, CRAWL_WORKERS, HTTP_WORKERS, RECYCLE_AFTER_ROUTES, MAX_BROWSER_MEMORY_MB
+from crawler.storage import get_storage
+from crawler.write_behind import WriteBehind
+
+# asyncio scheduler for route-date jobs. A global semaphore caps how many
+# jobs run at once, a token bucket per host caps how fast requests leave,
+# and every job has its own timeout. Browser jobs run the blocking Selenium
+# crawl on executor threads, one pooled browser per thread; HTTP jobs run
+# natively on an httpx AsyncClient.
+
+DEFAULT_RATE_PER_HOST = 2.0   # job starts (page loads or API requests) per second
+DEFAULT_BURST = 4
+DEFAULT_JOB_TIMEOUT = 180     # seconds
+
+
+class TokenBucket:
+    # `rate` tokens per second, holding at most `burst`
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Orchestrator:
+
+    def __init__(self, concurrency=8, rate_per_host=DEFAULT_RATE_PER_HOST, burst=DEFAULT_BURST,
+                 job_timeout=DEFAULT_JOB_TIMEOUT, host_rates=None):
+        self.concurrency = concurrency
+        self.rate_per_host = rate_per_host
+        self.burst = burst
+        self.job_timeout = job_timeout
+        self.host_rates = host_rates or {}
+        self.buckets = {}
+        self.results = []   # every finished job's result, cancelled ones included
+
+    def bucket(self, host):
+        if host not in self.buckets:
+            rate = self.host_rates.get(host, self.rate_per_host)
+            self.buckets[host] = TokenBucket(rate, max(1, self.burst))
+        return self.buckets[host]
+
+    async def run(self, jobs, worker):
+        # worker(job) is a coroutine returning the number of buses stored;
+        # job['host'] picks the rate limit it is charged against
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.time()
+
+        async def run_job(job):
+            async with semaphore:
+                await self.bucket(job['host']).acquire()
+                job_started = time.time()
+                try:
+                    buses = await asyncio.wait_for(worker(job), self.job_timeout)
+                    status, error = 'ok', None
+                except asyncio.TimeoutError:
+                    buses, status, error = 0, 'timeout', f"no result after {self.job_timeout}s"
+                except asyncio.CancelledError:
+                    # Recorded, then passed on so the crawl really stops
+                    self.results.append({'job': job, 'status': 'cancelled', 'buses': 0, 'error': None,
+                                         'elapsed': time.time() - job_started})
+                    raise
+                except Exception as e:
+                    buses, status, error = 0, 'failed', str(e)
+                result = {'job': job, 'status': status, 'buses': buses, 'error': error,
+                          'elapsed': time.time() - job_started}
+                self.results.append(result)
+                if error:
+                    print(f"{job['label']}: {status} ({error})")
+                return result
+
+        tasks = [asyncio.create_task(run_job(job)) for job in jobs]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # On cancellation, stop whatever has not finished yet
+            for task in tasks:
+                task.cancel()
+            print(f"Ran {len(jobs)} jobs in {time.time() - started:.0f}s")
+
+
+class BrowserWorkers:
+    # Executor threads, each paired with one pooled browser slot. Without
+    # store, routes are crawled and parsed but nothing is written.
+
+    def __init__(self, size, settings, store=True):
+        from crawler.driver_pool import PooledDriver, make_driver
+
+        self.settings = settings
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='browser')
+        factory = lambda: make_driver(settings['headless'], settings['block_resources'],
+                                      settings['extract'] == 'api')
+        self.slots = asyncio.Queue()
+        for _ in range(size):
+            self.slots.put_nowait(PooledDriver(factory, settings['recycle_after'], settings['max_browser_mb']))
+
+    async def __call__(self, job):
+        from crawler.engine import crawl_and_store, crawl_route
+
+        loop = asyncio.get_running_loop()
+        slot = await self.slots.get()
+        settings = {**self.settings, 'onward': job['onward']}
+
+        def crawl():
+            if self.store:
+                buses = crawl_and_store(slot.get(), job['route'], settings)
+            else:
+                buses = len(crawl_route(slot.get(), job['route'], settings))
+            slot.route_finished()
+            return buses
+
+        future = loop.run_in_executor(self.executor, crawl)
+        try:
+            return await asyncio.shield(future)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # Closing the browser aborts the WebDriver call the thread is stuck in
+            await loop.run_in_executor(None, slot.quit)
+            with suppress(Exception):
+                await future
+            raise
+        except Exception:
+            await loop.run_in_executor(None, slot.route_failed)
+            raise
+        finally:
+            self.slots.put_nowait(slot)
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        while not self.slots.empty():
+            await loop.run_in_executor(None, self.slots.get_nowait().quit)
+        self.executor.shutdown(wait=False)
+
+
+class HttpWorkers:
+
+    def __init__(self, seed, size, base_url=None, writer=None):
+        from crawler.http_engine import make_async_client
+
+        self.seed = seed
+        self.base_url = base_url
+        self.writer = writer
+        self.client = make_async_client(seed, size)
+
+    async def __call__(self, job):
+        from crawler.http_engine import fetch_route_async
+
+        buses = await fetch_route_async(self.client, self.seed, job['route'], job['onward'], self.base_url)
+        if self.writer:
+            # put() blocks while the write-behind queue is full; keep it off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self.writer.put, buses)
+        return len(buses)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def make_jobs(routes, onwards, host_of):
+    jobs = []
+    for route in routes:
+        for onward in onwards or [None]:
+            onward = onward or route['onward']
+            jobs.append({
+                'route': route,
+                'onward': onward,
+                'host': host_of(route, onward),
+                'label': f"{route['route_name']} ({route['operator']}) {onward}",
+            })
+    return jobs
+
+
+async def crawl(routes, engine='browser', onwards=None, concurrency=None, rate_per_host=DEFAULT_RATE_PER_HOST,
+                burst=DEFAULT_BURST, job_timeout=DEFAULT_JOB_TIMEOUT, settings=None, seed=None, base_url=None,
+                store=True):
+    loop = asyncio.get_running_loop()
+    writer = None
+    storage = get_storage() if store else None
+    if engine == 'browser':
+        from crawler.engine import make_settings
+
+        settings = make_settings(**(settings or {}))
+    run_id = (settings or {}).get('run_id')
+    if store:
+        # Labelled like engine.run's crawl runs
+        await loop.run_in_executor(None, storage.start_run, engine, run_id)
+        writer = WriteBehind().start()
+    if engine == 'browser':
+        settings['writer'] = writer
+        size = concurrency or settings['workers']
+        workers = BrowserWorkers(size, settings, store)
+        host_of = lambda route, onward: urlsplit(route_link(route, onward)).netloc
+    else:
+        size = concurrency or HTTP_WORKERS
+        workers = HttpWorkers(seed, size, base_url, writer)
+        host_of = lambda route, onward: urlsplit(base_url or seed['template']['url']).netloc
+
+    orchestrator = Orchestrator(size, rate_per_host, burst, job_timeout)
+    jobs = make_jobs(routes, onwards, host_of)
+    try:
+        results = await orchestrator.run(jobs, workers)
+    finally:
+        await workers.close()
+        if writer:
+            await loop.run_in_executor(None, writer.close)
+        if store:
+            await loop.run_in_executor(None, storage.finish_run)
+
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    stored = sum(result['buses'] for result in results)
+    print(f"{engine} jobs: {summary}, {stored} buses")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl route-dates with bounded concurrency and per-host rate limits")
+    parser.add_argument('--engine', choices=['browser', 'http'], default='browser')
+    parser.add_argument('--catalog', default=CATALOG_PATH)
+    parser.add_argument('--corporation', action='append')
+    parser.add_argument('--operator', action='append')
+    parser.add_argument('--mode', choices=['govt', 'private'])
+    parser.add_argument('--onward', action='append', help="onward date(s), repeatable (default: catalog date)")
+    parser.add_argument('--concurrency', type=int,
+                        help=f"jobs in flight (default: {CRAWL_WORKERS} browsers or {HTTP_WORKERS} HTTP requests)")
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE_PER_HOST, help="requests per second per host")
+    parser.add_argument('--burst', type=int, default=DEFAULT_BURST, help="token bucket size per host")
+    parser.add_argument('--job-timeout', type=float, default=DEFAULT_JOB_TIMEOUT, help="seconds before a job is abandoned")
+    parser.add_argument('--recycle-after', type=int, default=RECYCLE_AFTER_ROUTES)
+    parser.add_argument('--max-browser-mb', type=int, default=MAX_BROWSER_MEMORY_MB)
+    parser.add_argument('--extract', choices=['dom', 'api'], default='dom')
+    parser.add_argument('--archive', metavar='DIR', help="browser engine: archive scrolled route pages here")
+    parser.add_argument('--run-id', help="crawl run label and archive key (default with --archive: start time)")
+    parser.add_argument('--seed', metavar='FILE', help="HTTP engine: saved seed (default: seed from one browser)")
+    parser.add_argument('--base-url', help="HTTP engine: send requests to this host instead")
+    parser.add_argument('--no-store', action='store_true', help="fetch and parse only, write nothing")
+    args = parser.parse_args(argv)
+
+    routes = load_routes(args.catalog, corporations=args.corporation, mode=args.mode, operators=args.operator)
+    if not routes:
+        print("No routes match the given filters")
+        return
+
+    seed = None
+    if args.engine == 'http':
+        if args.seed:
+            with open(args.seed, encoding='utf-8') as f:
+                seed = json.load(f)
+        else:
+            from crawler.http_engine import seed_with_browser
+            seed = seed_with_browser(routes[0])
+
+    settings = {'recycle_after': args.recycle_after, 'max_browser_mb': args.max_browser_mb, 'extract': args.extract,
+                'archive': args.archive, 'run_id': args.run_id}
+    try:
+        asyncio.run(crawl(routes, args.engine, args.onward, args.concurrency, args.rate, args.burst,
+                          args.job_timeout, settings, seed, args.base_url, not args.no_store))
+    except KeyboardInterrupt:
+        print("Cancelled")
+
+
+if __name__ == '__main__':
+    main()
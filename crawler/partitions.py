@@ -0,0 +1,213 @@
+import argparse
+from datetime import date, datetime, timedelta
+
+from crawler.config import db_config, PARTITION_DAYS_AHEAD, PARTITION_RETENTION_DAYS
+
+# trips is range-partitioned on departing_time, one partition per departure
+# day (p20240729 holds departures on 29-Jul-2024), plus pfuture for anything
+# past the last day. Queries with a departing_time range only open the days
+# they cover, and old days are dropped or archived a partition at a time
+# instead of with a DELETE over the whole table.
+#
+# MySQL doesn't allow FOREIGN KEYs on partitioned tables, and every unique
+# key must contain departing_time, so trips has PRIMARY KEY (id, departing_time)
+# and no foreign keys; the merge in schema.py only ever writes ids it has
+# just looked up.
+#
+# Run `maintain` daily, e.g. from cron before the crawl:
+#
+#   python -m crawler.partitions maintain                       # add upcoming days
+#   python -m crawler.partitions maintain --retention 90        # ... and drop days over 90 days old
+#   python -m crawler.partitions maintain --retention 90 --archive   # ... or move them to trips_archive_YYYYMMDD
+#   python -m crawler.partitions status
+
+FUTURE = 'pfuture'
+DAY_FORMAT = 'p%Y%m%d'
+ARCHIVE_FORMAT = 'trips_archive_%Y%m%d'
+
+PARTITION_CLAUSE = f"PARTITION BY RANGE COLUMNS (departing_time) (PARTITION {FUTURE} VALUES LESS THAN (MAXVALUE))"
+
+
+def partition_day(name):
+    # Departure day held by a daily partition, None for pfuture
+    try:
+        return datetime.strptime(name, DAY_FORMAT).date()
+    except ValueError:
+        return None
+
+
+def partition_definition(day):
+    return f"PARTITION {day.strftime(DAY_FORMAT)} VALUES LESS THAN ('{day + timedelta(days=1)} 00:00:00')"
+
+
+def list_partitions(cursor, table='trips'):
+    # [(name, rows)] in partition order; [] when the table isn't partitioned
+    cursor.execute("SELECT PARTITION_NAME, TABLE_ROWS FROM information_schema.PARTITIONS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+                   "ORDER BY PARTITION_ORDINAL_POSITION", (table,))
+    return [(name, rows) for name, rows in cursor.fetchall()]
+
+
+def is_partitioned(cursor, table='trips'):
+    return bool(list_partitions(cursor, table))
+
+
+def foreign_keys(cursor, table='trips'):
+    cursor.execute("SELECT CONSTRAINT_NAME FROM information_schema.TABLE_CONSTRAINTS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_TYPE = 'FOREIGN KEY'",
+                   (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def table_exists(cursor, table):
+    cursor.execute("SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                   (table,))
+    return cursor.fetchone()[0] > 0
+
+
+def archive_statements(cursor, name, table):
+    # Moves partition `name` into its own table. An archive table left by an
+    # interrupted earlier run is reused: unpartitioned only if it still is,
+    # and if it already holds the exchanged rows, whatever the partition has
+    # left is copied over instead of exchanged back.
+    exchange = f"ALTER TABLE trips EXCHANGE PARTITION {name} WITH TABLE {table}"
+    drop = f"ALTER TABLE trips DROP PARTITION {name}"
+    if not table_exists(cursor, table):
+        return [f"CREATE TABLE {table} LIKE trips", f"ALTER TABLE {table} REMOVE PARTITIONING", exchange, drop]
+    statements = []
+    if is_partitioned(cursor, table):
+        statements.append(f"ALTER TABLE {table} REMOVE PARTITIONING")
+    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+    if cursor.fetchone()[0]:
+        statements.append(f"INSERT INTO {table} SELECT * FROM trips PARTITION ({name})")
+    else:
+        statements.append(exchange)
+    return statements + [drop]
+
+
+def partition_steps(cursor):
+    # Turns an unpartitioned trips table (created before partitioning) into
+    # one with just pfuture; maintenance_steps() then splits it into days
+    steps = []
+    keys = foreign_keys(cursor)
+    if keys:
+        steps.append(("drop foreign keys on trips",
+                      "ALTER TABLE trips " + ', '.join(f"DROP FOREIGN KEY {key}" for key in keys)))
+    steps.append(("add departing_time to the trips primary key",
+                  "ALTER TABLE trips DROP PRIMARY KEY, ADD PRIMARY KEY (id, departing_time)"))
+    steps.append(("partition trips by departure day", f"ALTER TABLE trips {PARTITION_CLAUSE}"))
+    return steps
+
+
+def departure_days(cursor, after=None):
+    # Distinct departure days stored past the last daily partition (all of
+    # them the first time); a range scan on idx_departing
+    if after is None:
+        cursor.execute("SELECT DISTINCT DATE(departing_time) FROM trips")
+    else:
+        cursor.execute("SELECT DISTINCT DATE(departing_time) FROM trips WHERE departing_time >= %s",
+                       (after + timedelta(days=1),))
+    return sorted(row[0] for row in cursor.fetchall())
+
+
+def maintenance_steps(cursor, ahead=PARTITION_DAYS_AHEAD, retention=PARTITION_RETENTION_DAYS, archive=False,
+                      today=None):
+    # Statements that add daily partitions for today through today + ahead,
+    # and for any later day that already has trips in pfuture, then remove
+    # days that ended more than `retention` days ago (None keeps everything)
+    today = today or date.today()
+    days = [day for day in (partition_day(name) for name, _ in list_partitions(cursor)) if day]
+    last = days[-1] if days else None
+
+    steps = []
+    upcoming = {today + timedelta(days=n) for n in range(ahead + 1)}
+    # Days without trips between two partitions need none of their own: a
+    # range partition holds everything from the previous bound up to its own
+    new_days = sorted(day for day in upcoming.union(departure_days(cursor, last)) if last is None or day > last)
+    if new_days:
+        # Splitting pfuture only moves the rows it holds, none once maintenance runs daily
+        definitions = ',\n  '.join([partition_definition(day) for day in new_days] +
+                                   [f"PARTITION {FUTURE} VALUES LESS THAN (MAXVALUE)"])
+        steps.append((f"add partitions {new_days[0]} to {new_days[-1]}",
+                      f"ALTER TABLE trips REORGANIZE PARTITION {FUTURE} INTO (\n  {definitions}\n)"))
+
+    if retention is None:
+        return steps
+    cutoff = today - timedelta(days=retention)
+    for day in [day for day in days if day < cutoff]:
+        name = day.strftime(DAY_FORMAT)
+        if archive:
+            table = day.strftime(ARCHIVE_FORMAT)
+            steps.append((f"archive {name} to {table}", archive_statements(cursor, name, table)))
+        else:
+            steps.append((f"drop {name}", f"ALTER TABLE trips DROP PARTITION {name}"))
+    return steps
+
+
+def run_steps(cursor, steps, dry_run=False):
+    # Partition DDL commits implicitly
+    for name, statements in steps:
+        print(f"-- {name}")
+        for statement in statements if isinstance(statements, list) else [statements]:
+            print(f"{statement};")
+            if not dry_run:
+                cursor.execute(statement)
+
+
+def maintain(ahead=PARTITION_DAYS_AHEAD, retention=PARTITION_RETENTION_DAYS, archive=False, dry_run=False):
+    import mysql.connector
+
+    connection = mysql.connector.connect(**db_config)
+    try:
+        cursor = connection.cursor()
+        if not is_partitioned(cursor):
+            print("trips is not partitioned; run `python -m crawler.schema upgrade` first")
+            return
+        steps = maintenance_steps(cursor, ahead, retention, archive)
+        if not steps:
+            print("Partitions are up to date")
+        run_steps(cursor, steps, dry_run)
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def status():
+    import mysql.connector
+
+    connection = mysql.connector.connect(**db_config)
+    try:
+        cursor = connection.cursor()
+        partitions = list_partitions(cursor)
+        if not partitions:
+            print("trips is not partitioned")
+        for name, rows in partitions:
+            # TABLE_ROWS is InnoDB's estimate
+            print(f"{name}: ~{rows} rows")
+        cursor.execute("SELECT TABLE_NAME FROM information_schema.TABLES "
+                       "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE %s ORDER BY TABLE_NAME",
+                       ('trips\\_archive\\_%',))
+        archived = [row[0] for row in cursor.fetchall()]
+        if archived:
+            print(f"Archived days: {', '.join(archived)}")
+        cursor.close()
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain the daily partitions of the trips table")
+    parser.add_argument('command', choices=['maintain', 'status'])
+    parser.add_argument('--ahead', type=int, default=PARTITION_DAYS_AHEAD,
+                        help="days past today to have partitions for")
+    parser.add_argument('--retention', type=int, default=PARTITION_RETENTION_DAYS,
+                        help="keep departure days this many days back (default: keep all)")
+    parser.add_argument('--archive', action='store_true',
+                        help="move expired days to trips_archive_YYYYMMDD tables instead of dropping them")
+    parser.add_argument('--dry-run', action='store_true', help="print the statements without running them")
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        status()
+    else:
+        maintain(args.ahead, args.retention, args.archive, args.dry_run)
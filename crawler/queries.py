@@ -0,0 +1,177 @@
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+from crawler.config import db_config
+from crawler.rows import split_busname
+from crawler.schema import COMPAT_SELECT, is_normalized
+
+# Filter query behind the Streamlit dashboard, shared with the EXPLAIN check
+# below so the check always sees exactly what the app runs.
+#
+# Conditions are written against base columns only: departing_time as a
+# half-open range (>= first day, < day after the last) instead of
+# DATE(departing_time) BETWEEN, and on the normalized schema busname as its
+# (operator, service_no) parts, since the view's computed busname can't
+# use an index.
+#
+#   python -m crawler.queries check          # exits 1 if a filter falls back to a full scan,
+#                                            # or there are no trips to build filters from
+#   python -m crawler.queries check --show   # prints every plan
+
+# Columns per schema; the normalized ones match COMPAT_SELECT's aliases
+COLUMNS = {
+    False: {'route_name': 'route_name', 'busname': 'busname', 'bustype': 'bustype',
+            'star_rating': 'star_rating', 'price': 'price', 'departing_time': 'departing_time'},
+    True: {'route_name': 'r.route_name', 'busname': '(o.name, t.service_no)', 'bustype': 'b.name',
+           'star_rating': 't.star_rating', 'price': 't.price', 'departing_time': 't.departing_time'},
+}
+
+# Tables that must never be read in full by a filter query: (alias or name)
+LARGE_TABLES = {'t', 'trips', 'bus_routes', 'bus_routes_legacy'}
+
+
+def placeholders(values, each='%s'):
+    return ','.join([each] * len(values))
+
+
+def as_day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def build_filter_query(route_names=(), busnames=(), bustypes=(), min_rating=None, price_range=None,
+                       date_range=None, normalized=False):
+    # Returns (query, params)
+    columns = COLUMNS[normalized]
+    if normalized:
+        # The SELECT runs with params, so its DATE_FORMAT % signs are escaped
+        query = COMPAT_SELECT.replace('%', '%%') + "\nWHERE 1=1"
+    else:
+        query = "SELECT * FROM bus_routes WHERE 1=1"
+    params = []
+
+    if route_names:
+        query += f" AND {columns['route_name']} IN ({placeholders(route_names)})"
+        params.extend(route_names)
+    if busnames:
+        if normalized:
+            query += f" AND {columns['busname']} IN ({placeholders(busnames, '(%s, %s)')})"
+            for busname in busnames:
+                params.extend(split_busname(busname))
+        else:
+            query += f" AND {columns['busname']} IN ({placeholders(busnames)})"
+            params.extend(busnames)
+    if bustypes:
+        query += f" AND {columns['bustype']} IN ({placeholders(bustypes)})"
+        params.extend(bustypes)
+
+    if min_rating:
+        query += f" AND {columns['star_rating']} >= %s"
+        params.append(min_rating)
+
+    if price_range:
+        query += f" AND {columns['price']} BETWEEN %s AND %s"
+        params.extend([price_range[0], price_range[-1]])
+
+    if date_range:
+        # date_input gives a single date while the end of a range is being picked
+        first, last = as_day(date_range[0]), as_day(date_range[-1])
+        query += f" AND {columns['departing_time']} >= %s AND {columns['departing_time']} < %s"
+        params.extend([first, last + timedelta(days=1)])
+
+    return query, params
+
+
+def filter_options(cursor, normalized=False):
+    # Sidebar choices and ranges, without reading every trip into the app
+    if normalized:
+        queries = {
+            'route_name': "SELECT route_name FROM routes ORDER BY route_name",
+            'busname': "SELECT DISTINCT IF(t.service_no = '', o.name, CONCAT(o.name, ' - ', t.service_no)) "
+                       "FROM trips t JOIN operators o ON o.id = t.operator_id ORDER BY 1",
+            'bustype': "SELECT name FROM bus_types ORDER BY name",
+        }
+        ranges = "SELECT MIN(price), MAX(price), MIN(departing_time), MAX(departing_time) FROM trips"
+    else:
+        queries = {column: f"SELECT DISTINCT {column} FROM bus_routes ORDER BY 1"
+                   for column in ('route_name', 'busname', 'bustype')}
+        ranges = "SELECT MIN(price), MAX(price), MIN(departing_time), MAX(departing_time) FROM bus_routes"
+
+    options = {}
+    for key, query in queries.items():
+        cursor.execute(query)
+        options[key] = [row[0] for row in cursor.fetchall()]
+    cursor.execute(ranges)
+    options['min_price'], options['max_price'], options['min_departing'], options['max_departing'] = \
+        cursor.fetchone()
+    return options
+
+
+def sample_filters(cursor, normalized):
+    # Selective filter combinations built from values in the data, as a
+    # user would pick them in the sidebar
+    options = filter_options(cursor, normalized)
+    if not options['route_name'] or options['min_departing'] is None:
+        return []
+    day = as_day(options['min_departing'])
+    week = (day, day + timedelta(days=6))
+    price_range = (options['min_price'], options['max_price'])
+    return [
+        ('one day', dict(date_range=(day, day))),
+        ('one day, rating and price', dict(min_rating=4.0, price_range=price_range, date_range=(day, day))),
+        ('route, one week', dict(route_names=options['route_name'][:1], date_range=week)),
+        ('routes, one day', dict(route_names=options['route_name'][:3], date_range=(day, day))),
+        ('bus name, one week', dict(busnames=options['busname'][:1], date_range=week)),
+        ('bus type, one day', dict(bustypes=options['bustype'][:1], date_range=(day, day))),
+    ]
+
+
+def explain(cursor, query, params):
+    cursor.execute("EXPLAIN " + query, tuple(params))
+    columns = [column[0].lower() for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def full_scans(plan):
+    # ALL is a table scan, index a scan of a whole index
+    return [step for step in plan if step.get('table') in LARGE_TABLES and step.get('type') in ('ALL', 'index')]
+
+
+def check(show=False):
+    import mysql.connector
+
+    connection = mysql.connector.connect(**db_config)
+    try:
+        cursor = connection.cursor()
+        normalized = is_normalized(cursor)
+        if not normalized:
+            print("bus_routes is not normalized yet; run `python -m crawler.schema upgrade` for the index plan")
+        cases = sample_filters(cursor, normalized)
+        if not cases:
+            # Nothing to EXPLAIN isn't a pass: a fresh database would hide a missing index
+            print("FAIL  no trips to build filters from; load some before checking the plans")
+            return False
+
+        passed = True
+        for name, filters in cases:
+            query, params = build_filter_query(normalized=normalized, **filters)
+            plan = explain(cursor, query, params)
+            scans = full_scans(plan)
+            passed = passed and not scans
+            print(f"{'FAIL' if scans else 'ok'}  {name}")
+            for step in plan if show or scans else []:
+                print(f"      {step.get('table')}: type={step.get('type')} key={step.get('key')} "
+                      f"partitions={step.get('partitions')} rows={step.get('rows')} {step.get('extra') or ''}")
+        cursor.close()
+    finally:
+        connection.close()
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Dashboard filter query tools")
+    parser.add_argument('command', choices=['check'])
+    parser.add_argument('--show', action='store_true', help="print the plan of every filter, not only failures")
+    args = parser.parse_args()
+
+    sys.exit(0 if check(args.show) else 1)
@@ -0,0 +1,139 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from crawler.lookup import REQUIRED_SELECTORS, OPTIONAL_SELECTORS, LookupStats
+from crawler.scraper import to_bus_details
+from crawler.snapshots import load_index, latest_run, read_snapshot
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# Re-extracts trips from archived route pages (crawler/snapshots.py) with a
+# C-backed HTML parser instead of a browser. Records come out in the same
+# shape as the in-page extractor's, so field handling changes (ratings,
+# next-day labels, fares) can be replayed over a whole crawl run:
+#
+#   python -m crawler.reparse snapshots/ --run 20240729T061500 --workers 8
+
+BUS_ITEM_FIELDS = {**REQUIRED_SELECTORS, **OPTIONAL_SELECTORS}
+
+
+def clean_text(text):
+    # Collapse whitespace the way innerText would
+    text = ' '.join((text or '').split())
+    return text or None
+
+
+def has_class_xpath(class_name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')"
+
+
+def records_with_selectolax(html):
+    records = []
+    for item in LexborHTMLParser(html).css('.bus-item'):
+        record = {}
+        for field, class_name in BUS_ITEM_FIELDS.items():
+            node = item.css_first('.' + class_name)
+            record[field] = clean_text(node.text(deep=True)) if node is not None else None
+        records.append(record)
+    return records
+
+
+def records_with_lxml(html):
+    records = []
+    tree = lxml.html.fromstring(html)
+    for item in tree.xpath(f"//*[{has_class_xpath('bus-item')}]"):
+        record = {}
+        for field, class_name in BUS_ITEM_FIELDS.items():
+            nodes = item.xpath(f".//*[{has_class_xpath(class_name)}]")
+            record[field] = clean_text(nodes[0].text_content()) if nodes else None
+        records.append(record)
+    return records
+
+
+PARSERS = {'selectolax': records_with_selectolax, 'lxml': records_with_lxml}
+
+
+def pick_parser(name='auto'):
+    if name == 'auto':
+        name = 'selectolax' if LexborHTMLParser is not None else 'lxml'
+    if (name == 'selectolax' and LexborHTMLParser is None) or (name == 'lxml' and lxml is None):
+        raise ImportError("Offline parsing needs selectolax or lxml (pip install selectolax)")
+    return name
+
+
+def reparse_entry(job):
+    # Runs in a worker process; returns (entry, buses, summary)
+    archive_dir, entry, parser = job
+    html = read_snapshot(archive_dir, entry)
+    stats = LookupStats()
+    buses = []
+    for record in PARSERS[parser](html):
+        stats.record(record)
+        if not stats.missing_required(record):
+            buses.append(to_bus_details(record, entry['route_name'], entry['route_link'], entry['onward']))
+    return entry, buses, stats.summary()
+
+
+def reparse(archive_dir, entries, workers=None, parser='auto', store=False, verbose=False):
+    parser = pick_parser(parser)
+    jobs = [(archive_dir, entry, parser) for entry in entries]
+    started = time.time()
+    total = 0
+    writer = None
+    if store:
+        from crawler.storage import get_storage
+        from crawler.write_behind import WriteBehind
+
+        storage = get_storage()
+        storage.start_run('reparse', entries[0]['run_id'] if entries else None)
+        writer = WriteBehind().start()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(jobs) // ((workers or os.cpu_count() or 1) * 4))
+        for entry, buses, summary in executor.map(reparse_entry, jobs, chunksize=chunksize):
+            print(f"{entry['route_name']} ({entry['operator']}) {entry['onward']}: {summary}")
+            total += len(buses)
+            if verbose:
+                for bus_details in buses:
+                    print(bus_details)
+            if writer:
+                writer.put(buses)
+    if writer:
+        writer.close()
+        storage.finish_run()
+
+    print(f"Re-parsed {len(jobs)} pages ({total} buses) in {time.time() - started:.1f}s with {parser}")
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-extract trips from archived RedBus route pages")
+    parser.add_argument('archive_dir')
+    parser.add_argument('--run', help="crawl run id (default: latest run in the archive)")
+    parser.add_argument('--corporation', action='append')
+    parser.add_argument('--operator', action='append')
+    parser.add_argument('--workers', type=int, help="parser processes (default: one per CPU)")
+    parser.add_argument('--parser', choices=['auto', 'selectolax', 'lxml'], default='auto')
+    parser.add_argument('--store', action='store_true', help="insert the re-extracted trips into the database")
+    parser.add_argument('--verbose', action='store_true', help="print every re-extracted bus")
+    args = parser.parse_args(argv)
+
+    run_id = args.run or latest_run(args.archive_dir)
+    entries = load_index(args.archive_dir, run_id, args.corporation, args.operator)
+    if not entries:
+        print(f"No archived pages for run {run_id} in {args.archive_dir}")
+        return
+    reparse(args.archive_dir, entries, args.workers, args.parser, args.store, args.verbose)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from crawler.api_capture import is_search_response
+from crawler.catalog import load_routes
+from crawler.config import CATALOG_PATH
+
+# Local stand-in for the RedBus search API. Serves the responses saved by
+# `python -m crawler --extract api --record-api DIR` so the HTTP engine can
+# be exercised without touching the live site. Each page of a route-date is
+# served from its own recording, and a page past the last one is empty:
+#
+#   python -m crawler.replay_server recorded/ --port 8765 --write-seed stand_in_seed.json
+#   python -m crawler.http_engine --seed stand_in_seed.json --base-url http://127.0.0.1:8765 --no-store
+
+STAND_IN_TEMPLATE = {
+    'method': 'GET',
+    'url': 'http://127.0.0.1/search/SearchResults?fromCity={from_city_id}&toCity={to_city_id}&DOJ={onward}'
+           '&page={page}',
+    'post_data': None,
+    'paging': 'page',
+    'first_page': 0,
+}
+
+
+def stand_in_seed():
+    return {'cookies': {}, 'headers': {'Accept': 'application/json'}, 'template': STAND_IN_TEMPLATE}
+
+
+def make_handler(record_dir, slugs):
+    class ReplayHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, like the real site
+
+        def do_GET(self):
+            self.serve(parse_qs(urlsplit(self.path).query))
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            params = parse_qs(urlsplit(self.path).query)
+            try:
+                params.update({k: [str(v)] for k, v in json.loads(body or b'{}').items()})
+            except ValueError:
+                pass
+            self.serve(params)
+
+        def serve(self, params):
+            if not is_search_response(self.path):
+                return self.reply(404, {'error': 'not a search request'})
+            key = (params.get('fromCity', [''])[0], params.get('toCity', [''])[0])
+            slug = slugs.get(key)
+            onward = params.get('DOJ', [''])[0]
+            page = params.get('page', ['0'])[0]
+            path = os.path.join(record_dir, f"{slug}_{onward}_{page}.json")
+            if slug is None or not os.path.exists(os.path.join(record_dir, f"{slug}_{onward}_0.json")):
+                return self.reply(404, {'error': f"no recording for {key} on {onward}"})
+            if not os.path.exists(path):
+                return self.reply(200, {'data': {'inv': []}})
+            with open(path, 'rb') as f:
+                self.reply(200, f.read())
+
+        def reply(self, status, body):
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ReplayHandler
+
+
+def make_server(record_dir, host='127.0.0.1', port=8765, catalog=CATALOG_PATH):
+    slugs = {(route['from_city_id'], route['to_city_id']): route['slug'] for route in load_routes(catalog)}
+    return ThreadingHTTPServer((host, port), make_handler(record_dir, slugs))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve recorded search responses on a local port")
+    parser.add_argument('record_dir')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--write-seed', metavar='FILE', help="write a seed file pointing at this server")
+    args = parser.parse_args()
+
+    if args.write_seed:
+        with open(args.write_seed, 'w', encoding='utf-8') as f:
+            json.dump(stand_in_seed(), f, indent=2)
+    server = make_server(args.record_dir, args.host, args.port)
+    print(f"Replaying {args.record_dir} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Exiting...")
+    finally:
+        server.server_close()
@@ -0,0 +1,125 @@
+import re
+from datetime import datetime, timedelta
+
+# Scraped bus dicts to bus_routes rows, one bus at a time. Kept free of any
+# database driver so the parsers, the embedded backends, the lake and the
+# dump importer load without mysql-connector installed.
+
+# Column order of a bus_routes row
+COLUMNS = ('route_name', 'route_link', 'busname', 'bustype', 'departing_time', 'duration',
+           'reaching_time', 'star_rating', 'price', 'seats_available')
+
+TIME_FORMAT = '%d-%b-%Y %H:%M'
+
+# Whole-value patterns, shared with the batch parser in crawler/normalize.py
+DURATION = re.compile(r'^\s*(\d+)h\s*(\d+)m\s*$')
+CLOCK = re.compile(r'^\s*(\d{1,2}):(\d{2})\s*$')
+# Day and month of a next-day label ('14-Jul'); the per-route scripts append
+# '-2024 ', older scraper output the onward year
+LABEL_DAY = re.compile(r'^\s*(\d{1,2}-[A-Za-z]{3})\b.*$')
+
+# Same split as schema.SERVICE_NO_PATTERN: government buses read
+# '<operator label> - <service number>'
+SERVICE_NO = re.compile(r' - ([0-9][0-9A-Za-z/]*)$')
+
+# Longest text the normalized MySQL tables take (crawler/schema.py). A bus
+# with a longer value is left out and reported like any other bad value;
+# in strict mode MySQL would otherwise fail the merge of its whole batch.
+MAX_LENGTHS = {'route_name': 160, 'route_link': 500, 'operator': 120, 'service_no': 16, 'bustype': 150}
+
+
+def split_busname(busname):
+    # 'SETC - 325UD' -> ('SETC', '325UD'); names without a service number keep ''
+    match = SERVICE_NO.search(busname)
+    if match is None:
+        return busname, ''
+    return busname[:match.start()], match.group(1)
+
+
+def too_long(route_name, route_link, busname, bustype):
+    # Fields longer than MAX_LENGTHS allows; busname is checked as its
+    # operator and service number parts
+    operator, service_no = split_busname(busname)
+    values = {'route_name': route_name, 'route_link': route_link, 'operator': operator, 'service_no': service_no,
+              'bustype': bustype}
+    return [field for field, value in values.items() if len(value or '') > MAX_LENGTHS[field]]
+
+
+def duration_minutes(duration):
+    # '04h 10m' -> 250, None when it doesn't read as a duration
+    match = DURATION.match(duration or '')
+    return int(match.group(1)) * 60 + int(match.group(2)) if match else None
+
+
+def label_date(arrival_dt, departure_day):
+    # The next-day label's date with the departure's year, or the next year
+    # when that lands before the departure (01-Jan after a 31-Dec departure)
+    match = LABEL_DAY.match(arrival_dt or '')
+    if not match:
+        return None
+    try:
+        day = datetime.strptime(f"{match.group(1)}-{departure_day.year}", '%d-%b-%Y')
+    except ValueError:
+        return None
+    return day if day >= departure_day else day.replace(year=day.year + 1)
+
+
+def arrival_time(departing_time, duration_min, arrival, arrival_dt):
+    # The page shows the arrival clock time, the duration and, for some
+    # trips, a next-day label ('14-Jul'). The clock time is taken on the day
+    # that departure + duration lands on, which gets overnight and multi-day
+    # trips right whatever the label says. Without a duration, the label's
+    # date is used (see label_date); with neither, the first time the clock
+    # comes round after departure. normalize.arrival_times is the same rule
+    # for a whole batch.
+    departure_day = departing_time.replace(hour=0, minute=0, second=0, microsecond=0)
+    match = CLOCK.match(arrival or '')
+    by_duration = departing_time + timedelta(minutes=duration_min) if duration_min is not None else None
+    if not match:
+        if by_duration is None:
+            raise ValueError(f"no arrival time or duration ({arrival!r})")
+        return by_duration
+    on_departure_day = departure_day + timedelta(minutes=int(match.group(1)) * 60 + int(match.group(2)))
+    if by_duration is not None:
+        return on_departure_day + timedelta(days=round((by_duration - on_departure_day) / timedelta(days=1)))
+    label_day = label_date(arrival_dt, departure_day)
+    if label_day is not None and label_day != departure_day:
+        return label_day + (on_departure_day - departure_day)
+    return on_departure_day + timedelta(days=1) if on_departure_day < departing_time else on_departure_day
+
+
+def parse_bus_details(bus_details):
+    # Convert the scraped text fields into the bus_routes column values.
+    # Used one bus at a time when pandas isn't installed; the batch parser
+    # (crawler/normalize.py) gives the same values.
+    onward = bus_details['onward'].strip()
+    departure = bus_details['departure_time'].strip() or '00:00'
+    departing_time = datetime.strptime(onward + ' ' + departure, TIME_FORMAT)
+    reaching_time = arrival_time(departing_time, duration_minutes(bus_details['duration']),
+                                 bus_details['arrival_time'], bus_details['arrival_dt'])
+    long_fields = too_long(bus_details['bus_route_name'], bus_details['bus_route_link'], bus_details['bus_name'],
+                           bus_details['bus_type'])
+    if long_fields:
+        raise ValueError(f"{', '.join(long_fields)} longer than the table takes")
+
+    return (
+        bus_details['bus_route_name'],
+        bus_details['bus_route_link'],
+        bus_details['bus_name'],
+        bus_details['bus_type'],
+        departing_time,
+        bus_details['duration'],
+        reaching_time,
+        float(bus_details['rating'].split()[0]),  # Assuming rating is in format "4.5 stars"
+        float(bus_details['ticket_fare'].replace('INR ', '').strip()),  # Remove 'INR'
+        int(bus_details['seats_availability'].split()[0])  # Assuming format is "X seats available"
+    )
+
+
+def parse_row(bus_details):
+    # Column values for one bus, or None (with a message) when its text won't parse
+    try:
+        return parse_bus_details(bus_details)
+    except (ValueError, IndexError, KeyError, AttributeError) as error:
+        print(f"Skipping bus {bus_details.get('bus_name')} on {bus_details.get('bus_route_name')}: {error}")
+        return None
@@ -0,0 +1,450 @@
+import argparse
+
+from crawler.config import db_config, CATALOG_PATH
+from crawler.partitions import PARTITION_CLAUSE, is_partitioned, maintenance_steps, partition_steps, run_steps
+
+# Schema changes on top of the bus_routes table created by bus_routes.sql.
+# Each step checks information_schema first, so `upgrade` can be rerun
+# safely against a database at any stage:
+#
+#   python -m crawler.schema upgrade --dry-run
+#   python -m crawler.schema upgrade
+#
+# The end state is a normalized schema (routes, operators, bus_types, trips,
+# crawl_runs) with a `bus_routes` view of the same columns on top, so the
+# Streamlit app and ad-hoc queries keep working. The original table is kept
+# as bus_routes_legacy.
+
+# Natural identity of a trip on the original table: route, operator/service number ("TSRTC - 8613"
+# or the private travels name), bus type, and departure date and time (the
+# onward date is the date part). Private operators run several coaches at
+# the same time under one name, so bus type is part of the key. The text
+# columns are hashed into a stored generated column so the unique index
+# stays small.
+TRIP_KEY_SQL = "SHA2(CONCAT_WS('|', route_name, busname, bustype, departing_time), 256)"
+
+# Index plan for the dashboard filter (crawler/queries.py): each filter
+# column leads an index that continues with departing_time, so a filter plus
+# a date range is one range scan, and price/star_rating ride along so the
+# remaining conditions are checked in the index before any row is read.
+TRIP_INDEXES = [
+    ('idx_operator_departing', '(operator_id, service_no, departing_time, price, star_rating)'),
+    ('idx_bus_type_departing', '(bus_type_id, departing_time, price, star_rating)'),
+    ('idx_route_departing', '(route_id, departing_time, price, star_rating)'),
+    ('idx_departing', '(departing_time, price, star_rating)'),
+]
+
+# Indexes the plan above replaces
+SUPERSEDED_TRIP_INDEXES = ['idx_operator', 'idx_bus_type']
+
+NORMALIZED_TABLES = [
+    ('crawl_runs', """
+CREATE TABLE IF NOT EXISTS crawl_runs (
+  id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  engine ENUM('browser', 'http', 'reparse', 'import') NOT NULL,
+  label VARCHAR(32) NULL,
+  started_at DATETIME NOT NULL,
+  finished_at DATETIME NULL,
+  KEY idx_started_at (started_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""),
+    ('routes', """
+CREATE TABLE IF NOT EXISTS routes (
+  id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  route_name VARCHAR(160) NOT NULL,
+  from_city_id INT UNSIGNED NOT NULL DEFAULT 0,
+  to_city_id INT UNSIGNED NOT NULL DEFAULT 0,
+  corporation VARCHAR(24) NULL,
+  link_template VARCHAR(500) NOT NULL,
+  UNIQUE KEY uq_route (route_name, from_city_id, to_city_id),
+  KEY idx_corporation (corporation)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""),
+    ('operators', """
+CREATE TABLE IF NOT EXISTS operators (
+  id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  name VARCHAR(120) NOT NULL,
+  UNIQUE KEY uq_name (name)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""),
+    ('bus_types', """
+CREATE TABLE IF NOT EXISTS bus_types (
+  id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  name VARCHAR(150) NOT NULL,
+  UNIQUE KEY uq_name (name)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""),
+    ('trips', """
+CREATE TABLE IF NOT EXISTS trips (
+  id INT UNSIGNED NOT NULL AUTO_INCREMENT,
+  route_id INT UNSIGNED NOT NULL,
+  operator_id INT UNSIGNED NOT NULL,
+  service_no VARCHAR(16) NOT NULL DEFAULT '',
+  bus_type_id INT UNSIGNED NOT NULL,
+  onward DATE NOT NULL,
+  departing_time DATETIME NOT NULL,
+  duration_min SMALLINT UNSIGNED NULL,
+  reaching_time DATETIME NOT NULL,
+  star_rating DECIMAL(2,1) NOT NULL,
+  price DECIMAL(8,2) NOT NULL,
+  seats_available SMALLINT UNSIGNED NOT NULL,
+  crawl_run_id INT UNSIGNED NULL,
+  PRIMARY KEY (id, departing_time),
+  UNIQUE KEY uq_trip (route_id, onward, departing_time, operator_id, service_no, bus_type_id),
+  {trip_indexes}
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+""" + PARTITION_CLAUSE),
+    # One row per trip per crawl run that saw it, in crawl order. Values are
+    # stored as the change since the trip's previous snapshot (the first one
+    # against zero), so a curve is a running sum; price is in paise.
+    # minutes_to_departure is measured when the row is written.
+    ('trip_snapshots', """
+CREATE TABLE IF NOT EXISTS trip_snapshots (
+  trip_id INT UNSIGNED NOT NULL,
+  crawl_run_id INT UNSIGNED NOT NULL,
+  minutes_to_departure MEDIUMINT NOT NULL,
+  seats_delta SMALLINT NOT NULL,
+  price_delta INT NOT NULL,
+  PRIMARY KEY (trip_id, crawl_run_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""),
+]
+
+# Same columns, names and text formats as the original table
+COMPAT_SELECT = """
+SELECT t.id,
+       r.route_name,
+       REPLACE(r.link_template, '{onward}', DATE_FORMAT(t.onward, '%d-%b-%Y')) AS route_link,
+       IF(t.service_no = '', o.name, CONCAT(o.name, ' - ', t.service_no)) AS busname,
+       b.name AS bustype,
+       t.departing_time,
+       IF(t.duration_min IS NULL, '',
+          CONCAT(LPAD(t.duration_min DIV 60, 2, '0'), 'h ', LPAD(t.duration_min MOD 60, 2, '0'), 'm')) AS duration,
+       t.reaching_time,
+       t.star_rating + 0E0 AS star_rating,
+       t.price,
+       t.seats_available
+FROM trips t
+JOIN routes r ON r.id = t.route_id
+JOIN operators o ON o.id = t.operator_id
+JOIN bus_types b ON b.id = t.bus_type_id"""
+
+COMPAT_VIEW = "CREATE OR REPLACE VIEW bus_routes AS" + COMPAT_SELECT
+
+# Columns of a bus_routes-shaped row set (legacy table or staging table),
+# and the expressions that split it into the normalized tables
+STAGING_TABLE = """
+CREATE TEMPORARY TABLE IF NOT EXISTS bus_routes_staging (
+  route_name text NOT NULL,
+  route_link text NOT NULL,
+  busname text NOT NULL,
+  bustype text NOT NULL,
+  departing_time datetime NOT NULL,
+  duration text NOT NULL,
+  reaching_time datetime NOT NULL,
+  star_rating float NOT NULL,
+  price decimal(10,2) NOT NULL,
+  seats_available int(11) NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+
+
+def city_id_sql(column, param):
+    return (f"IF(LOCATE('{param}=', {column}) > 0, "
+            f"CAST(SUBSTRING_INDEX(SUBSTRING_INDEX({column}, '{param}=', -1), '&', 1) AS UNSIGNED), 0)")
+
+
+def onward_sql(column, fallback):
+    # The search date from '...&onward=29-Jul-2024'. '%%' because the
+    # statement it goes into is run with parameters.
+    return (f"IF(LOCATE('onward=', {column}) > 0, "
+            f"STR_TO_DATE(SUBSTRING_INDEX(SUBSTRING_INDEX({column}, 'onward=', -1), '&', 1), '%%d-%%b-%%Y'), "
+            f"DATE({fallback}))")
+
+
+def link_template_sql(column):
+    return f"REGEXP_REPLACE({column}, 'onward=[^&]*', 'onward={{onward}}')"
+
+
+# Government buses read '<operator label> - <service number>'
+SERVICE_NO_PATTERN = "' - [0-9][0-9A-Za-z/]*$'"
+
+
+def operator_name_sql(column):
+    return (f"IF({column} REGEXP {SERVICE_NO_PATTERN}, "
+            f"LEFT({column}, CHAR_LENGTH({column}) - CHAR_LENGTH(SUBSTRING_INDEX({column}, ' - ', -1)) - 3), "
+            f"{column})")
+
+
+def service_no_sql(column):
+    return f"IF({column} REGEXP {SERVICE_NO_PATTERN}, SUBSTRING_INDEX({column}, ' - ', -1), '')"
+
+
+def duration_min_sql(column):
+    # '04h 10m' -> 250
+    return (f"IF({column} REGEXP '^[0-9]+h [0-9]+m$', "
+            f"CAST(SUBSTRING_INDEX({column}, 'h', 1) AS UNSIGNED) * 60 + "
+            f"CAST(TRIM(TRAILING 'm' FROM TRIM(SUBSTRING_INDEX({column}, 'h', -1))) AS UNSIGNED), NULL)")
+
+
+def staged_trip_joins(source):
+    # Lookup ids for the rows of a bus_routes-shaped table aliased s
+    return f"""
+JOIN routes r ON r.route_name = s.route_name
+             AND r.from_city_id = {city_id_sql('s.route_link', 'fromCityId')}
+             AND r.to_city_id = {city_id_sql('s.route_link', 'toCityId')}
+JOIN operators o ON o.name = {operator_name_sql('s.busname')}
+JOIN bus_types b ON b.name = s.bustype"""
+
+
+def merge_statements(source):
+    # Upserts the rows of a bus_routes-shaped table into the normalized
+    # tables. The trips statement takes one parameter, the crawl_runs id.
+    # Lookup rows are inserted only for names not there yet: an INSERT that
+    # hits the unique key still takes an AUTO_INCREMENT value, so inserting
+    # every name on every batch would use up ids. ON DUPLICATE KEY is only
+    # for two writers adding the same new name at once.
+    return [
+        f"""
+INSERT INTO routes (route_name, from_city_id, to_city_id, link_template)
+SELECT src.route_name, src.from_city_id, src.to_city_id, MAX(src.link_template) FROM (
+  SELECT route_name, {city_id_sql('route_link', 'fromCityId')} AS from_city_id,
+         {city_id_sql('route_link', 'toCityId')} AS to_city_id, {link_template_sql('route_link')} AS link_template
+  FROM {source}) AS src
+LEFT JOIN routes r ON r.route_name = src.route_name AND r.from_city_id = src.from_city_id
+                  AND r.to_city_id = src.to_city_id
+WHERE r.id IS NULL
+GROUP BY src.route_name, src.from_city_id, src.to_city_id
+ON DUPLICATE KEY UPDATE id = routes.id""",
+        f"""
+INSERT INTO operators (name)
+SELECT DISTINCT src.name FROM (SELECT {operator_name_sql('busname')} AS name FROM {source}) AS src
+LEFT JOIN operators o ON o.name = src.name
+WHERE o.id IS NULL
+ON DUPLICATE KEY UPDATE id = operators.id""",
+        f"""
+INSERT INTO bus_types (name)
+SELECT DISTINCT src.bustype FROM {source} src
+LEFT JOIN bus_types b ON b.name = src.bustype
+WHERE b.id IS NULL
+ON DUPLICATE KEY UPDATE id = bus_types.id""",
+        f"""
+INSERT INTO trips (route_id, operator_id, service_no, bus_type_id, onward, departing_time, duration_min,
+                   reaching_time, star_rating, price, seats_available, crawl_run_id)
+SELECT r.id, o.id, {service_no_sql('s.busname')}, b.id, {onward_sql('s.route_link', 's.departing_time')},
+       s.departing_time, {duration_min_sql('s.duration')},
+       s.reaching_time, s.star_rating, s.price, s.seats_available, %s
+FROM {source} s{staged_trip_joins(source)}
+ON DUPLICATE KEY UPDATE
+duration_min = VALUES(duration_min), reaching_time = VALUES(reaching_time), star_rating = VALUES(star_rating),
+price = VALUES(price), seats_available = VALUES(seats_available), crawl_run_id = VALUES(crawl_run_id)""",
+    ]
+
+
+def snapshot_statement(source):
+    # Run after the trips upsert; takes the crawl_runs id three times. Each
+    # trip's snapshot for the run is its current values less the running
+    # total of its snapshots from earlier runs (zero for a new trip), so
+    # merging the same trip again in one run (routes listed twice in the
+    # catalog, a replayed batch) rewrites the run's row to the latest
+    # values instead of adding a second step or being skipped.
+    earlier = "FROM trip_snapshots p WHERE p.trip_id = t.id AND p.crawl_run_id < %s"
+    return f"""
+INSERT INTO trip_snapshots (trip_id, crawl_run_id, minutes_to_departure, seats_delta, price_delta)
+SELECT t.id, %s, TIMESTAMPDIFF(MINUTE, NOW(), t.departing_time),
+       CAST(t.seats_available AS SIGNED) - (SELECT COALESCE(SUM(p.seats_delta), 0) {earlier}),
+       ROUND(t.price * 100) - (SELECT COALESCE(SUM(p.price_delta), 0) {earlier})
+FROM {source} s{staged_trip_joins(source)}
+JOIN trips t ON t.route_id = r.id AND t.onward = {onward_sql('s.route_link', 's.departing_time')}
+            AND t.departing_time = s.departing_time AND t.operator_id = o.id
+            AND t.service_no = {service_no_sql('s.busname')} AND t.bus_type_id = b.id
+ON DUPLICATE KEY UPDATE minutes_to_departure = VALUES(minutes_to_departure),
+seats_delta = VALUES(seats_delta), price_delta = VALUES(price_delta)"""
+
+
+def merge_into_trips(cursor, source, crawl_run_id=None):
+    # Returns the rows affected in trips (1 per insert, 2 per updated trip).
+    # Writes made as part of a crawl run also append to trip_snapshots.
+    routes_statement, *lookup_statements, trips_statement = merge_statements(source)
+    cursor.execute(routes_statement)
+    routes_added = cursor.rowcount
+    for statement in lookup_statements:
+        cursor.execute(statement)
+    cursor.execute(trips_statement, (crawl_run_id,))
+    affected = cursor.rowcount
+    if crawl_run_id is not None:
+        cursor.execute(snapshot_statement(source), (crawl_run_id,) * 3)
+    if routes_added > 0:
+        fill_corporations(cursor)
+    return affected
+
+
+def fill_corporations(cursor, catalog=CATALOG_PATH):
+    # Tags routes with their corporation from the route catalog
+    from crawler.catalog import load_routes
+
+    corporations = {}
+    for route in load_routes(catalog):
+        corporations.setdefault((int(route['from_city_id']), int(route['to_city_id'])), route['corporation'])
+    cursor.execute("SELECT id, from_city_id, to_city_id FROM routes WHERE corporation IS NULL")
+    updates = [(corporations[(from_id, to_id)], route_id)
+               for route_id, from_id, to_id in cursor.fetchall() if (from_id, to_id) in corporations]
+    if updates:
+        cursor.executemany("UPDATE routes SET corporation = %s WHERE id = %s", updates)
+    return len(updates)
+
+
+def table_type(cursor, table):
+    # 'BASE TABLE', 'VIEW', or None when missing
+    cursor.execute("SELECT TABLE_TYPE FROM information_schema.TABLES "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def is_normalized(cursor):
+    return table_type(cursor, 'bus_routes') == 'VIEW'
+
+
+def column_exists(cursor, table, column):
+    cursor.execute("SELECT COUNT(*) FROM information_schema.COLUMNS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s", (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def column_type(cursor, table, column):
+    # DATA_TYPE ('smallint', 'int', ...), or None when missing
+    cursor.execute("SELECT DATA_TYPE FROM information_schema.COLUMNS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s", (table, column))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def index_exists(cursor, table, index):
+    cursor.execute("SELECT COUNT(*) FROM information_schema.STATISTICS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s", (table, index))
+    return cursor.fetchone()[0] > 0
+
+
+def trip_key_steps(cursor):
+    if table_type(cursor, 'bus_routes') != 'BASE TABLE':
+        return []
+    steps = []
+    if not column_exists(cursor, 'bus_routes', 'trip_key'):
+        steps.append(("add trip_key",
+                      f"ALTER TABLE bus_routes ADD COLUMN trip_key CHAR(64) AS ({TRIP_KEY_SQL}) STORED, "
+                      f"ADD INDEX idx_trip_key (trip_key)"))
+    if not index_exists(cursor, 'bus_routes', 'uq_trip_key'):
+        if not steps and not index_exists(cursor, 'bus_routes', 'idx_trip_key'):
+            steps.append(("index trip_key", "ALTER TABLE bus_routes ADD INDEX idx_trip_key (trip_key)"))
+        steps.append(("remove duplicate trips, keeping the latest scrape",
+                      "DELETE older FROM bus_routes older JOIN bus_routes newer "
+                      "ON newer.trip_key = older.trip_key AND newer.id > older.id"))
+        steps.append(("unique trip_key",
+                      "ALTER TABLE bus_routes DROP INDEX idx_trip_key, ADD UNIQUE INDEX uq_trip_key (trip_key)"))
+    return steps
+
+
+def create_statement(statement):
+    indexes = ',\n  '.join(f"KEY {name} {columns}" for name, columns in TRIP_INDEXES)
+    return statement.replace('{trip_indexes}', indexes)
+
+
+def normalize_steps(cursor):
+    steps = [(f"create {name}", create_statement(statement)) for name, statement in NORMALIZED_TABLES
+             if table_type(cursor, name) is None]
+    if table_type(cursor, 'bus_routes') == 'BASE TABLE':
+        steps.append(("keep the original table as bus_routes_legacy",
+                      "RENAME TABLE bus_routes TO bus_routes_legacy"))
+        steps.append(("copy bus_routes_legacy into the normalized tables",
+                      lambda cursor: merge_into_trips(cursor, 'bus_routes_legacy')))
+    if table_type(cursor, 'bus_routes') != 'VIEW':
+        steps.append(("bus_routes compatibility view", COMPAT_VIEW))
+    return steps
+
+
+def index_steps(cursor):
+    # New trips tables are created with the plan; this brings older ones up to it
+    if table_type(cursor, 'trips') != 'BASE TABLE':
+        return []
+    changes = [f"ADD INDEX {name} {columns}" for name, columns in TRIP_INDEXES
+               if not index_exists(cursor, 'trips', name)]
+    changes += [f"DROP INDEX {name}" for name in SUPERSEDED_TRIP_INDEXES if index_exists(cursor, 'trips', name)]
+    if not changes:
+        return []
+    return [("dashboard index plan on trips", "ALTER TABLE trips " + ', '.join(changes))]
+
+
+def id_width_steps(cursor):
+    # routes/operators/bus_types ids were SMALLINT UNSIGNED at first, which
+    # runs out at 65535
+    steps = [(f"widen {table}.id to INT", f"ALTER TABLE {table} MODIFY id INT UNSIGNED NOT NULL AUTO_INCREMENT")
+             for table in ('routes', 'operators', 'bus_types') if column_type(cursor, table, 'id') == 'smallint']
+    narrow = [column for column in ('route_id', 'operator_id', 'bus_type_id')
+              if column_type(cursor, 'trips', column) == 'smallint']
+    if narrow:
+        steps.append(("widen the trips lookup ids to INT",
+                      "ALTER TABLE trips " + ', '.join(f"MODIFY {column} INT UNSIGNED NOT NULL" for column in narrow)))
+    return steps
+
+
+def run_engine_steps(cursor):
+    # crawl_runs.engine once listed a 'bulk' engine that nothing records
+    cursor.execute("SELECT COLUMN_TYPE FROM information_schema.COLUMNS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'crawl_runs' AND COLUMN_NAME = 'engine'")
+    row = cursor.fetchone()
+    if row is None or "'bulk'" not in row[0]:
+        return []
+    return [("drop the unused 'bulk' crawl run engine",
+             "ALTER TABLE crawl_runs MODIFY engine ENUM('browser', 'http', 'reparse', 'import') NOT NULL")]
+
+
+def split_into_days(cursor):
+    # Daily partitions for the trips stored so far and the days ahead
+    run_steps(cursor, maintenance_steps(cursor, retention=None))
+
+
+def trip_partition_steps(cursor):
+    # See crawler/partitions.py; new trips tables are created partitioned
+    exists = table_type(cursor, 'trips') == 'BASE TABLE'
+    if exists and is_partitioned(cursor):
+        return []
+    steps = partition_steps(cursor) if exists else []
+    return steps + [("daily partitions on trips", split_into_days)]
+
+
+def pending_steps(cursor):
+    # Steps are planned up front, so later ones can't see what earlier
+    # ones change; trip_key applies to the original table only. Ids are
+    # widened after partitioning has dropped the foreign keys on them.
+    return (trip_key_steps(cursor) + normalize_steps(cursor) + index_steps(cursor) + trip_partition_steps(cursor)
+            + id_width_steps(cursor) + run_engine_steps(cursor))
+
+
+def upgrade(dry_run=False):
+    import mysql.connector
+
+    connection = mysql.connector.connect(**db_config)
+    try:
+        cursor = connection.cursor()
+        steps = pending_steps(cursor)
+        if not steps:
+            print("Schema is up to date")
+        for name, statement in steps:
+            if callable(statement):
+                print(f"-- {name}")
+                if not dry_run:
+                    statement(cursor)
+            else:
+                print(f"-- {name}\n{statement.strip()};")
+                if not dry_run:
+                    cursor.execute(statement)
+            if not dry_run:
+                if cursor.rowcount and cursor.rowcount > 0:
+                    print(f"-- {cursor.rowcount} rows affected")
+                connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bring the redbus database schema up to date")
+    parser.add_argument('command', choices=['upgrade'])
+    parser.add_argument('--dry-run', action='store_true', help="print the pending statements without running them")
+    args = parser.parse_args()
+    upgrade(args.dry_run)
@@ -0,0 +1,204 @@
+import time
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException, StaleElementReferenceException, JavascriptException
+
+from crawler.config import BASE_URL, RTC_DIRECTORY_URL
+from crawler.lookup import LookupStats, REQUIRED_SELECTORS, OPTIONAL_SELECTORS, no_implicit_wait, read_bus_item
+
+# Browser-side steps shared by every route. These are the same steps the
+# per-route scripts inline, parameterised by a catalog row instead of
+# hardcoded XPaths.
+
+
+def click_element(driver, xpath, timeout=10, retries=3):
+    for attempt in range(retries):
+        try:
+            wait = WebDriverWait(driver, timeout)
+            element = wait.until(EC.element_to_be_clickable((By.XPATH, xpath)))
+            driver.execute_script("arguments[0].scrollIntoView(true);", element)
+            element.click()
+            return
+        except (TimeoutException, StaleElementReferenceException) as e:
+            if attempt == retries - 1:
+                print(f"Failed to click element after {retries} attempts. Error: {str(e)}")
+                raise
+            print(f"Attempt {attempt + 1} failed. Retrying...")
+            driver.refresh()  # Refresh the page and try again
+
+
+def open_via_directory(driver, route, timeout=5):
+    # Home page -> RTC directory (or the corporation's own page) -> route anchor
+    wait = WebDriverWait(driver, timeout)
+    driver.get(BASE_URL + "/")
+
+    if route['directory_url']:
+        driver.get(route['directory_url'])
+    else:
+        driver.get(RTC_DIRECTORY_URL)
+        click_element(driver, f"//a[normalize-space()='{route['directory_link']}']", timeout=timeout)
+
+    if route['directory_page']:
+        page = wait.until(EC.presence_of_element_located(
+            (By.XPATH, f"//div[normalize-space()='{route['directory_page']}']")))
+        driver.execute_script("arguments[0].scrollIntoView(true);", page)
+        page.click()
+        time.sleep(1)
+
+    route_anchor = wait.until(EC.presence_of_element_located(
+        (By.XPATH, f"//a[@title=\"{route['route_name']}\"]")))
+    route_text = route_anchor.text
+    driver.execute_script("arguments[0].click();", route_anchor)
+    return route_text or route['route_name']
+
+
+def apply_operator_filter(driver, operator_filter, timeout=20):
+    wait = WebDriverWait(driver, timeout)
+
+    operator_opt = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@id='opfilter']")))
+    driver.execute_script("arguments[0].scrollIntoView(true);", operator_opt)
+    operator_opt.click()
+    time.sleep(1)
+
+    # Catalog rows hold either the operator label title or the raw XPath the script clicked
+    if operator_filter.startswith('//'):
+        operator_xpath = operator_filter
+    else:
+        operator_xpath = f"//label[@title='{operator_filter}']"
+    operator = wait.until(EC.presence_of_element_located((By.XPATH, operator_xpath)))
+    driver.execute_script("arguments[0].scrollIntoView(true);", operator)
+    operator.click()
+    time.sleep(1)
+
+    apply_button = wait.until(EC.presence_of_element_located((By.XPATH, "//div[@class='button btn-apply op-apply']")))
+    driver.execute_script("arguments[0].scrollIntoView(true);", apply_button)
+    apply_button.click()
+    time.sleep(3)
+
+
+# Scrolls inside the page until the bus-item count stops growing. A
+# MutationObserver resets the settle timer whenever new buses are attached,
+# so the call returns as soon as the list is complete instead of sleeping a
+# fixed interval per scroll step.
+SCROLL_UNTIL_SETTLED_JS = """
+var settleMs = arguments[0], maxMs = arguments[1], tickMs = arguments[2];
+var done = arguments[arguments.length - 1];
+var started = Date.now();
+var count = function () { return document.getElementsByClassName('bus-item').length; };
+var last = count(), lastChange = started, steps = 0;
+
+var observer = new MutationObserver(function () {
+    var now = count();
+    if (now !== last) { last = now; lastChange = Date.now(); }
+});
+observer.observe(document.body, {childList: true, subtree: true});
+
+var timer = setInterval(function () {
+    window.scrollTo(0, document.body.scrollHeight);
+    steps++;
+    var now = count();
+    if (now !== last) { last = now; lastChange = Date.now(); }
+    var elapsed = Date.now() - started;
+    if (Date.now() - lastChange >= settleMs || elapsed >= maxMs) {
+        clearInterval(timer);
+        observer.disconnect();
+        done({count: last, steps: steps, elapsed_ms: elapsed, timed_out: elapsed >= maxMs});
+    }
+}, tickMs);
+"""
+
+
+# Function to scroll and load more buses
+def scroll_and_load(driver, settle=1.5, max_wait=90, tick=0.2, first_bus_timeout=20):
+    # The settle window only makes sense once the first results have rendered
+    try:
+        WebDriverWait(driver, first_bus_timeout).until(
+            EC.presence_of_element_located((By.CLASS_NAME, "bus-item")))
+    except TimeoutException:
+        return {'count': 0, 'steps': 0, 'elapsed_ms': 0, 'timed_out': True}
+
+    driver.set_script_timeout(max_wait + 10)
+    result = driver.execute_async_script(
+        SCROLL_UNTIL_SETTLED_JS, int(settle * 1000), int(max_wait * 1000), int(tick * 1000))
+    if result['timed_out']:
+        print(f"Bus list still growing after {max_wait}s, extracting {result['count']} buses loaded so far")
+    else:
+        print(f"Loaded {result['count']} buses in {result['elapsed_ms'] / 1000:.1f}s ({result['steps']} scroll steps)")
+    return result
+
+
+# Reads every bus-item in one WebDriver roundtrip. Each record carries the
+# raw text of the same classes the per-route scripts looked up one by one;
+# fields a bus does not show (rating "New", no next-day label) come back null.
+EXTRACT_BUSES_JS = """
+var fields = arguments[0];
+var text = function (item, cls) {
+    var el = item.getElementsByClassName(cls)[0];
+    if (!el) { return null; }
+    var value = (el.innerText || el.textContent || '').trim();
+    return value === '' ? null : value;
+};
+var items = document.getElementsByClassName('bus-item');
+var records = [];
+for (var i = 0; i < items.length; i++) {
+    var record = {};
+    for (var key in fields) { record[key] = text(items[i], fields[key]); }
+    records.push(record);
+}
+return records;
+"""
+
+BUS_ITEM_FIELDS = {**REQUIRED_SELECTORS, **OPTIONAL_SELECTORS}
+
+
+def extract_bus_records(driver):
+    try:
+        return driver.execute_script(EXTRACT_BUSES_JS, BUS_ITEM_FIELDS)
+    except JavascriptException as e:
+        print(f"In-page extraction failed, reading bus-items one by one: {str(e)}")
+    with no_implicit_wait(driver):
+        return [read_bus_item(bus) for bus in driver.find_elements(By.CLASS_NAME, "bus-item")]
+
+
+def to_bus_details(record, route_name, route_link, onward):
+    # Shape one raw record like the dicts the per-route scripts built.
+    # arrival_dt carries the page's next-day label as shown ('14-Jul '); the
+    # parsers work the arrival date out from departure + duration.
+    arrival_dt = record['next_day'] + ' ' if record['next_day'] else ''
+
+    rating = record['rating']
+    new_rating = rating if rating and rating != 'New' else '0.0'
+
+    return {
+        'bus_route_name': route_name,
+        'bus_route_link': route_link,
+        'bus_name': record['bus_name'],
+        'bus_type': record['bus_type'] or '',
+        'departure_time': record['departure_time'] or '',
+        'arrival_time': record['arrival_time'] or '',
+        'duration': record['duration'] or '',
+        'ticket_fare': record['ticket_fare'],
+        'seats_availability': record['seats_availability'],
+        'rating': new_rating,
+        'arrival_dt': arrival_dt,
+        'onward': onward
+    }
+
+
+def extract_buses(driver, route_name, route_link, onward):
+    stats = LookupStats()
+    buses = []
+    for record in extract_bus_records(driver):
+        stats.record(record)
+        missing = stats.missing_required(record)
+        if missing:
+            print(f"Skipping a bus on {route_name}, missing {', '.join(missing)}")
+            continue
+        buses.append(to_bus_details(record, route_name, route_link, onward))
+
+    if stats.rows:
+        print(f"{route_name}: {stats.summary()}")
+    else:
+        print(f"No buses listed for {route_name}")
+    return buses
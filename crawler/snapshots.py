@@ -0,0 +1,302 @@
+import argparse
+import csv
+import gzip
+import hashlib
+import os
+import random
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:  # pages fall back to gzip
+    zstandard = None
+
+# Archive of fully scrolled route pages, so trips can be re-extracted later
+# without a browser. Pages are stored once per distinct content under
+# objects/<sha256[:2]>/<sha256>.html.<codec>, and index.csv maps every
+# (run, route, onward date) that produced a page to its hash.
+#
+# Route pages are near-identical across routes and dates, so once a zstd
+# dictionary has been trained on archived pages (`train`), new pages are
+# compressed with it one object at a time. Each page still decompresses on
+# its own, which keeps lookups by (route, onward, run) random access.
+#
+#   <archive>/index.csv
+#   <archive>/objects/ab/ab12...ef.html.zst
+#   <archive>/dictionaries/<dict_id>.zdict, current
+
+INDEX_FIELDS = ['run_id', 'corporation', 'route_name', 'operator', 'slug', 'onward', 'route_link',
+                'sha256', 'size', 'saved_at', 'codec', 'dict_id', 'stored_size']
+
+EXTENSIONS = {'gzip': '.html.gz', 'zstd': '.html.zst'}
+
+ZSTD_LEVEL = 12
+DICTIONARY_SIZE = 112640      # zstd's own default, ~110 KB
+TRAINING_SAMPLES = 400
+
+index_lock = threading.Lock()
+dictionaries = {}             # dict_id -> ZstdCompressionDict, per process
+
+
+def new_run_id():
+    return time.strftime('%Y%m%dT%H%M%S')
+
+
+def object_path(archive_dir, sha256, codec='gzip'):
+    return os.path.join(archive_dir, 'objects', sha256[:2], sha256 + EXTENSIONS[codec])
+
+
+def dictionary_dir(archive_dir):
+    return os.path.join(archive_dir, 'dictionaries')
+
+
+def load_dictionary(archive_dir, dict_id):
+    key = (archive_dir, str(dict_id))
+    if key not in dictionaries:
+        with open(os.path.join(dictionary_dir(archive_dir), f"{dict_id}.zdict"), 'rb') as f:
+            dictionaries[key] = zstandard.ZstdCompressionDict(f.read())
+    return dictionaries[key]
+
+
+def current_dictionary_id(archive_dir):
+    path = os.path.join(dictionary_dir(archive_dir), 'current')
+    if zstandard is None or not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return f.read().strip() or None
+
+
+def compress(archive_dir, data):
+    # Returns (codec, dict_id, bytes)
+    dict_id = current_dictionary_id(archive_dir)
+    if dict_id is None:
+        return 'gzip', '', gzip.compress(data, compresslevel=6)
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=load_dictionary(archive_dir, dict_id))
+    return 'zstd', dict_id, compressor.compress(data)
+
+
+def decompress(archive_dir, entry, blob):
+    if entry.get('codec') == 'zstd':
+        if zstandard is None:
+            raise ImportError("This archive holds zstd pages; pip install zstandard to read them")
+        dict_data = load_dictionary(archive_dir, entry['dict_id']) if entry.get('dict_id') else None
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(blob)
+    return gzip.decompress(blob)
+
+
+def write_object(path, blob):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename, so a crash never leaves a truncated object behind
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def stored_object(archive_dir, sha256):
+    # (codec, path) of an already archived copy of this page, if any
+    for codec in EXTENSIONS:
+        path = object_path(archive_dir, sha256, codec)
+        if os.path.exists(path):
+            return codec, path
+    return None, None
+
+
+def save_snapshot(archive_dir, run_id, route, onward, link, html):
+    data = html.encode('utf-8')
+    sha256 = hashlib.sha256(data).hexdigest()
+    codec, path = stored_object(archive_dir, sha256)
+    dict_id = ''
+    if codec is None:
+        codec, dict_id, blob = compress(archive_dir, data)
+        path = object_path(archive_dir, sha256, codec)
+        write_object(path, blob)
+    else:
+        dict_id = find_dict_id(archive_dir, sha256)
+
+    entry = {
+        'run_id': run_id,
+        'corporation': route['corporation'],
+        'route_name': route['route_name'],
+        'operator': route['operator'],
+        'slug': route['slug'],
+        'onward': onward,
+        'route_link': link,
+        'sha256': sha256,
+        'size': len(data),
+        'saved_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'codec': codec,
+        'dict_id': dict_id,
+        'stored_size': os.path.getsize(path),
+    }
+    append_index(archive_dir, entry)
+    return entry
+
+
+def find_dict_id(archive_dir, sha256):
+    # A deduplicated page reuses the dictionary its first copy was written with
+    for entry in load_index(archive_dir):
+        if entry['sha256'] == sha256:
+            return entry['dict_id']
+    return ''
+
+
+def index_path(archive_dir):
+    return os.path.join(archive_dir, 'index.csv')
+
+
+def append_index(archive_dir, entry):
+    path = index_path(archive_dir)
+    with index_lock:
+        if os.path.exists(path):
+            with open(path, newline='', encoding='utf-8') as f:
+                header = next(csv.reader(f), [])
+            if header != INDEX_FIELDS:
+                # Index written before codecs were recorded; rewrite it once
+                write_index(archive_dir, load_index(archive_dir))
+        new_index = not os.path.exists(path)
+        with open(path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=INDEX_FIELDS)
+            if new_index:
+                writer.writeheader()
+            writer.writerow(entry)
+
+
+def write_index(archive_dir, entries):
+    path = index_path(archive_dir)
+    with open(path + '.tmp', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=INDEX_FIELDS)
+        writer.writeheader()
+        writer.writerows(entries)
+    os.replace(path + '.tmp', path)
+
+
+def load_index(archive_dir, run_id=None, corporations=None, operators=None):
+    path = index_path(archive_dir)
+    if not os.path.exists(path):
+        return []
+    with open(path, newline='', encoding='utf-8') as f:
+        entries = list(csv.DictReader(f))
+    for entry in entries:
+        # Rows from before codecs were recorded are plain gzip
+        entry['codec'] = entry.get('codec') or 'gzip'
+        entry['dict_id'] = entry.get('dict_id') or ''
+        entry['stored_size'] = entry.get('stored_size') or ''
+    if run_id:
+        entries = [entry for entry in entries if entry['run_id'] == run_id]
+    if corporations:
+        entries = [entry for entry in entries if entry['corporation'] in corporations]
+    if operators:
+        entries = [entry for entry in entries if entry['operator'] in operators]
+    return entries
+
+
+def latest_run(archive_dir):
+    runs = sorted({entry['run_id'] for entry in load_index(archive_dir)})
+    return runs[-1] if runs else None
+
+
+def find_snapshot(archive_dir, route_name, onward, run_id=None, operator=None):
+    # Index entry for one route page; the latest run unless run_id is given
+    matches = [entry for entry in load_index(archive_dir, run_id)
+               if entry['route_name'] == route_name and entry['onward'] == onward
+               and (operator is None or entry['operator'] == operator)]
+    return max(matches, key=lambda entry: entry['run_id']) if matches else None
+
+
+def read_snapshot(archive_dir, entry):
+    with open(object_path(archive_dir, entry['sha256'], entry['codec']), 'rb') as f:
+        return decompress(archive_dir, entry, f.read()).decode('utf-8')
+
+
+def train_dictionary(archive_dir, samples=TRAINING_SAMPLES, size=DICTIONARY_SIZE):
+    # Trains on a random sample of distinct archived pages and makes the
+    # result the dictionary new pages are written with
+    if zstandard is None:
+        raise ImportError("Dictionary training needs zstandard (pip install zstandard)")
+    unique = {entry['sha256']: entry for entry in load_index(archive_dir)}
+    chosen = random.sample(list(unique.values()), min(samples, len(unique)))
+    pages = [read_snapshot(archive_dir, entry).encode('utf-8') for entry in chosen]
+    if len(pages) < 8:
+        raise ValueError(f"Need at least 8 archived pages to train a dictionary, found {len(pages)}")
+
+    dictionary = zstandard.train_dictionary(size, pages, level=ZSTD_LEVEL)
+    dict_id = str(dictionary.dict_id())
+    os.makedirs(dictionary_dir(archive_dir), exist_ok=True)
+    with open(os.path.join(dictionary_dir(archive_dir), f"{dict_id}.zdict"), 'wb') as f:
+        f.write(dictionary.as_bytes())
+    with open(os.path.join(dictionary_dir(archive_dir), 'current'), 'w', encoding='utf-8') as f:
+        f.write(dict_id)
+    print(f"Trained dictionary {dict_id} ({len(dictionary.as_bytes()) / 1024:.0f} KB) on {len(pages)} pages")
+    return dict_id
+
+
+def recompress(archive_dir):
+    # Rewrites every page not yet on the current dictionary with it
+    dict_id = current_dictionary_id(archive_dir)
+    if dict_id is None:
+        raise ValueError("No current dictionary; run `train` first")
+    with index_lock:
+        entries = load_index(archive_dir)
+        done = {}
+        for entry in entries:
+            sha256 = entry['sha256']
+            if sha256 not in done:
+                if entry['codec'] == 'zstd' and entry['dict_id'] == dict_id:
+                    done[sha256] = entry
+                else:
+                    old_path = object_path(archive_dir, sha256, entry['codec'])
+                    with open(old_path, 'rb') as f:
+                        data = decompress(archive_dir, entry, f.read())
+                    codec, new_dict_id, blob = compress(archive_dir, data)
+                    new_path = object_path(archive_dir, sha256, codec)
+                    write_object(new_path, blob)
+                    if new_path != old_path:
+                        os.remove(old_path)
+                    done[sha256] = {'codec': codec, 'dict_id': new_dict_id, 'stored_size': len(blob)}
+            for field in ('codec', 'dict_id', 'stored_size'):
+                entry[field] = done[sha256][field]
+        write_index(archive_dir, entries)
+    print(f"Recompressed {len(done)} pages with dictionary {dict_id}")
+
+
+def archive_stats(archive_dir):
+    unique = {entry['sha256']: entry for entry in load_index(archive_dir)}
+    by_codec = {}
+    for entry in unique.values():
+        path = object_path(archive_dir, entry['sha256'], entry['codec'])
+        totals = by_codec.setdefault(entry['codec'], [0, 0, 0])
+        totals[0] += 1
+        totals[1] += int(entry['size'])
+        totals[2] += os.path.getsize(path)
+    for codec, (pages, raw, stored) in sorted(by_codec.items()):
+        print(f"{codec}: {pages} pages, {raw / 1024 / 1024:.1f} MB -> {stored / 1024 / 1024:.2f} MB "
+              f"({raw / stored if stored else 0:.1f}x)")
+    return by_codec
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manage the archive of scrolled route pages")
+    parser.add_argument('command', choices=['train', 'recompress', 'stats', 'show'])
+    parser.add_argument('archive_dir')
+    parser.add_argument('--samples', type=int, default=TRAINING_SAMPLES, help="train: pages to sample")
+    parser.add_argument('--size', type=int, default=DICTIONARY_SIZE, help="train: dictionary size in bytes")
+    parser.add_argument('--route', help="show: route title")
+    parser.add_argument('--onward', help="show: onward date")
+    parser.add_argument('--run', help="show: crawl run id (default: latest)")
+    parser.add_argument('--operator', help="show: operator, when a route has several")
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        train_dictionary(args.archive_dir, args.samples, args.size)
+    elif args.command == 'recompress':
+        recompress(args.archive_dir)
+    elif args.command == 'stats':
+        archive_stats(args.archive_dir)
+    else:
+        entry = find_snapshot(args.archive_dir, args.route, args.onward, args.run, args.operator)
+        if entry is None:
+            print(f"No archived page for {args.route} on {args.onward}")
+        else:
+            print(read_snapshot(args.archive_dir, entry))
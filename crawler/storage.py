@@ -0,0 +1,463 @@
+import argparse
+import glob
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+
+from crawler.config import STORAGE_BACKEND, STORAGE_PATH, DB_BATCH_SIZE, LAKE_PATH
+from crawler.lake import LAKE_VIEW, lake_files
+from crawler.queries import as_day, build_filter_query, filter_options
+from crawler.rows import COLUMNS
+
+try:
+    import duckdb
+except ImportError:  # only needed for the duckdb backend
+    duckdb = None
+
+try:
+    import pandas as pd
+except ImportError:  # only needed by the readers
+    pd = None
+
+# Where trips are written and read from, selected with REDBUS_STORAGE:
+#
+#   mysql   the redbus database in config.db_config (default)
+#   sqlite  an embedded file, REDBUS_STORAGE_PATH (default redbus.sqlite3)
+#   duckdb  an embedded columnar file (default redbus.duckdb), for analytics
+#           nodes and the dashboard
+#   lake    the Parquet lake written by crawler/lake.py (default ./lake),
+#           read-only, for the dashboard
+#
+# Every backend has the same writer side (start_run, write_rows,
+# finish_run), used by the crawl engines and the write-behind queue, and the
+# same reader side (filter_options, filter_trips and the dashboard
+# aggregations), used by the Streamlit app. The embedded backends keep the
+# original bus_routes columns in one table, unique on the trip's natural
+# key, so the dashboard's filter query is the same SQL everywhere.
+#
+#   REDBUS_STORAGE=duckdb python -m crawler --corporation KSRTC
+#   python -m crawler.storage copy --source mysql --target duckdb    # refresh a DuckDB copy for the dashboard
+
+DEFAULT_PATHS = {'sqlite': 'redbus.sqlite3', 'duckdb': 'redbus.duckdb', 'lake': 'lake'}
+
+KEY_COLUMNS = ('route_name', 'busname', 'bustype', 'departing_time')
+
+stores = {}
+stores_lock = threading.Lock()
+
+
+class Storage:
+    name = None
+    errors = ()               # errors a failed write raises
+
+    def start_run(self, engine, label=None):
+        raise NotImplementedError
+
+    def finish_run(self):
+        raise NotImplementedError
+
+    def write_rows(self, rows):
+        # Upserts parsed bus_routes rows; returns rows written
+        raise NotImplementedError
+
+    def is_connection_error(self, error):
+        # Whether a failed write means the store is unreachable, so the
+        # write-behind queue backs off before trying it again
+        return False
+
+    def export_run(self, run_id):
+        # Appends a finished run to the Parquet lake when REDBUS_LAKE_PATH is
+        # set; a failed export is reported and doesn't fail the crawl
+        if not LAKE_PATH or run_id is None:
+            return
+        from crawler.lake import export_run
+
+        try:
+            export_run(self, run_id, LAKE_PATH)
+        except Exception as error:
+            print(f"Could not export crawl run {run_id} to the lake at {LAKE_PATH}: {error}")
+
+    def cursor(self):
+        # Context manager giving a DB-API cursor
+        raise NotImplementedError
+
+    def is_normalized(self, cursor):
+        return False
+
+    def prepare(self, query, params):
+        # Adapts a %s-style query and its parameters to the driver
+        return query, list(params)
+
+    def fetch(self, query, params=()):
+        # Query result as a DataFrame
+        with self.cursor() as cursor:
+            query, params = self.prepare(query, params)
+            cursor.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            return pd.DataFrame(cursor.fetchall(), columns=columns)
+
+    def filter_options(self):
+        with self.cursor() as cursor:
+            return filter_options(cursor, self.is_normalized(cursor))
+
+    def filter_query(self, **filters):
+        with self.cursor() as cursor:
+            normalized = self.is_normalized(cursor)
+        return build_filter_query(normalized=normalized, **filters)
+
+    def filter_trips(self, **filters):
+        return self.fetch(*self.filter_query(**filters))
+
+    def aggregate(self, group_by, value, function, **filters):
+        # One value per group over the filtered trips, largest first, as a Series
+        query, params = self.filter_query(**filters)
+        frame = self.fetch(f"SELECT {group_by}, {function}({value}) AS {value} FROM ({query}) filtered "
+                           f"GROUP BY {group_by} ORDER BY {value} DESC", params)
+        return frame.set_index(group_by)[value].astype(float)
+
+    def rating_by_busname(self, **filters):
+        return self.aggregate('busname', 'star_rating', 'AVG', **filters)
+
+    def seats_by_bustype(self, **filters):
+        return self.aggregate('bustype', 'seats_available', 'SUM', **filters)
+
+    def iter_rows(self, batch_size=DB_BATCH_SIZE):
+        # Every trip as a bus_routes row, batch_size at a time
+        with self.cursor() as cursor:
+            cursor.execute(f"SELECT {', '.join(COLUMNS)} FROM bus_routes")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield [tuple(row) for row in rows]
+
+
+class MySQLStorage(Storage):
+    # The existing pooled writer in crawler/db.py, normalized schema or not.
+    # The driver is imported here, so the other backends don't need it.
+
+    name = 'mysql'
+
+    def __init__(self, path=None, read_only=False):
+        import mysql.connector
+        from crawler import db
+
+        self.db = db
+        self.errors = (mysql.connector.Error,)
+
+    def start_run(self, engine, label=None):
+        return self.db.start_crawl_run(engine, label)
+
+    def finish_run(self):
+        self.db.finish_crawl_run()
+        self.export_run(self.db.crawl_run_id)
+
+    def write_rows(self, rows):
+        return self.db.write_rows(rows)
+
+    def is_connection_error(self, error):
+        return self.db.is_connection_error(error)
+
+    @contextmanager
+    def cursor(self):
+        with self.db.pooled_connection() as connection:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def is_normalized(self, cursor):
+        return self.db.schema_is_normalized(cursor)
+
+
+class EmbeddedStorage(Storage):
+    # One connection per process, shared by the crawl and writer threads
+    # under a lock; the embedded engines take one writer at a time anyway
+
+    create_statements = []
+
+    def __init__(self, path=None, read_only=False):
+        self.path = path or DEFAULT_PATHS[self.name]
+        self.lock = threading.RLock()
+        self.crawl_run_id = None
+        self.connection = self.connect(read_only)
+        if not read_only:
+            for statement in self.create_statements:
+                self.connection.execute(statement)
+            self.connection.commit()
+        columns = COLUMNS + ('crawl_run_id',)
+        updates = ', '.join(f"{column} = excluded.{column}" for column in columns if column not in KEY_COLUMNS)
+        self.upsert = (f"INSERT INTO bus_routes ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))}) "
+                       f"ON CONFLICT ({', '.join(KEY_COLUMNS)}) DO UPDATE SET {updates}")
+
+    def connect(self, read_only):
+        raise NotImplementedError
+
+    def value(self, value):
+        return value
+
+    def prepare(self, query, params):
+        return query.replace('%s', '?'), [self.value(param) for param in params]
+
+    @contextmanager
+    def cursor(self):
+        with self.lock:
+            cursor = self.connection.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def start_run(self, engine, label=None):
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT INTO crawl_runs (engine, label, started_at) VALUES (?, ?, ?) RETURNING id",
+                [engine, label, self.value(datetime.now())])
+            self.crawl_run_id = cursor.fetchone()[0]
+            self.connection.commit()
+        return self.crawl_run_id
+
+    def finish_run(self):
+        if self.crawl_run_id is None:
+            return
+        with self.lock:
+            self.connection.execute("UPDATE crawl_runs SET finished_at = ? WHERE id = ?",
+                                    [self.value(datetime.now()), self.crawl_run_id])
+            self.connection.commit()
+        self.export_run(self.crawl_run_id)
+
+    def write_rows(self, rows):
+        rows = [[self.value(value) for value in row] + [self.crawl_run_id] for row in rows]
+        with self.lock:
+            self.begin()
+            try:
+                self.connection.executemany(self.upsert, rows)
+                self.connection.commit()
+                return len(rows)
+            except self.errors as error:
+                self.connection.rollback()
+                print(f"Batch insert of {len(rows)} rows failed ({error}), retrying row by row")
+            written = 0
+            for row in rows:
+                try:
+                    self.connection.execute(self.upsert, row)
+                    written += 1
+                except self.errors as error:
+                    print(f"Failed to insert record into bus_routes table: {error} ({row[0]}, {row[2]})")
+            self.connection.commit()
+            return written
+
+    def begin(self):
+        pass
+
+
+class SQLiteStorage(EmbeddedStorage):
+
+    name = 'sqlite'
+    errors = (sqlite3.Error,)
+    create_statements = [
+        """CREATE TABLE IF NOT EXISTS crawl_runs (
+  id INTEGER PRIMARY KEY,
+  engine TEXT NOT NULL,
+  label TEXT,
+  started_at TEXT NOT NULL,
+  finished_at TEXT
+)""",
+        """CREATE TABLE IF NOT EXISTS bus_routes (
+  route_name TEXT NOT NULL,
+  route_link TEXT NOT NULL,
+  busname TEXT NOT NULL,
+  bustype TEXT NOT NULL,
+  departing_time TEXT NOT NULL,
+  duration TEXT NOT NULL,
+  reaching_time TEXT NOT NULL,
+  star_rating REAL NOT NULL,
+  price REAL NOT NULL,
+  seats_available INTEGER NOT NULL,
+  crawl_run_id INTEGER,
+  UNIQUE (route_name, busname, bustype, departing_time)
+)""",
+        "CREATE INDEX IF NOT EXISTS idx_departing ON bus_routes (departing_time)",
+    ]
+
+    def connect(self, read_only):
+        if read_only:
+            return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode = WAL")
+        return connection
+
+    def value(self, value):
+        # Times are stored as 'YYYY-MM-DD HH:MM:SS' text, which sorts and
+        # compares like the times themselves
+        if isinstance(value, datetime):
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        if isinstance(value, date):
+            return value.isoformat()
+        return value
+
+    def filter_options(self):
+        options = super().filter_options()
+        for key in ('min_departing', 'max_departing'):
+            if options[key] is not None:
+                options[key] = datetime.fromisoformat(options[key])
+        return options
+
+    def fetch(self, query, params=()):
+        frame = super().fetch(query, params)
+        for column in ('departing_time', 'reaching_time'):
+            if column in frame:
+                frame[column] = pd.to_datetime(frame[column])
+        return frame
+
+
+class DuckDBStorage(EmbeddedStorage):
+
+    name = 'duckdb'
+    create_statements = [
+        "CREATE SEQUENCE IF NOT EXISTS crawl_run_ids",
+        """CREATE TABLE IF NOT EXISTS crawl_runs (
+  id INTEGER PRIMARY KEY DEFAULT nextval('crawl_run_ids'),
+  engine VARCHAR NOT NULL,
+  label VARCHAR,
+  started_at TIMESTAMP NOT NULL,
+  finished_at TIMESTAMP
+)""",
+        """CREATE TABLE IF NOT EXISTS bus_routes (
+  route_name VARCHAR NOT NULL,
+  route_link VARCHAR NOT NULL,
+  busname VARCHAR NOT NULL,
+  bustype VARCHAR NOT NULL,
+  departing_time TIMESTAMP NOT NULL,
+  duration VARCHAR NOT NULL,
+  reaching_time TIMESTAMP NOT NULL,
+  star_rating FLOAT NOT NULL,
+  price DECIMAL(10, 2) NOT NULL,
+  seats_available INTEGER NOT NULL,
+  crawl_run_id INTEGER,
+  UNIQUE (route_name, busname, bustype, departing_time)
+)""",
+    ]
+
+    def __init__(self, path=None, read_only=False):
+        if duckdb is None:
+            raise ImportError("The duckdb backend needs duckdb (pip install duckdb)")
+        self.errors = (duckdb.Error,)
+        super().__init__(path, read_only)
+
+    def connect(self, read_only):
+        return duckdb.connect(self.path, read_only=read_only)
+
+    def begin(self):
+        self.connection.begin()
+
+    def write_rows(self, rows):
+        # executemany runs the upsert once per row, a few hundred rows/s; a
+        # batch goes in as one INSERT ... SELECT over a registered frame
+        # instead. DuckDB won't update the same key twice in one statement,
+        # so the batch is deduplicated first, the last row winning as it
+        # would row by row.
+        if pd is None:
+            return super().write_rows(rows)
+        latest = {}
+        for row in rows:
+            latest[tuple(row[COLUMNS.index(column)] for column in KEY_COLUMNS)] = row
+        batch = pd.DataFrame(list(latest.values()), columns=list(COLUMNS))
+        batch['crawl_run_id'] = pd.Series([self.crawl_run_id] * len(batch), dtype='Int64')
+        with self.lock:
+            self.begin()
+            try:
+                self.connection.register('batch', batch)
+                self.connection.execute(self.upsert.replace(
+                    f"VALUES ({', '.join(['?'] * (len(COLUMNS) + 1))})", "SELECT * FROM batch"))
+                self.connection.commit()
+                return len(rows)
+            except self.errors as error:
+                self.connection.rollback()
+                print(f"Batch upsert of {len(rows)} rows failed ({error}), falling back to executemany")
+            finally:
+                self.connection.unregister('batch')
+        return super().write_rows(rows)
+
+    def fetch(self, query, params=()):
+        # Columnar straight into pandas, no per-row Python objects
+        query, params = self.prepare(query, params)
+        with self.lock:
+            return self.connection.execute(query, params).df()
+
+
+class LakeStorage(DuckDBStorage):
+    # The Parquet lake through an in-memory DuckDB view with the bus_routes
+    # columns (lake.LAKE_VIEW); trips are written by `crawler.lake export`
+
+    name = 'lake'
+
+    def __init__(self, path=None, read_only=True):
+        if duckdb is None:
+            raise ImportError("The lake backend needs duckdb (pip install duckdb)")
+        self.errors = (duckdb.Error,)
+        self.path = path or LAKE_PATH or DEFAULT_PATHS[self.name]
+        if not glob.glob(lake_files(self.path)):
+            raise ValueError(f"No Parquet files in the lake at {self.path}; run `python -m crawler.lake export`")
+        self.lock = threading.RLock()
+        self.crawl_run_id = None
+        self.connection = duckdb.connect()
+        self.connection.execute(LAKE_VIEW.format(files=lake_files(self.path).replace("'", "''")))
+
+    def start_run(self, engine, label=None):
+        raise ValueError("The lake is read-only; export crawl runs into it with `python -m crawler.lake export`")
+
+    def write_rows(self, rows):
+        raise ValueError("The lake is read-only; export crawl runs into it with `python -m crawler.lake export`")
+
+    def filter_query(self, **filters):
+        # The date range again on onward, the partition column, so only the
+        # chosen days are read; trips depart on their onward date
+        query, params = build_filter_query(**filters)
+        date_range = filters.get('date_range')
+        if date_range:
+            query += " AND onward BETWEEN %s AND %s"
+            params.extend([as_day(date_range[0]), as_day(date_range[-1])])
+        return f"SELECT {', '.join(COLUMNS)} FROM ({query}) lake", params
+
+
+BACKENDS = {'mysql': MySQLStorage, 'sqlite': SQLiteStorage, 'duckdb': DuckDBStorage, 'lake': LakeStorage}
+
+
+def get_storage(backend=None, path=None, read_only=False):
+    # One store per backend and path, per process
+    backend = backend or STORAGE_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend {backend!r}; choose from {', '.join(BACKENDS)}")
+    path = path or (STORAGE_PATH if backend == STORAGE_BACKEND else None)
+    key = (backend, path, read_only)
+    with stores_lock:
+        if key not in stores:
+            stores[key] = BACKENDS[backend](path, read_only)
+        return stores[key]
+
+
+def copy_trips(source, target, batch_size=DB_BATCH_SIZE):
+    # Every trip in source upserted into target, as an 'import' crawl run there
+    target.start_run('import', f"copy from {source.name}")
+    copied = 0
+    for rows in source.iter_rows(batch_size):
+        copied += target.write_rows(rows)
+    target.finish_run()
+    print(f"Copied {copied} trips from {source.name} to {target.name}")
+    return copied
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Copy trips between storage backends")
+    parser.add_argument('command', choices=['copy'])
+    parser.add_argument('--source', choices=list(BACKENDS), default=STORAGE_BACKEND)
+    parser.add_argument('--source-path')
+    parser.add_argument('--target', choices=[name for name in BACKENDS if name != 'lake'], required=True)
+    parser.add_argument('--target-path')
+    args = parser.parse_args()
+
+    copy_trips(get_storage(args.source, args.source_path, read_only=True),
+               get_storage(args.target, args.target_path))
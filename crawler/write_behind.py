@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+from crawler.config import DB_BATCH_SIZE, WRITE_BEHIND_QUEUE, WRITE_BEHIND_WRITERS, JOURNAL_PATH, DEAD_LETTER_PATH
+from crawler.normalize import parse_rows
+from crawler.storage import get_storage
+
+# Producer/consumer hand-off between extraction and the database. Crawl
+# threads put() a route's trips on a bounded queue and go straight back to
+# the browser; writer threads drain the queue in batches. While the
+# database is unreachable, batches are appended to a journal file instead,
+# and the journal is replayed once a write goes through again. A batch that
+# fails for any other reason (a deadlock, a value too long for its column)
+# is retried one trip at a time, and only the trips that still fail go to a
+# dead-letter file, so one bad trip neither holds back the rest nor sits in
+# the journal forever, and a writer thread never dies and leaves put()
+# blocked on a full queue.
+
+STOP = object()
+RETRY_INTERVAL = 15   # seconds between attempts while the database is down
+
+
+class Journal:
+    # Append-only JSON-lines file of bus dicts waiting for the database,
+    # or, as the dead-letter file, rejected by it
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self.replay_path = path + '.replay'
+        self.lock = threading.Lock()
+
+    def append(self, buses):
+        if not buses:
+            return
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for bus_details in buses:
+                    f.write(json.dumps(bus_details) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def pending(self):
+        return os.path.exists(self.path) or os.path.exists(self.replay_path)
+
+    def take(self):
+        # Moves the journal aside and returns its trips. A replay file left by
+        # an interrupted run is picked up first; call done() once written.
+        with self.lock:
+            if not os.path.exists(self.replay_path):
+                if not os.path.exists(self.path):
+                    return []
+                os.replace(self.path, self.replay_path)
+            with open(self.replay_path, encoding='utf-8') as f:
+                return [json.loads(line) for line in f if line.strip()]
+
+    def done(self):
+        with self.lock:
+            if os.path.exists(self.replay_path):
+                os.remove(self.replay_path)
+
+
+class WriteBehind:
+
+    def __init__(self, writers=WRITE_BEHIND_WRITERS, max_queue=WRITE_BEHIND_QUEUE, batch_size=DB_BATCH_SIZE,
+                 journal_path=JOURNAL_PATH, retry_interval=RETRY_INTERVAL, dead_letter_path=DEAD_LETTER_PATH):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.storage = get_storage()
+        self.batch_size = batch_size
+        self.journal = Journal(journal_path)
+        self.dead_letter = Journal(dead_letter_path)
+        self.retry_interval = retry_interval
+        self.retry_at = 0          # database considered down until this time
+        self.replay_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.stats = {'queued': 0, 'written': 0, 'skipped': 0, 'journaled': 0, 'replayed': 0, 'dead': 0}
+        self.threads = [threading.Thread(target=self.writer_loop, name=f"db-writer-{i}", daemon=True)
+                        for i in range(writers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def put(self, buses):
+        # Blocks only when the queue is full, i.e. the writers are far behind
+        for bus_details in buses:
+            self.queue.put(bus_details)
+        self.count('queued', len(buses))
+
+    def close(self):
+        # Drains the queue, then stops the writers
+        for _ in self.threads:
+            self.queue.put(STOP)
+        for thread in self.threads:
+            thread.join()
+        if self.journal.pending() and self.database_up():
+            self.replay()
+        print(f"Write-behind: {self.stats}")
+        if self.journal.pending():
+            print(f"Trips still journaled in {self.journal.path}; "
+                  f"replay with `python -m crawler.write_behind replay`")
+        if self.stats['dead']:
+            print(f"{self.stats['dead']} trips the database rejected are in {self.dead_letter.path}")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def count(self, key, n):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    def database_up(self):
+        return time.time() >= self.retry_at
+
+    def next_batch(self):
+        # Up to batch_size trips; (batch, stop)
+        try:
+            item = self.queue.get(timeout=1)
+        except queue.Empty:
+            return [], False
+        batch = []
+        while item is not STOP:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, False
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return batch, False
+        return batch, True
+
+    def writer_loop(self):
+        while True:
+            batch, stop = self.next_batch()
+            if batch:
+                self.write(batch)
+            elif self.journal.pending() and self.database_up():
+                self.replay()
+            if stop:
+                return
+
+    def write(self, batch):
+        if not self.database_up():
+            self.journal.append(batch)
+            self.count('journaled', len(batch))
+            return
+        rest = self.write_batch(batch, 'written')
+        if rest:
+            self.journal.append(rest)
+            self.count('journaled', len(rest))
+        elif self.journal.pending():
+            self.replay()
+
+    def write_batch(self, batch, key):
+        # Writes a batch, one trip at a time if the batch as a whole fails
+        # for a reason other than the connection. Returns the trips left
+        # unwritten because the database went away, for the journal.
+        try:
+            self.write_buses(batch, key)
+            return []
+        except Exception as error:
+            if self.storage.is_connection_error(error):
+                self.unavailable(error)
+                return batch
+            print(f"Write of {len(batch)} trips failed ({type(error).__name__}: {error}); retrying one at a time")
+        for i, bus_details in enumerate(batch):
+            try:
+                self.write_buses([bus_details], key)
+            except Exception as error:
+                if self.storage.is_connection_error(error):
+                    self.unavailable(error)
+                    return batch[i:]
+                print(f"Rejected {bus_details.get('bus_route_name')} {bus_details.get('bus_name')} "
+                      f"({type(error).__name__}: {error}); writing it to {self.dead_letter.path}")
+                self.dead_letter.append([bus_details])
+                self.count('dead', 1)
+        return []
+
+    def unavailable(self, error):
+        self.retry_at = time.time() + self.retry_interval
+        print(f"Database unavailable ({error}); journaling trips to {self.journal.path}")
+
+    def write_buses(self, buses, key):
+        rows = parse_rows(buses)
+        written = self.storage.write_rows(rows) if rows else 0
+        self.count(key, written)
+        self.count('skipped', len(buses) - written)
+
+    def replay(self):
+        # One writer replays at a time; the others keep draining the queue
+        if not self.replay_lock.acquire(blocking=False):
+            return
+        try:
+            buses = self.journal.take()
+            for start in range(0, len(buses), self.batch_size):
+                rest = self.write_batch(buses[start:start + self.batch_size], 'replayed')
+                if rest:
+                    self.journal.append(rest + buses[start + self.batch_size:])
+                    break
+            self.journal.done()
+        finally:
+            self.replay_lock.release()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay trips journaled while the database was down")
+    parser.add_argument('command', choices=['replay', 'status'])
+    parser.add_argument('--journal', default=JOURNAL_PATH)
+    args = parser.parse_args()
+
+    journal = Journal(args.journal)
+    if args.command == 'status':
+        count = 0
+        for path in (journal.path, journal.replay_path):
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    count += sum(1 for line in f if line.strip())
+        print(f"{count} trips journaled in {args.journal}")
+    else:
+        writer = WriteBehind(writers=0, journal_path=args.journal, retry_interval=0)
+        writer.replay()
+        print(f"Replayed {writer.stats['replayed']} trips, skipped {writer.stats['skipped']}, "
+              f"rejected {writer.stats['dead']}")
@@ -0,0 +1,21 @@
+import os
+import threading
+
+import pytest
+
+# Search responses as `--record-api` saves them
+RECORDED = os.path.join(os.path.dirname(__file__), 'fixtures', 'search')
+
+
+@pytest.fixture
+def replay_url():
+    # replay_server serving the recorded responses on a free port
+    pytest.importorskip('selenium')
+    from crawler.replay_server import make_server
+
+    server = make_server(RECORDED, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
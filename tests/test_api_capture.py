@@ -0,0 +1,87 @@
+import glob
+import json
+import os
+
+import pytest
+
+pytest.importorskip('selenium')
+
+from crawler import api_capture  # noqa: E402
+from crawler.catalog import load_routes  # noqa: E402
+from crawler.http_engine import trips_from_payloads  # noqa: E402
+
+# Search responses as `--record-api` saves them, two pages of one route
+RECORDED = os.path.join(os.path.dirname(__file__), 'fixtures', 'search')
+ROUTE = 'bettiah-to-patna'
+ONWARD = '29-Jul-2024'
+
+
+def recorded_pages():
+    pages = []
+    for path in sorted(glob.glob(os.path.join(RECORDED, f"{ROUTE}_{ONWARD}_*.json"))):
+        with open(path, encoding='utf-8') as f:
+            pages.append(json.load(f))
+    return pages
+
+
+def test_parse_recorded_response():
+    records = api_capture.parse_search_response(recorded_pages()[0])
+    assert records[0] == {
+        'bus_name': 'Shree Shyam Travels', 'bus_type': 'A/C Sleeper (2+1)', 'departure_time': '20:30',
+        'arrival_time': '04:45', 'duration': '08h 15m', 'ticket_fare': 'INR 750',
+        'seats_availability': '23 Seats available', 'rating': '4.3', 'next_day': '30-Jul',
+    }
+    # Cheapest of the fare list; duration from the timestamps; unrated
+    assert records[1]['ticket_fare'] == 'INR 420.5'
+    assert records[2]['duration'] == '08h 10m'
+    assert records[2]['rating'] == 'New'
+
+
+def test_bad_seat_counts_reject_only_their_trip():
+    records = [record for page in recorded_pages() for record in api_capture.parse_search_response(page)]
+    assert [record['seats_availability'] for record in records] == [
+        '23 Seats available', None, '17 Seats available', None, '9 Seats available']
+
+    route, = [route for route in load_routes() if route['slug'] == ROUTE]
+    buses = trips_from_payloads(route, ONWARD, recorded_pages())
+    assert [bus['bus_name'] for bus in buses] == ['Shree Shyam Travels', 'Gupta Travels', 'Patna Express']
+
+
+class RecordedDriver:
+    # Performance log and getResponseBody for recorded responses; each page
+    # shows up in the log after the previous one has been read
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.logged = 0
+
+    def get_log(self, kind):
+        if self.logged == len(self.pages):
+            return []
+        request_id = str(self.logged)
+        self.logged += 1
+        url = f"https://www.redbus.in/search/SearchV4Results?fromCity=82458&toCity=74699&page={request_id}"
+        return [{'message': json.dumps({'message': message})} for message in (
+            {'method': 'Network.responseReceived', 'params': {'requestId': request_id, 'response': {'url': url}}},
+            {'method': 'Network.loadingFinished', 'params': {'requestId': request_id}},
+        )]
+
+    def execute_cdp_cmd(self, command, params):
+        return {'body': json.dumps(self.pages[int(params['requestId'])]), 'base64Encoded': False}
+
+
+def test_every_search_response_is_read_once():
+    pages = recorded_pages()
+    driver = RecordedDriver(pages)
+    messages, read = [], set()
+    assert api_capture.wait_for_search_payloads(driver, messages, timeout=1, poll=0, read=read) == pages[:1]
+    assert api_capture.wait_for_search_payloads(driver, messages, timeout=1, poll=0, read=read) == pages[1:]
+    assert api_capture.wait_for_search_payloads(driver, messages, timeout=0, poll=0, read=read) == []
+
+
+def test_trips_from_every_page(monkeypatch):
+    monkeypatch.setattr(api_capture, 'scroll_and_load', lambda driver: None)
+    route, = [route for route in load_routes() if route['slug'] == ROUTE]
+    buses = api_capture.extract_buses_from_api(RecordedDriver(recorded_pages()), route, route['route_name'],
+                                               'https://www.redbus.in/bus-tickets/bettiah-to-patna', ONWARD, [])
+    assert len(buses) == 3
@@ -0,0 +1,89 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip('selenium')
+pytest.importorskip('httpx')
+
+from crawler import http_engine, write_behind  # noqa: E402
+from crawler.catalog import load_routes  # noqa: E402
+from crawler.replay_server import stand_in_seed  # noqa: E402
+from crawler.storage import SQLiteStorage  # noqa: E402
+
+ONWARD = '29-Jul-2024'
+SHORT_IDS = {'from_city_id': '1', 'to_city_id': '12'}
+
+
+def test_template_swaps_whole_query_fields():
+    request = {'method': 'GET', 'url': 'https://www.redbus.in/search/SearchV4Results'
+                                       '?fromCity=1&toCity=12&DOJ=29-Jul-2024&limit=100&offset=10&f={}'}
+    template = http_engine.make_template(request, SHORT_IDS, ONWARD)
+    assert template['url'] == ('https://www.redbus.in/search/SearchV4Results'
+                               '?fromCity={from_city_id}&toCity={to_city_id}&DOJ={onward}'
+                               '&limit=100&offset={offset}&f={{}}')
+    assert (template['paging'], template['first_page']) == ('offset', 10)
+
+    route = {'from_city_id': '82458', 'to_city_id': '74699'}
+    method, url, post_data = http_engine.build_request({'template': template}, route, '30-Jul-2024', page=1, offset=100)
+    assert url.endswith('?fromCity=82458&toCity=74699&DOJ=30-Jul-2024&limit=100&offset=110&f={}')
+    assert post_data is None
+
+
+def test_template_swaps_json_fields():
+    request = {'method': 'POST', 'url': 'https://www.redbus.in/search/SearchV4Results',
+               'postData': '{"fromCity": 1, "toCity": "12", "doj": "29-Jul-2024", '
+                           '"meta": {"pageSize": 20, "pageNo": 1}}'}
+    template = http_engine.make_template(request, SHORT_IDS, ONWARD)
+
+    route = {'from_city_id': '82458', 'to_city_id': '74699'}
+    _, _, post_data = http_engine.build_request({'template': template}, route, '30-Jul-2024', page=2, offset=40)
+    assert post_data == '{"fromCity":82458,"toCity":"74699","doj":"30-Jul-2024","meta":{"pageSize":20,"pageNo":3}}'
+
+
+def test_template_needs_one_field_per_placeholder():
+    request = {'url': 'https://www.redbus.in/search/SearchV4Results?fromCity=1&toCity=12&DOJ=2024-07-29'}
+    with pytest.raises(ValueError, match='no field holding onward'):
+        http_engine.make_template(request, SHORT_IDS, ONWARD)
+
+    request = {'url': 'https://www.redbus.in/search/SearchV4Results?fromCity=1&toCity=12&DOJ=29-Jul-2024&limit=12'}
+    with pytest.raises(ValueError, match='several fields holding to_city_id'):
+        http_engine.make_template(request, SHORT_IDS, ONWARD)
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    storage = SQLiteStorage(str(tmp_path / 'redbus.sqlite3'))
+    monkeypatch.setattr(http_engine, 'get_storage', lambda: storage)
+    monkeypatch.setattr(write_behind, 'get_storage', lambda: storage)
+    return storage
+
+
+def stored(storage):
+    connection = sqlite3.connect(storage.path)
+    try:
+        buses = [row[0] for row in connection.execute("SELECT busname FROM bus_routes ORDER BY busname")]
+        runs = connection.execute("SELECT engine, finished_at IS NOT NULL FROM crawl_runs").fetchall()
+        return buses, runs
+    finally:
+        connection.close()
+
+
+def test_run_against_replay_server(replay_url, storage):
+    routes = [route for route in load_routes() if route['slug'] == 'bettiah-to-patna']
+    fetched, failed = http_engine.run(routes, stand_in_seed(), onwards=[ONWARD, '30-Jul-2024'], workers=2,
+                                      base_url=replay_url)
+    # 30-Jul has no recording, so the server answers 404
+    assert fetched == 1
+    assert failed == ['Bettiah to Patna (Bihar) (private) 30-Jul-2024']
+    # Both recorded pages, minus the two trips with no seat count
+    assert stored(storage) == (['Gupta Travels', 'Patna Express', 'Shree Shyam Travels'], [('http', 1)])
+
+
+def test_run_finishes_when_the_client_fails(storage, monkeypatch):
+    def make_client(seed, workers):
+        raise OSError('no route to host')
+
+    monkeypatch.setattr(http_engine, 'make_client', make_client)
+    with pytest.raises(OSError):
+        http_engine.run(load_routes()[:1], stand_in_seed())
+    assert stored(storage) == ([], [('http', 1)])
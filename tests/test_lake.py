@@ -0,0 +1,38 @@
+import glob
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('pyarrow')
+pytest.importorskip('pandas')
+
+from crawler import lake  # noqa: E402
+from crawler.storage import SQLiteStorage  # noqa: E402
+
+
+def trip(departing_time, price):
+    return ('Kochi to Bangalore', 'https://www.redbus.in/bus-tickets/kochi-to-bangalore', 'KSRTC - 1234',
+            'Non AC Seater', departing_time, '09h 30m', departing_time + timedelta(hours=9, minutes=30), 4.1,
+            price, 12)
+
+
+def test_export_again_replaces_the_runs_files(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'redbus.sqlite3'))
+    path = str(tmp_path / 'lake')
+    corporations = {'Kochi to Bangalore': 'KSRTC'}
+    run_id = storage.start_run('test')
+    storage.write_rows([trip(datetime(2024, 7, 29, 21, 0), 650.0), trip(datetime(2024, 7, 30, 21, 0), 1500000.0)])
+    assert lake.export_run(storage, run_id, path, corporations) == 2
+
+    # The second trip moves to the first day; its old partition must go
+    with storage.cursor() as cursor:
+        cursor.execute("DELETE FROM bus_routes WHERE departing_time > '2024-07-30'")
+    storage.connection.commit()
+    storage.write_rows([trip(datetime(2024, 7, 29, 6, 0), 1500000.0)])
+    assert lake.export_run(storage, run_id, path, corporations) == 2
+
+    assert [os.path.relpath(name, path) for name in glob.glob(lake.lake_files(path))] == [
+        os.path.join('corporation=KSRTC', 'onward=2024-07-29', f'crawl_run={run_id}', f'run-{run_id}-0.parquet')]
+    frame = lake.scan(path)
+    assert sorted(float(price) for price in frame['price']) == [650.0, 1500000.0]
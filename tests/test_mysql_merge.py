@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+from crawler.config import db_config
+from crawler.normalize import parse_rows
+from crawler.schema import NORMALIZED_TABLES, STAGING_TABLE, create_statement, merge_into_trips
+
+# Runs the normalized merge against a real server. Point
+# REDBUS_TEST_MYSQL_DATABASE at a scratch database (its tables are dropped),
+# reached with the credentials in config.db_config.
+
+DATABASE = os.environ.get('REDBUS_TEST_MYSQL_DATABASE')
+
+pytestmark = pytest.mark.skipif(not DATABASE, reason="set REDBUS_TEST_MYSQL_DATABASE to run the MySQL tests")
+
+
+@pytest.fixture
+def cursor():
+    mysql = pytest.importorskip('mysql.connector')
+    connection = mysql.connect(**{**db_config, 'database': DATABASE})
+    cursor = connection.cursor()
+    for table in ('trip_snapshots', 'trips', 'routes', 'operators', 'bus_types', 'crawl_runs'):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    for _, statement in NORMALIZED_TABLES:
+        cursor.execute(create_statement(statement))
+    cursor.execute(STAGING_TABLE)
+    yield cursor
+    cursor.close()
+    connection.close()
+
+
+def bus(bus_name, seats='12', fare='650'):
+    return {
+        'bus_route_name': 'Kochi to Bangalore',
+        'bus_route_link': 'https://www.redbus.in/bus-tickets/kochi-to-bangalore?fromCityId=1&toCityId=12&onward=29-Jul-2024',
+        'bus_name': bus_name, 'bus_type': 'Non AC Seater', 'departure_time': '21:00', 'arrival_time': '06:30',
+        'duration': '09h 30m', 'ticket_fare': f'INR {fare}', 'seats_availability': f'{seats} Seats available',
+        'rating': '4.1', 'arrival_dt': '', 'onward': '29-Jul-2024',
+    }
+
+
+def merge(cursor, buses, crawl_run_id=None):
+    from crawler.db import STAGING_INSERT
+
+    cursor.execute("DELETE FROM bus_routes_staging")
+    cursor.executemany(STAGING_INSERT, parse_rows(buses))
+    return merge_into_trips(cursor, 'bus_routes_staging', crawl_run_id)
+
+
+def test_known_names_take_no_new_ids(cursor):
+    for _ in range(10):
+        merge(cursor, [bus('KSRTC - 1234'), bus('KSRTC - 5678')])
+    merge(cursor, [bus('SETC - 325UD')])
+    cursor.execute("SELECT name, id FROM operators ORDER BY id")
+    operators = cursor.fetchall()
+    assert [name for name, _ in operators] == ['KSRTC', 'SETC']
+    # InnoDB may skip a few values per inserting statement, never one per merge
+    assert operators[-1][1] <= 4
+
+
+def start_run(cursor):
+    cursor.execute("INSERT INTO crawl_runs (engine, started_at) VALUES ('http', NOW())")
+    return cursor.lastrowid
+
+
+def test_same_trip_twice_in_one_run(cursor):
+    from crawler.curves import trip_curves
+
+    first, second = start_run(cursor), start_run(cursor)
+    # The route is listed twice in the catalog, so the run merges the trip twice
+    merge(cursor, [bus('KSRTC - 1234', seats='12', fare='650')], first)
+    merge(cursor, [bus('KSRTC - 1234', seats='10', fare='700')], first)
+    merge(cursor, [bus('KSRTC - 1234', seats='8', fare='700')], second)
+    merge(cursor, [bus('KSRTC - 1234', seats='8', fare='700')], second)
+
+    cursor.execute("SELECT id FROM trips")
+    (trip_id,), = cursor.fetchall()
+    points = trip_curves(cursor, [trip_id])[trip_id]
+    assert [(point['crawl_run_id'], point['seats_available'], point['price']) for point in points] == [
+        (first, 10, 700.0), (second, 8, 700.0)]
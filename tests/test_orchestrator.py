@@ -0,0 +1,64 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from crawler import orchestrator, write_behind
+from crawler.catalog import load_routes
+from crawler.storage import SQLiteStorage
+
+ONWARD = '29-Jul-2024'
+
+
+def test_cancelling_the_run_cancels_its_jobs():
+    async def worker(job):
+        await asyncio.sleep(60)
+
+    async def main():
+        runner = orchestrator.Orchestrator(concurrency=2, rate_per_host=100)
+        jobs = [{'host': 'www.redbus.in', 'label': str(i)} for i in range(2)]
+        task = asyncio.create_task(runner.run(jobs, worker))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return runner
+
+    runner = asyncio.run(main())
+    assert [result['status'] for result in runner.results] == ['cancelled', 'cancelled']
+
+
+def bettiah_to_patna():
+    return [route for route in load_routes() if route['slug'] == 'bettiah-to-patna']
+
+
+def crawl_replay(replay_url, store, settings=None):
+    pytest.importorskip('selenium')
+    pytest.importorskip('httpx')
+    from crawler.replay_server import stand_in_seed
+
+    return asyncio.run(orchestrator.crawl(bettiah_to_patna(), 'http', [ONWARD], rate_per_host=100, settings=settings,
+                                          seed=stand_in_seed(), base_url=replay_url, store=store))
+
+
+def test_no_store_opens_no_storage(replay_url, monkeypatch):
+    def get_storage():
+        raise ImportError('no database driver')
+
+    monkeypatch.setattr(orchestrator, 'get_storage', get_storage)
+    results = crawl_replay(replay_url, store=False)
+    assert [(result['status'], result['buses']) for result in results] == [('ok', 3)]
+
+
+def test_crawl_run_is_labelled(replay_url, tmp_path, monkeypatch):
+    storage = SQLiteStorage(str(tmp_path / 'redbus.sqlite3'))
+    monkeypatch.setattr(orchestrator, 'get_storage', lambda: storage)
+    monkeypatch.setattr(write_behind, 'get_storage', lambda: storage)
+    crawl_replay(replay_url, store=True, settings={'run_id': 'nightly'})
+
+    connection = sqlite3.connect(storage.path)
+    try:
+        assert connection.execute("SELECT engine, label FROM crawl_runs").fetchall() == [('http', 'nightly')]
+        assert connection.execute("SELECT COUNT(*) FROM bus_routes").fetchone() == (3,)
+    finally:
+        connection.close()
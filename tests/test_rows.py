@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pytest
+
+from crawler import normalize
+from crawler.rows import parse_bus_details
+
+
+def bus(onward, departure, arrival, duration, arrival_dt=''):
+    return {
+        'bus_route_name': 'Kochi to Bangalore', 'bus_route_link': 'https://www.redbus.in/bus-tickets/kochi-to-bangalore',
+        'bus_name': 'KSRTC - 1234', 'bus_type': 'Non AC Seater', 'departure_time': departure, 'arrival_time': arrival,
+        'duration': duration, 'ticket_fare': 'INR 650', 'seats_availability': '12 Seats available', 'rating': '4.1',
+        'arrival_dt': arrival_dt, 'onward': onward,
+    }
+
+
+# (bus, expected reaching_time)
+ARRIVALS = [
+    (bus('29-Jul-2024', '09:00', '13:10', '04h 10m'), datetime(2024, 7, 29, 13, 10)),
+    (bus('29-Jul-2024', '21:00', '06:30', '09h 30m', '30-Jul '), datetime(2024, 7, 30, 6, 30)),
+    # Label written with the onward year by older scraper output
+    (bus('31-Dec-2024', '22:00', '06:00', '08h 00m', '01-Jan-2024 '), datetime(2025, 1, 1, 6, 0)),
+    (bus('31-Dec-2024', '22:00', '06:00', '', '01-Jan '), datetime(2025, 1, 1, 6, 0)),
+    # Over 24 hours: the label only says "not today"
+    (bus('29-Jul-2024', '18:00', '08:00', '38h 00m', '30-Jul '), datetime(2024, 7, 31, 8, 0)),
+    (bus('29-Jul-2024', '23:30', '01:15', ''), datetime(2024, 7, 30, 1, 15)),
+    (bus('29-Jul-2024', '23:30', '', '02h 00m'), datetime(2024, 7, 30, 1, 30)),
+]
+
+
+@pytest.mark.parametrize('details, expected', ARRIVALS)
+def test_arrival_one_bus_at_a_time(details, expected):
+    assert parse_bus_details(details)[6] == expected
+
+
+def test_batch_and_fallback_paths_agree(monkeypatch):
+    buses = [details for details, _ in ARRIVALS]
+    batch = normalize.parse_rows(buses)
+    monkeypatch.setattr(normalize, 'pd', None)
+    assert normalize.parse_rows(buses) == batch
+    assert [row[6] for row in batch] == [expected for _, expected in ARRIVALS]
+
+
+def test_fallback_skips_a_bus_without_arrival_or_duration(monkeypatch):
+    monkeypatch.setattr(normalize, 'pd', None)
+    rows = normalize.parse_rows([bus('29-Jul-2024', '09:00', '', ''), ARRIVALS[0][0]])
+    assert [row[6] for row in rows] == [ARRIVALS[0][1]]
+
+
+def test_batch_report_counts_bad_values_per_column(capsys):
+    buses = [dict(ARRIVALS[0][0], rating='-'), dict(ARRIVALS[0][0], rating='-', ticket_fare='INR ?')]
+    rows = normalize.parse_rows(buses)
+    assert [row[7] for row in rows] == [0.0]
+    assert capsys.readouterr().out.strip() == (
+        "Kochi to Bangalore: 1 of 2 buses stored, bad values: price 1 ('INR ?'); star_rating 2 ('-')")
+
+
+@pytest.mark.parametrize('batch', [True, False])
+def test_values_too_long_for_the_tables_reject_only_their_bus(batch, monkeypatch, capsys):
+    if not batch:
+        monkeypatch.setattr(normalize, 'pd', None)
+    buses = [bus('29-Jul-2024', f"{hour:02d}:00", f"{hour + 1:02d}:00", '01h 00m') for hour in range(4)]
+    buses[1]['bus_name'] = 'KSRTC - 1234567890ABCDEFG'        # 17-character service number
+    buses[2]['bus_type'] = 'A/C Sleeper ' * 13
+    rows = normalize.parse_rows(buses)
+    assert [row[4].hour for row in rows] == [0, 3]
+    if batch:
+        assert '2 of 4 buses stored, bad values: busname 1' in capsys.readouterr().out
@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+# The embedded backends, the lake and the dump importer must load and write
+# without mysql-connector; sys.modules['mysql'] = None makes any import of it fail.
+
+SCRIPT = """
+import sys
+sys.modules['mysql'] = None
+
+from datetime import datetime
+
+import crawler.dump_import
+import crawler.lake
+from crawler.normalize import parse_rows
+from crawler.storage import get_storage
+
+row = parse_rows([{{
+    'bus_route_name': 'Kochi to Bangalore', 'bus_route_link': 'https://www.redbus.in/bus-tickets/kochi-to-bangalore',
+    'bus_name': 'KSRTC - 1234', 'bus_type': 'Non AC Seater', 'departure_time': '21:00', 'arrival_time': '06:30',
+    'duration': '09h 30m', 'ticket_fare': 'INR 650', 'seats_availability': '12 Seats available',
+    'rating': '4.1', 'arrival_dt': '', 'onward': '29-Jul-2024'}}])
+storage = get_storage('sqlite', {path!r})
+storage.start_run('test')
+assert storage.write_rows(row) == 1
+storage.finish_run()
+assert storage.filter_trips()['reaching_time'][0] == datetime(2024, 7, 30, 6, 30)
+"""
+
+
+def test_embedded_backends_load_without_mysql(tmp_path):
+    script = textwrap.dedent(SCRIPT).format(path=str(tmp_path / 'redbus.sqlite3'))
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,99 @@
+import pytest
+
+from crawler import write_behind
+from crawler.storage import SQLiteStorage
+
+
+class FlakyStorage(SQLiteStorage):
+    # Fails the first `failures` writes, with a connection error if `down`
+
+    def __init__(self, path, failures, down=False):
+        super().__init__(path)
+        self.failures = failures
+        self.down = down
+
+    def write_rows(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise (ConnectionError('Lost connection') if self.down else
+                   RuntimeError('Deadlock found when trying to get lock'))
+        return super().write_rows(rows)
+
+    def is_connection_error(self, error):
+        return isinstance(error, ConnectionError)
+
+
+class StrictStorage(SQLiteStorage):
+    # Rejects any write holding an over-long bus name, as a strict-mode
+    # MySQL multi-row insert does
+
+    def write_rows(self, rows):
+        if any(len(row[2]) > 20 for row in rows):
+            raise RuntimeError("Data too long for column 'busname'")
+        return super().write_rows(rows)
+
+
+def buses(count, bus_name='KSRTC - 1234'):
+    return [{
+        'bus_route_name': 'Kochi to Bangalore', 'bus_route_link': 'https://www.redbus.in/bus-tickets/kochi-to-bangalore',
+        'bus_name': bus_name, 'bus_type': 'Non AC Seater', 'departure_time': f"{hour:02d}:00",
+        'arrival_time': f"{hour:02d}:30", 'duration': '00h 30m', 'ticket_fare': 'INR 650',
+        'seats_availability': '12 Seats available', 'rating': '4.1', 'arrival_dt': '', 'onward': '29-Jul-2024',
+    } for hour in range(count)]
+
+
+def make_writer(storage, tmp_path, monkeypatch, retry_interval):
+    monkeypatch.setattr(write_behind, 'get_storage', lambda: storage)
+    return write_behind.WriteBehind(writers=1, max_queue=2, batch_size=4, retry_interval=retry_interval,
+                                    journal_path=str(tmp_path / 'journal.jsonl'),
+                                    dead_letter_path=str(tmp_path / 'dead.jsonl'))
+
+
+def test_a_failed_batch_is_retried_and_the_writer_keeps_going(tmp_path, monkeypatch):
+    storage = FlakyStorage(str(tmp_path / 'redbus.sqlite3'), failures=1)
+    writer = make_writer(storage, tmp_path, monkeypatch, retry_interval=60)
+    with writer:
+        # More trips than the queue holds: put() only returns if the writer survived the failure
+        writer.put(buses(6))
+    assert writer.stats['written'] == 6
+    assert writer.stats['journaled'] == writer.stats['dead'] == 0
+    assert len(storage.filter_trips()) == 6
+
+
+def test_a_rejected_trip_goes_to_the_dead_letter_file(tmp_path, monkeypatch):
+    storage = StrictStorage(str(tmp_path / 'redbus.sqlite3'))
+    writer = make_writer(storage, tmp_path, monkeypatch, retry_interval=60)
+    poison = buses(1, bus_name='KSRTC - 1234 Garuda Plus Volvo Multi-Axle')[0]
+    with writer:
+        writer.put(buses(5))
+        writer.put([poison])
+        writer.put(buses(12)[6:])
+    assert writer.stats['written'] == 11
+    assert writer.stats['dead'] == 1
+    assert writer.stats['journaled'] == 0
+    assert not writer.journal.pending()
+    assert len(storage.filter_trips()) == 11
+    assert write_behind.Journal(writer.dead_letter.path).take() == [poison]
+
+
+def test_batches_are_journaled_while_the_database_is_down(tmp_path, monkeypatch):
+    storage = FlakyStorage(str(tmp_path / 'redbus.sqlite3'), failures=1, down=True)
+    writer = make_writer(storage, tmp_path, monkeypatch, retry_interval=0)
+    with writer:
+        writer.put(buses(6))
+    assert writer.stats['journaled'] > 0
+    assert writer.stats['written'] + writer.stats['replayed'] == 6
+    assert not writer.journal.pending()
+    assert len(storage.filter_trips()) == 6
+
+
+def test_connection_errors_by_errno():
+    errors = pytest.importorskip('mysql.connector.errors')
+    from crawler.db import is_connection_error
+
+    assert is_connection_error(errors.DatabaseError(msg="Can't connect to MySQL server", errno=2003))
+    assert is_connection_error(errors.OperationalError(msg='Lost connection to MySQL server', errno=2013))
+    assert is_connection_error(errors.OperationalError(msg='MySQL Connection not available'))
+    assert not is_connection_error(errors.InternalError(msg='Deadlock found when trying to get lock', errno=1213))
+    assert not is_connection_error(errors.DataError(msg='Out of range value', errno=1264))
+    assert not is_connection_error(ValueError('bad fare'))